@@ -0,0 +1,133 @@
+# Time from cancelling a stream to the server seeing the disconnect.
+#
+#  A local stub server plays a llama.cpp-like slot: it holds each request
+#  in a long "prefill", then sends a recorded stream slowly, watching the
+#  socket the whole time so it notices at once when the client goes away.
+#  A stream is cancelled from the main (UI) thread - as AI Agent Cancel
+#  Stream does - during the prefill and during the stream. Measured:
+#
+#   * server: cancel -> the server sees the socket closed (its slot is free)
+#   * slot:   cancel -> the `_SCHEDULER` slot is released to the next chat
+#
+#  for both "stream_engine" settings.
+#
+#      python bench/bench_cancel.py
+
+import http.server
+import select
+import socket
+import socketserver
+import threading
+import time
+
+import harness
+
+cs = harness.load_plugin()
+
+PREFILL = 5.0    # seconds before the first event
+INTERVAL = 0.5   # seconds between events
+EVENTS = [b"%x\r\n%s\n\n\r\n" % (len(e) + 2, e) for e in harness.load_stream(
+    "llamacpp.sse").split(b"\n\n") if e.strip()]
+
+
+class Slot(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []      # perf_counter() of each request received
+    disconnects = []   # perf_counter() of each disconnect seen
+
+    def log_message(self, *args):
+        pass
+
+    def gone(self, timeout):
+        """Wait up to `timeout` seconds; True once the client closed"""
+        readable, _, _ = select.select([self.connection], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            return not self.connection.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        Slot.requests.append(time.perf_counter())
+        self.close_connection = True
+        if self.gone(PREFILL):
+            Slot.disconnects.append(time.perf_counter())
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in EVENTS:
+            try:
+                self.wfile.write(event)
+                self.wfile.flush()
+            except OSError:
+                break
+            if self.gone(INTERVAL):
+                break
+        Slot.disconnects.append(time.perf_counter())
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def measure(engine, phase):
+    """Cancel a stream in `phase`; return (server ms, slot ms)"""
+    settings = cs.sublime.load_settings("Agentic.sublime-settings")
+    settings.set("stream_engine", engine)
+    released = []
+    release = cs._SCHEDULER.release
+
+    def timed_release(ticket):
+        released.append(time.perf_counter())
+        release(ticket)
+    cs._SCHEDULER.release = timed_release
+
+    view = harness.new_chat(cs.sublime.Window())
+    Slot.requests, Slot.disconnects = [], []
+    cs.start_streaming(view, cs._build_messages_from_text(view.text), "slot")
+    if phase == "prefill":
+        cs.sublime.pump_until(lambda: Slot.requests, 10)
+        time.sleep(0.2)
+    else:
+        cs.sublime.pump_until(lambda: "\n>" in view.text, PREFILL + 10)
+        time.sleep(INTERVAL / 2)  # between two events
+    t0 = time.perf_counter()
+    cs._ACTIVE_STREAMERS[view.id()].cancel()
+    cs.sublime.pump_until(lambda: Slot.disconnects and released, 10)
+    cs.sublime.pump_until(lambda: not cs._FLUSHER._pending, 1)
+    cs._SCHEDULER.release = release
+    ms = lambda t: (t[0] - t0) * 1000 if t else float("NaN")
+    return ms(Slot.disconnects), ms(released)
+
+
+def main():
+    cs.print = lambda *a, **k: None
+
+    server = Server(("127.0.0.1", 0), Slot)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/v1/chat/completions".format(
+        server.server_address[1])
+    settings = cs.sublime.load_settings("Agentic.sublime-settings")
+    models = dict(settings.get("models"))
+    models["slot"] = {"url": url, "model": "slot", "token": "-",
+                      "options": {"stream": True}, "context": 131072,
+                      "cost": 0.0, "speed": 1 / INTERVAL, "workers": 1}
+    settings.set("models", models)
+
+    print("prefill {:.1f}s, {:.1f}s between events".format(PREFILL, INTERVAL))
+    print("{:>8} {:>8} {:>12} {:>12}".format(
+        "engine", "phase", "server ms", "slot ms"))
+    for engine in ("threads", "async"):
+        for phase in ("prefill", "stream"):
+            disconnect, release = measure(engine, phase)
+            print("{:>8} {:>8} {:>12.1f} {:>12.1f}".format(
+                engine, phase, disconnect, release))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Settings snapshot (`_Config`): request bodies and load-time checks.
+#
+#  Builds request bodies through the snapshot's pre-serialized fragments
+#  and checks they are byte-identical to serializing the whole body per
+#  request (as chat_stream.py did before), for every model of the
+#  default settings and a few option variants, then compares the cost
+#  per request of both and of reading a setting. Finally breaks the
+#  settings in a few ways and checks each problem is reported when the
+#  snapshot is rebuilt, before anything streams.
+#
+#      python bench/bench_config.py
+
+import json
+import timeit
+
+import harness
+
+cs = harness.load_plugin()
+
+
+def full_body(messages, model, settings):
+    """The request body serialized in one go"""
+    body = dict(model.get("options", {}))
+    body.update({"messages": messages, "model": model.get("model")})
+    if "include_reasoning" in body and body["include_reasoning"]:
+        body.update({"include_reasoning": settings.get("show_reasoning")})
+    if body.get("stream", False) and "stream_options" not in body \
+            and settings.get("request_usage", True):
+        body["stream_options"] = {"include_usage": True}
+    return json.dumps(body).encode("utf-8")
+
+
+def per_call(func, number=2000):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    cs.print = lambda *a, **k: None
+    settings = cs.sublime.load_settings("Agentic.sublime-settings")
+    models = dict(settings.get("models"))
+    models["bench_plain"] = {"url": "http://127.0.0.1:1/v1", "model": "m",
+                             "speed": 10.0}
+    models["bench_reasoning"] = {
+        "url": "http://127.0.0.1:1/v1", "model": "r", "speed": 10.0,
+        "options": {"stream": True, "include_reasoning": True,
+                    "stream_options": {"include_usage": False},
+                    "extra": ["→", None, 1.5]}}
+    settings.set("models", models)
+    messages = cs._build_messages_from_text(
+        harness.CHAT + "café \"quoted\" \\ →\n" * 200)
+
+    for name, model in sorted(cs._config().models.items()):
+        _, data, _, _ = cs._build_request(messages, model)
+        assert data == full_body(messages, model, settings), \
+            "{}: request body differs".format(name)
+    print("request bodies identical for {} models".format(
+        len(cs._config().models)))
+
+    model = cs._config().models["high_1"]
+    print("{:>30} {:>9}".format("", "us/call"))
+    print("{:>30} {:>9.1f}".format(
+        "body serialized per request",
+        per_call(lambda: full_body(messages, model, settings))))
+    print("{:>30} {:>9.1f}".format(
+        "body from snapshot fragments",
+        per_call(lambda: cs._build_request(messages, model))))
+    print("{:>30} {:>9.2f}".format(
+        "snapshot setting read",
+        per_call(lambda: cs._config().get("show_reasoning"), 100000)))
+
+    good = dict(settings._values)
+    broken = dict(models)
+    broken["no_url"] = {"model": "m", "speed": 1.0, "tokens": "typo"}
+    broken["no_speed"] = {"url": "http://127.0.0.1:1/v1", "model": "m"}
+    settings.set("models", broken)
+    settings.set("models_high", ["high_1", "no_url", "no_speed", "missing"])
+    settings.set("stream_engine", "fibers")
+    errors = cs._config().errors
+    for expected in ('model "no_url": missing "url"',
+                     'model "no_url": unknown key "tokens"',
+                     'model "no_speed": missing "speed"',
+                     '"models_high": unknown model "missing"',
+                     '"stream_engine" must be one of'):
+        assert any(e.startswith(expected) for e in errors), \
+            "not reported: {}".format(expected)
+    assert cs._config().capability("models_high") == ["high_1", "no_speed"]
+    print("{} settings problems reported at load:".format(len(errors)))
+    for error in errors:
+        print("  " + error)
+    settings._values = good
+    settings.set("stream_engine", "async")
+    assert not cs._config().errors
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Requests made by "context_policy": "summarize" over a growing chat.
+#
+#  Submits a chat turn after turn past its model's context budget, with
+#  the "models_low" summary request answered by a stand-in, and counts
+#  the summaries requested. A summary is anchored to the turns it covers,
+#  so it is only extended when the chat overflows again - not redone on
+#  every submit - and resubmitting an unchanged chat requests nothing.
+#  Fitting for a prompt cache warm-up (`cached_only`) never requests one.
+#
+#      python bench/bench_context.py [--turns 12]
+
+import argparse
+import time
+
+import harness
+
+cs = harness.load_plugin()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=12)
+    args = parser.parse_args()
+    cs.print = lambda *a, **k: None
+    settings = cs.sublime.load_settings("Agentic.sublime-settings")
+    settings.set("context_policy", "summarize")
+
+    requests = []
+
+    def summarize(request, model, cancel=None, stats=None):
+        requests.append(request)
+        yield (False, "Summary #{}.".format(len(requests)))
+    cs.chat_stream = summarize
+
+    model = {"url": "-", "model": "chat", "speed": 1.0, "context": 4000}
+    turn = " filler" * 300  # ~480 tokens
+    messages = [{"role": "developer",  # a chat new to the scratch cache
+                 "content": "You are an expert ({}).".format(time.time())}]
+    for n in range(args.turns):
+        messages.append({"role": "user", "content": "Q{}{}".format(n, turn)})
+        before = len(requests)
+        fitted = cs._fit_context(list(messages), model)
+        assert fitted[-1] == messages[-1], "last turn lost"
+        assert cs._context_tokens(fitted) <= model["context"], "over budget"
+        assert len(requests) <= before + 1, "several summaries per submit"
+        assert cs._fit_context(list(messages), model) == fitted
+        assert len(requests) == before + (len(requests) > before), \
+            "unchanged chat summarized again"
+        messages.append({"role": "assistant",
+                         "content": "A{}{}".format(n, turn)})
+    print("{} submits, {} summary requests".format(args.turns, len(requests)))
+
+    before, skipped = len(requests), 0
+    for n in range(args.turns, args.turns + 6):
+        messages.append({"role": "user", "content": "Q{}{}".format(n, turn)})
+        skipped += cs._fit_context(list(messages), model,
+                                   cached_only=True) is None
+        messages.append({"role": "assistant",
+                         "content": "A{}{}".format(n, turn)})
+    assert len(requests) == before, "summary requested for a warm-up"
+    assert skipped, "no warm-up needed a new summary"
+    print("warm-up fitting: no summary requests")
+    assert len(requests) <= args.turns // 2, "summarized on most submits"
+
+
+if __name__ == "__main__":
+    main()
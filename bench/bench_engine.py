@@ -0,0 +1,99 @@
+# CPU use and latency of the two stream engines of chat_stream.py.
+#
+#  Streams a recorded response (served by sse_server.py in its own
+#  process) into 1, 10 and 50 chat views at once, through the real
+#  start_streaming() path, with "stream_engine" set to "threads" (one
+#  blocking thread per stream) and to "async" (one event loop). UI
+#  callbacks run on the main thread (the stub's `pump_until`). Reports the
+#  plugin process' CPU time, time to first token and to completion, and
+#  the peak thread count, after checking every view got the same text.
+#
+#      python bench/bench_engine.py [--rate 500] [--streams 1,10,50]
+
+import argparse
+import threading
+import time
+
+import harness
+
+cs = harness.load_plugin()
+
+
+def run(engine, count):
+    """Stream into `count` views at once; return (records, texts, stats)"""
+    settings = cs.sublime.load_settings("Agentic.sublime-settings")
+    settings.set("stream_engine", engine)
+    window = cs.sublime.Window()
+    views = [harness.new_chat(window) for _ in range(count)]
+    records = {}
+    started = {}
+
+    def done(view):
+        def on_done(record):
+            records[view.id()] = (record, time.perf_counter() - started[view.id()])
+        return on_done
+
+    peak_threads = [0]
+
+    def finished():
+        peak_threads[0] = max(peak_threads[0], threading.active_count())
+        return len(records) == count and not cs._FLUSHER._pending
+
+    cpu, wall = time.process_time(), time.perf_counter()
+    for view in views:
+        started[view.id()] = time.perf_counter()
+        cs.start_streaming(view, cs._build_messages_from_text(view.text),
+                           "bench", on_done=done(view))
+    if not cs.sublime.pump_until(finished, 120):
+        raise RuntimeError("{} x{}: streams did not finish".format(engine, count))
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    return records, [v.text for v in views], (cpu, wall, peak_threads[0])
+
+
+def quantile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=500.0,
+                        help="events/s of each stream")
+    parser.add_argument("--streams", default="1,10,50")
+    args = parser.parse_args()
+
+    cs.print = lambda *a, **k: None  # per-stream console summaries
+
+    server, url = harness.start_server("--rate", args.rate)
+    try:
+        settings = cs.sublime.load_settings("Agentic.sublime-settings")
+        models = dict(settings.get("models"))
+        models["bench"] = {"url": url, "model": "bench", "token": "-",
+                           "options": {"stream": True}, "context": 131072,
+                           "cost": 0.0, "speed": args.rate}
+        settings.set("models", models)
+
+        expected = None
+        print("{:>7} {:>7} {:>8} {:>8} {:>7} {:>10} {:>10} {:>10}".format(
+            "engine", "streams", "cpu s", "wall s", "threads",
+            "ttft p50", "ttft p95", "done p95"))
+        for count in [int(n) for n in args.streams.split(",")]:
+            for engine in ("threads", "async"):
+                run(engine, 1)  # warm up connections and the loop
+                records, texts, (cpu, wall, threads) = run(engine, count)
+                expected = expected or texts[0]
+                assert all(t == expected for t in texts), \
+                    "{} x{}: streamed text differs".format(engine, count)
+                ttft = [r["ttft"] for r, _ in records.values()]
+                total = [t for _, t in records.values()]
+                print("{:>7} {:>7} {:>8.2f} {:>8.2f} {:>7} {:>8.0f}ms "
+                      "{:>8.0f}ms {:>9.2f}s".format(
+                          engine, count, cpu, wall, threads,
+                          quantile(ttft, 0.5) * 1000,
+                          quantile(ttft, 0.95) * 1000, quantile(total, 0.95)))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
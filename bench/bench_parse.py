@@ -0,0 +1,76 @@
+# Chat transcript parsing: full parse vs the incremental parse cache.
+#
+#  First replays a corpus of random edits (typing at the end, edits in
+#  old turns, deleted headers, odd tags) and checks that the cached,
+#  incremental result always equals `_build_messages_from_text` on the
+#  whole buffer. Then times both for chats of 1 KB to 10 MB.
+#
+#      python bench/bench_parse.py
+
+import random
+
+import harness
+
+cs = harness.load_plugin()
+
+SIZES = [1 << 10, 1 << 14, 1 << 17, 1 << 20, 10 << 20]
+SNIPPETS = ["x", "\n", "# --- User ---\n", "\n# --- Agent ---\n",
+            "## --- Thinking ---\n", "## --- Response ---\n",
+            "  # --- System ---  \n", "# --- Other ---\n", " ", ""]
+
+
+def edit(view, cache, rnd):
+    """Apply one random edit and report it like _ChatChangeListener"""
+    size = view.size()
+    if rnd.random() < 0.6:  # most edits happen at the end of the chat
+        begin = max(0, size - rnd.randint(0, 40))
+    else:
+        begin = rnd.randint(0, size)
+    end = min(size, begin + rnd.choice([0, 0, 1, 5, 30]))
+    view.replace(begin, end, rnd.choice(SNIPPETS))
+    cache.mark_dirty(view.buffer_id(), begin, view.change_count())
+
+
+def check_corpus():
+    checked = 0
+    for seed in range(40):
+        rnd = random.Random(seed)
+        view = cs.sublime.View(harness.make_chat(rnd.randint(200, 20000), seed))
+        view.text = rnd.choice(["", "preamble\n", "## --- Thinking ---\n"]) \
+            + view.text
+        cache = cs._ChatParseCache()
+        for _ in range(150):
+            if rnd.random() < 0.1:  # an edit the listener never reported
+                view.count += 1
+            got = cache.messages(view)
+            assert got == cs._build_messages_from_text(view.text), \
+                "seed {}: incremental parse differs".format(seed)
+            checked += 1
+            for _ in range(rnd.randint(1, 3)):
+                edit(view, cache, rnd)
+    print("corpus: {} incremental parses match the full parser".format(checked))
+
+
+def main():
+    check_corpus()
+    for size in SIZES:
+        view = cs.sublime.View(harness.make_chat(size))
+        full = harness.best_of(
+            lambda: cs._build_messages_from_text(view.substr(
+                cs.sublime.Region(0, view.size()))), 3)
+
+        cache = cs._ChatParseCache()
+        cache.messages(view)
+
+        def submit():  # type a few characters, then parse again
+            view.replace(view.size(), view.size(), "more text\n")
+            cache.mark_dirty(view.buffer_id(), view.size() - 10,
+                             view.change_count())
+            cache.messages(view)
+        incremental = harness.best_of(submit, 3)
+        print("{:>9} chars  full {:8.2f} ms  incremental {:7.3f} ms".format(
+            view.size(), full * 1000, incremental * 1000))
+
+
+if __name__ == "__main__":
+    main()
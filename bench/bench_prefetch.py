@@ -0,0 +1,217 @@
+# Prompt cache warm-up ("prefetch") against a llama.cpp-like slot.
+#
+#  A local stub server plays one llama.cpp slot with a prompt cache: a
+#  request's prompt is prefilled at PREFILL_TPS tokens per second past
+#  the prefix it shares with the cached prompt (kept partially when the
+#  client disconnects), then a short answer is streamed with llama.cpp
+#  "timings". A long chat is typed into a view and sent:
+#
+#   * cold     "prefetch" off: the whole history is prefilled on send
+#   * warm     "prefetch" on: the warm-up runs during a typing pause,
+#              the turn is finished and sent right after
+#
+#  and the time to first token and the prefill the plugin reports as
+#  saved are compared. Also checks a warm-up is cancelled (disconnects)
+#  when an earlier turn is edited, and is not sent while the system's
+#  only slot is busy.
+#
+#      python bench/bench_prefetch.py [--tokens 20000]
+
+import argparse
+import http.server
+import json
+import select
+import socket
+import socketserver
+import threading
+import time
+
+import harness
+
+cs = harness.load_plugin()
+
+PREFILL_TPS = 10000.0  # prompt tokens per second
+CHARS_PER_TOKEN = 4
+
+
+class Slot(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    cached = ""         # prompt in the slot's cache
+    requests = []       # (stream, prompt tokens prefilled, cached tokens)
+    disconnects = 0
+
+    def log_message(self, *args):
+        pass
+
+    def gone(self, timeout):
+        readable, _, _ = select.select([self.connection], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            return not self.connection.recv(1, socket.MSG_PEEK)
+        except OSError:
+            return True
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(
+            int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+        prompt = "".join("<{}>{}".format(m["role"], m["content"])
+                         for m in body["messages"])
+        with Slot.lock:
+            common = 0
+            for a, b in zip(prompt, Slot.cached):
+                if a != b:
+                    break
+                common += 1
+            todo = prompt[common:]
+            t0 = time.perf_counter()
+            for i in range(0, len(todo), 4000):  # prefill in batches
+                if self.gone(4000 / CHARS_PER_TOKEN / PREFILL_TPS):
+                    Slot.cached = prompt[:common + i]
+                    Slot.disconnects += 1
+                    self.close_connection = True
+                    return
+            Slot.cached = prompt
+            Slot.requests.append((body.get("stream", False),
+                                  len(todo) // CHARS_PER_TOKEN,
+                                  common // CHARS_PER_TOKEN))
+        timings = {"cache_n": common // CHARS_PER_TOKEN,
+                   "prompt_n": len(todo) // CHARS_PER_TOKEN,
+                   "prompt_per_second": PREFILL_TPS,
+                   "predicted_n": 3, "predicted_per_second": 100.0,
+                   "prompt_ms": (time.perf_counter() - t0) * 1000}
+        if not body.get("stream"):
+            self.reply("application/json", json.dumps({
+                "choices": [{"message": {"content": "ok"}}],
+                "timings": timings}).encode("utf-8"))
+            return
+        events = [{"choices": [{"delta": {"content": t}}]}
+                  for t in ("Sure", ", ", "done.")]
+        events.append({"choices": [{"delta": {}, "finish_reason": "stop"}],
+                       "timings": timings})
+        self.reply("text/event-stream", b"".join(
+            b"data: " + json.dumps(e).encode("utf-8") + b"\n\n"
+            for e in events) + b"data: [DONE]\n\n")
+
+    def reply(self, content_type, data):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def typed(view, at, text):
+    """Insert `text` at `at` as typing would, and tell the listener"""
+    view.replace(at, at, text)
+    view.sel().clear()
+    view.sel().add(cs.sublime.Region(at + len(text)))
+    cs.AgenticPrefetchListener().on_modified(view)
+
+
+def chat_view(window, tokens, seed):
+    """A chat with `tokens` of history, a new user turn half typed"""
+    turn = "Line {} of a long discussion about the code.\n".format(seed)
+    history = turn * int(tokens * CHARS_PER_TOKEN / len(turn))
+    view = harness.new_chat(window, harness.CHAT + history +
+                            "\n# --- Agent ---\nNoted.\n\n# --- User ---\n")
+    view.settings().set("agentic_is_chat", True)
+    view.settings().set("agent_model", "warm")
+    typed(view, len(view.text), "Now summarize the ")
+    return view
+
+
+def send(view, status):
+    """Finish the turn and send it; return the ledger record"""
+    typed(view, len(view.text), "discussion.\n")
+    done = []
+    cs.start_streaming(view, cs._build_messages_from_text(view.text),
+                       on_done=done.append)
+    assert cs.sublime.pump_until(lambda: done, 60), "stream stuck"
+    status.extend(m for m in cs.sublime.status_log if "Streaming Done" in m)
+    return done[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, default=20000,
+                        help="prompt tokens of chat history")
+    args = parser.parse_args()
+    cs.print = lambda *a, **k: None
+
+    server = Server(("127.0.0.1", 0), Slot)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    settings = cs.sublime.load_settings("Agentic.sublime-settings")
+    settings.set("prefetch_delay", 0.2)
+    models = dict(settings.get("models"))
+    models["warm"] = {
+        "url": "http://127.0.0.1:{}/v1/chat/completions".format(
+            server.server_address[1]),
+        "model": "warm", "token": "-", "options": {"stream": True},
+        "context": 1e6, "system": "slot", "workers": 1, "speed": 100.0,
+        "cost": 0.0, "prefetch": False}
+    settings.set("models", models)
+    window = cs.sublime.Window()
+
+    # cold: prefetch off
+    view = chat_view(window, args.tokens, 1)
+    cs.sublime.pump_until(lambda: False, 0.5)  # a typing pause
+    assert not Slot.requests, "warm-up sent with prefetch off"
+    cold = send(view, [])
+
+    # warm: the pause sends a warm-up, the turn goes out right after
+    models["warm"] = dict(models["warm"], prefetch=True)
+    settings.set("models", models)
+    view = chat_view(window, args.tokens, 2)
+    assert cs.sublime.pump_until(
+        lambda: view.id() in cs._PREFETCHER._warm, 30), "no warm-up"
+    warm_up = Slot.requests[-1]
+    assert not warm_up[0], "warm-up must not stream"
+    status = []
+    warm = send(view, status)
+    assert status and "Warm-up saved" in status[-1], status
+
+    print("{} history tokens, prefill {:.0f} tokens/s".format(
+        args.tokens, PREFILL_TPS))
+    print("{:>6} {:>10} {:>16}".format("", "ttft", "prefilled on send"))
+    print("{:>6} {:>9.2f}s {:>16}".format("cold", cold["ttft"],
+                                         Slot.requests[-3][1]))
+    print("{:>6} {:>9.2f}s {:>16}".format("warm", warm["ttft"],
+                                         Slot.requests[-1][1]))
+    print("warm-up prefilled {} tokens; {}".format(
+        warm_up[1], status[-1].split(". ")[-1]))
+    assert warm["ttft"] < cold["ttft"] / 2, "warm-up did not help"
+
+    # an edit of an earlier turn cancels the running warm-up
+    view = chat_view(window, args.tokens * 4, 3)
+    disconnects = Slot.disconnects
+    assert cs.sublime.pump_until(
+        lambda: view.id() in cs._PREFETCHER._running, 10), "no warm-up"
+    time.sleep(0.1)
+    typed(view, len(harness.CHAT) + 10, "x")
+    assert cs.sublime.pump_until(
+        lambda: Slot.disconnects > disconnects, 5), "stale warm-up kept"
+    print("edit of an earlier turn: warm-up cancelled")
+    cs._PREFETCHER.discard(view)
+    cs.sublime.pump_until(lambda: not cs._PREFETCHER._running, 10)
+
+    # a busy system gets no warm-up
+    ticket = cs._StreamTicket(None, "slot", 1)
+    assert cs._SCHEDULER.try_acquire(ticket)
+    sent = len(Slot.requests)
+    view = chat_view(window, args.tokens, 4)
+    cs.sublime.pump_until(lambda: False, 0.5)
+    assert len(Slot.requests) == sent and not cs._PREFETCHER._running, \
+        "warm-up sent on a busy system"
+    cs._SCHEDULER.release(ticket)
+    print("busy system: no warm-up")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Cost of the "profile_ui" UI-thread profiler, and what it reports.
+#
+#  Times a trivial call made directly, through a command wrapper with
+#  profiling off and on, and through `_set_timeout` + the UI queue both
+#  ways. Then streams a recording into a chat view with profiling on,
+#  checks every UI callback landed in the profile and prints the report
+#  of AI Agent UI Profile.
+#
+#      python bench/bench_profile.py
+
+import timeit
+
+import harness
+
+cs = harness.load_plugin()
+
+CALLS = 200000
+
+
+def per_call(statement, number=CALLS):
+    """Best-of-5 nanoseconds per call of `statement`"""
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    cs.print = lambda *a, **k: None
+    settings = cs.sublime.load_settings("Agentic.sublime-settings")
+
+    def noop():
+        pass
+    wrapped = cs._profiled(noop, "bench.noop")
+
+    print("{:>28} {:>10}".format("call", "ns/call"))
+    raw = per_call(noop)
+    cs._PROFILER.enabled = False
+    off = per_call(wrapped)
+    cs._PROFILER.enabled = True
+    on = per_call(wrapped)
+    print("{:>28} {:>10.0f}".format("direct", raw))
+    print("{:>28} {:>10.0f}".format("command wrapper, off", off))
+    print("{:>28} {:>10.0f}".format("command wrapper, on", on))
+    assert cs._PROFILER.sites["bench.noop"][0] == 5 * CALLS
+
+    def queued(enabled):
+        cs._PROFILER.enabled = enabled
+        ran = []
+
+        def callback():
+            ran.append(1)
+        for _ in range(CALLS // 10):
+            cs._set_timeout(callback, 0)
+        t0 = cs.time.perf_counter()
+        cs.sublime.pump_until(lambda: len(ran) == CALLS // 10, 60)
+        return (cs.time.perf_counter() - t0) / (CALLS // 10) * 1e9
+    print("{:>28} {:>10.0f}".format("set_timeout + run, off", queued(False)))
+    print("{:>28} {:>10.0f}".format("set_timeout + run, on", queued(True)))
+
+    server, url = harness.start_server("--rate", 2000)
+    try:
+        settings.set("profile_ui", True)
+        cs._on_settings_changed()
+        assert cs._PROFILER.enabled
+        cs._PROFILER.reset()
+        models = dict(settings.get("models"))
+        models["llamacpp"] = {"url": url, "model": "llamacpp", "token": "-",
+                              "options": {"stream": True}, "context": 131072,
+                              "cost": 0.0, "speed": 100.0}
+        settings.set("models", models)
+        window = cs.sublime.Window()
+        view = harness.new_chat(window)
+        callbacks = cs.sublime.ui_stats["callbacks"]
+        done = []
+        cs.start_streaming(view, cs._build_messages_from_text(view.text),
+                           "llamacpp", on_done=done.append)
+        assert cs.sublime.pump_until(
+            lambda: done and not cs._FLUSHER._pending, 60), "stream stuck"
+        callbacks = cs.sublime.ui_stats["callbacks"] - callbacks
+        recorded = sum(e[0] for e in cs._PROFILER.sites.values())
+        assert recorded == callbacks, \
+            "{} UI callbacks, {} profiled".format(callbacks, recorded)
+        assert "_FlushScheduler._tick" in cs._PROFILER.sites
+
+        cs.AgenticUiProfileCommand(window).run()
+        report = window.panels["agentic_ui_profile"].text
+        assert "_FlushScheduler._tick" in report
+        print()
+        print(report.rstrip())
+
+        settings.set("profile_ui", False)
+        cs._on_settings_changed()
+        cs.AgenticUiProfileCommand(window).run(reset=True)
+        assert "profiling is off" in window.panels["agentic_ui_profile"].text
+        assert not cs._PROFILER.sites
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Reasoning in the chat buffer vs in a side panel ("reasoning_output").
+#
+#  Streams several turns of a recording with its reasoning events sent
+#  `--repeat` times (a long "thinking" phase) into one chat,
+#  once with "reasoning_output": "chat" (quoted under "## --- Thinking
+#  ---") and once with "panel". Checks both chats parse to the same
+#  messages and the panel got every reasoning token, then reports the
+#  chat size, the time to parse it from scratch, UI thread time and
+#  UI callbacks for each mode.
+#
+#      python bench/bench_reasoning.py [--turns 5] [--repeat 40]
+
+import argparse
+import json
+import timeit
+
+import harness
+
+cs = harness.load_plugin()
+
+
+def reasoning_of(name, repeat):
+    """All reasoning text of a recording, each event sent `repeat` times"""
+    text = []
+    for event in harness.load_stream(name + ".sse").split(b"\n\n"):
+        payload = event.strip()[6:]
+        if not payload or payload == b"[DONE]":
+            continue
+        for choice in json.loads(payload.decode("utf-8")).get("choices", []):
+            delta = choice.get("delta", {})
+            text.append((delta.get("reasoning_content")
+                         or delta.get("reasoning") or "") * repeat)
+    return "".join(text)
+
+
+def chat(url, recording, mode, turns):
+    """Stream `turns` turns into one chat; return (window, view, stats)"""
+    settings = cs.sublime.load_settings("Agentic.sublime-settings")
+    settings.set("reasoning_output", mode)
+    models = dict(settings.get("models"))
+    models[recording] = {"url": url, "model": recording, "token": "-",
+                         "options": {"stream": True}, "context": 131072,
+                         "cost": 0.0, "speed": 100.0}
+    settings.set("models", models)
+
+    window = cs.sublime.Window()
+    view = harness.new_chat(window)
+    ui = dict(cs.sublime.ui_stats)
+    for turn in range(turns):
+        done = []
+        cs.start_streaming(view, cs._build_messages_from_text(view.text),
+                           recording, on_done=done.append)
+        if not cs.sublime.pump_until(
+                lambda: done and not cs._FLUSHER._pending, 120):
+            raise RuntimeError("{}: turn {} did not finish".format(mode, turn))
+        view.text += "and then?\n"
+    parse = min(timeit.repeat(
+        lambda: cs._build_messages_from_text(view.text), number=10,
+        repeat=3)) / 10
+    return window, view, {
+        "chars": len(view.text),
+        "parse": parse,
+        "ui": cs.sublime.ui_stats["seconds"] - ui["seconds"],
+        "callbacks": cs.sublime.ui_stats["callbacks"] - ui["callbacks"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=40)
+    parser.add_argument("--recording", default="llamacpp")
+    args = parser.parse_args()
+    cs.print = lambda *a, **k: None
+    reasoning = reasoning_of(args.recording, args.repeat)
+    assert reasoning, "{} has no reasoning".format(args.recording)
+
+    server, url = harness.start_server("--rate", 100000, "--reasoning-repeat",
+                                       args.repeat)
+    try:
+        results = {}
+        for mode in ("chat", "panel"):
+            results[mode] = chat(url, args.recording, mode, args.turns)
+    finally:
+        server.terminate()
+
+    (_, chat_view, _), (window, view, _) = results["chat"], results["panel"]
+    assert cs._build_messages_from_text(chat_view.text) == \
+        cs._build_messages_from_text(view.text), "chats parse differently"
+    panel = window.find_output_panel(cs._reasoning_panel_name(view))
+    assert panel.text.count(reasoning) == args.turns, "reasoning missing"
+    assert view.text.count("AI Agent Show Reasoning") == args.turns
+    cs.AgenticShowReasoningCommand(window).run()
+    assert window.active_panel() == \
+        "output." + cs._reasoning_panel_name(view)
+
+    print("{} turns of {}, {} reasoning chars each".format(
+        args.turns, args.recording, len(reasoning)))
+    print("{:>6} {:>11} {:>11} {:>9} {:>10}".format(
+        "mode", "chat chars", "parse ms", "UI ms", "callbacks"))
+    for mode in ("chat", "panel"):
+        m = results[mode][2]
+        print("{:>6} {:>11} {:>11.2f} {:>9.1f} {:>10}".format(
+            mode, m["chars"], m["parse"] * 1000, m["ui"] * 1000,
+            m["callbacks"]))
+
+
+if __name__ == "__main__":
+    main()
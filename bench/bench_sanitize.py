@@ -0,0 +1,77 @@
+# Throughput of the compiled sanitizer against the original regex path.
+#
+#  The reference below is the original `_update_sanitize_dict` +
+#  `_sanitize_text`: one longest-first alternation over every key and a
+#  Python callback per match. Each input is checked for identical output
+#  (whole and streamed in small chunks) before timing.
+#
+#      python bench/bench_sanitize.py
+
+import random
+import re
+
+import harness
+
+cs = harness.load_plugin()
+
+
+def reference():
+    all_sanitize = cs.sublime.load_settings(
+        "Agentic.sublime-settings").get("sanitize_dict")
+    table = {}
+    for canonical, alts in all_sanitize.items():
+        for ch in alts:
+            table[ch] = canonical
+    regex = re.compile(
+        "|".join(sorted(map(re.escape, table), key=len, reverse=True)))
+    return lambda text: regex.sub(lambda m: table[m.group(0)], text)
+
+
+def inputs():
+    rnd = random.Random(1)
+    with open(__file__.replace("bench_sanitize.py", "../chat_stream.py"),
+              encoding="utf-8") as f:
+        ascii_text = f.read()
+    lookalikes = "\u2019\u201c\u201d\u2014\u2013\u00a0\u2026\u2192\u2264" \
+        "\u00d7\uff08\uff09\u3010\u3011\u2047\u00bb"
+    words = ascii_text.split()
+    unicode_text = " ".join(
+        rnd.choice(words) + rnd.choice(lookalikes) for _ in range(60000))
+    keycap = "\ufe0f\u20e3"
+    pathological = "".join(rnd.choice([
+        "1", "2", "3" + keycap, "4\ufe0f", "?", "\u2047", "..", "\u2025",
+        "\u200b"]) for _ in range(150000))
+    return [("ascii-heavy", ascii_text * 8),
+            ("unicode-heavy", unicode_text),
+            ("pathological", pathological)]
+
+
+def streamed(text, rnd):
+    out, tail, i = [], "", 0
+    while i < len(text):
+        j = i + rnd.randint(1, 12)
+        shown, tail = cs._sanitize_stream(tail + text[i:j])
+        out.append(shown)
+        i = j
+    out.append(cs._sanitize_text(tail))
+    return "".join(out)
+
+
+def main():
+    old = reference()
+    rnd = random.Random(2)
+    for name, text in inputs():
+        expected = old(text)
+        assert cs._sanitize_text(text) == expected, name
+        assert streamed(text[:20000], rnd) == old(text[:20000]), name
+
+        t_old = harness.best_of(lambda: old(text), 3)
+        t_new = harness.best_of(lambda: cs._sanitize_text(text), 3)
+        mb = len(text) / 1e6
+        print("{:14} {:6.2f} MB  regex {:7.1f} MB/s  compiled {:7.1f} MB/s"
+              "  x{:.1f}".format(name, mb, mb / t_old, mb / t_new,
+                                 t_old / t_new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Events/sec of the SSE stream parser in chat_stream.py.
+#
+#  Compares the original line-by-line loop (decode, strip, json.loads
+#  per line) against `_iter_sse_events` on the recorded streams in
+#  streams/, both reading from a chunked `http.client.HTTPResponse`,
+#  after checking that they produce identical text chunks (the legacy
+#  loop never reported OpenAI's usage-only final event).
+#
+#      python bench/bench_sse.py
+
+import json
+
+import harness
+
+cs = harness.load_plugin()
+
+STREAMS = ["llamacpp.sse", "groq.sse", "openai.sse"]
+READ_SIZES = [1024, 65536]
+
+
+def reader(data, size):
+    """Response whose read1() hands out at most `size` bytes per call"""
+    resp = harness.http_response(data)
+    read1 = resp.read1
+    resp.read1 = lambda n=-1: read1(size)
+    return resp
+
+
+def legacy_chunks(resp):
+    """The pre-parser streaming loop of chat_stream(), verbatim"""
+    for raw in resp:
+        line = raw.decode("utf-8").strip()
+        if not line.startswith("data: "):
+            continue
+        payload = line[6:]
+        if payload == "[DONE]":
+            return
+        try:
+            evt = json.loads(payload)
+        except ValueError:
+            continue
+        for choice in evt.get("choices", []):
+            delta = choice.get("delta", {})
+            if "reasoning_content" in delta and delta["reasoning_content"]:
+                yield (True, delta["reasoning_content"])
+            elif "reasoning" in delta and delta["reasoning"]:
+                yield (True, delta["reasoning"])
+            elif "content" in delta and delta["content"]:
+                yield (False, delta["content"])
+            elif not delta:
+                t = cs._parse_metrics(evt)
+                if t:
+                    yield (t)
+
+
+def parser_chunks(resp):
+    for evt in cs._iter_sse_events(resp):
+        for chunk in cs._event_chunks(evt):
+            yield chunk
+
+
+def check_metrics_on_delta():
+    """Usage/timings sent with the last token delta are not dropped"""
+    for extra in ({"usage": {"prompt_tokens": 5, "completion_tokens": 2}},
+                  {"timings": {"cache_n": 3, "prompt_n": 5,
+                               "prompt_per_second": 100.0,
+                               "predicted_per_second": 40.0}}):
+        last = dict({"choices": [{"delta": {"content": "b"}}]}, **extra)
+        events = [{"choices": [{"delta": {"content": "a"}}], "usage": None},
+                  last]
+        data = b"".join(b"data: " + json.dumps(e).encode() + b"\n\n"
+                        for e in events) + b"data: [DONE]\n\n"
+        got = list(parser_chunks(harness.http_response(data)))
+        assert got[:2] == [(False, "a"), (False, "b")], got
+        assert len(got) == 3 and len(got[2]) == 4, \
+            "{} lost: {}".format(sorted(extra)[0], got)
+
+
+def main():
+    check_metrics_on_delta()
+    for name in STREAMS:
+        data = harness.load_stream(name)
+        events = data.count(b"\n\ndata: ") + 1
+        expected = [c for c in legacy_chunks(harness.http_response(data))
+                    if len(c) == 2]
+        for size in READ_SIZES:
+            got = [c for c in parser_chunks(reader(data, size)) if len(c) == 2]
+            assert got == expected, "{}: parser output differs".format(name)
+
+        old = harness.best_of(
+            lambda: list(legacy_chunks(harness.http_response(data))))
+        print("{:14} {:>7} events  {:>9.0f} ev/s  legacy lines".format(
+            name, events, events / old))
+        for size in READ_SIZES:
+            new = harness.best_of(
+                lambda: list(parser_chunks(reader(data, size))))
+            print("{:14} {:>7} events  {:>9.0f} ev/s  read1({}) x{:.2f}".format(
+                name, events, events / new, size, old / new))
+
+
+if __name__ == "__main__":
+    main()
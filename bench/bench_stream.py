@@ -0,0 +1,159 @@
+# End-to-end streaming into a chat view, per recording and engine.
+#
+#  Each recording of streams/ is served by sse_server.py and streamed
+#  through start_streaming() -> AgentStreamingTask -> the flush
+#  scheduler -> view appends, with UI callbacks pumped on the main
+#  thread. Checks the view got every content token of the recording,
+#  then reports:
+#
+#   * ev/s        events per second from first byte to the end of the turn
+#   * ttft +ms    time to the first token in the view, minus the server's
+#                 part (request sent -> first token parsed)
+#   * callbacks   UI callbacks run, appends and characters per append
+#
+#  A second pass serves every recording with injected 429/503 errors
+#  (the views must still get the same text) and dropped streams (the
+#  turn must still complete, continued from where it was cut).
+#
+#      python bench/bench_stream.py [--rate 100000]
+
+import argparse
+import json
+
+import harness
+
+cs = harness.load_plugin()
+
+RECORDINGS = ["llamacpp", "groq", "openai"]
+ENGINES = ["threads", "async"]
+
+
+def content_of(name):
+    """All content (non-reasoning) text of a recording"""
+    text = []
+    for event in harness.load_stream(name + ".sse").split(b"\n\n"):
+        payload = event.strip()[6:]
+        if not payload or payload == b"[DONE]":
+            continue
+        for choice in json.loads(payload.decode("utf-8")).get("choices", []):
+            text.append(choice.get("delta", {}).get("content") or "")
+    return "".join(text)
+
+
+def stream(url, recording, engine):
+    """Stream one recording into a new view; return measurements"""
+    settings = cs.sublime.load_settings("Agentic.sublime-settings")
+    settings.set("stream_engine", engine)
+    models = dict(settings.get("models"))
+    models[recording] = {"url": url, "model": recording, "token": "-",
+                         "options": {"stream": True}, "context": 131072,
+                         "cost": 0.0, "speed": 100.0}
+    settings.set("models", models)
+
+    view = harness.new_chat(cs.sublime.Window())
+    initial = len(view.text)
+    header = initial + len("\n\n# --- Agent ---\n")
+    callbacks = cs.sublime.ui_stats["callbacks"]
+    done = []
+    t0 = cs.time.perf_counter()
+    cs.start_streaming(view, cs._build_messages_from_text(view.text),
+                       recording, on_done=done.append)
+    task = cs._ACTIVE_STREAMERS[view.id()]
+    if not cs.sublime.pump_until(
+            lambda: done and not cs._FLUSHER._pending, 120):
+        raise RuntimeError("{} on {}: stream did not finish".format(
+            recording, engine))
+    t_end = cs.time.perf_counter()
+
+    stats = task.metrics
+    size = initial
+    for t_first, n in view.append_log:  # first append past the header
+        size += n
+        if size > header:
+            break
+    server = stats.t_first_token - stats.t_start
+    return {
+        "text": view.text,
+        "record": done[0],
+        "events": stats.chunks,
+        "seconds": t_end - stats.t_first_byte,
+        "ttft_overhead": (t_first - t0) - server,
+        "callbacks": cs.sublime.ui_stats["callbacks"] - callbacks,
+        "appends": len(view.append_log),
+        "chars": sum(n for _, n in view.append_log),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=100000.0,
+                        help="events/s the server sends (default: unpaced)")
+    args = parser.parse_args()
+    cs.print = lambda *a, **k: None
+
+    settings = cs.sublime.load_settings("Agentic.sublime-settings")
+    settings.set("retry_backoff", 0.01)
+    settings.set("retry_attempts", 8)
+
+    server, url = harness.start_server("--rate", args.rate)
+    texts = {}
+    try:
+        print("{:>9} {:>7} {:>7} {:>9} {:>9} {:>10} {:>8} {:>11}".format(
+            "stream", "engine", "events", "ev/s", "ttft +ms", "callbacks",
+            "appends", "chars/app"))
+        for recording in RECORDINGS:
+            content = content_of(recording)
+            for engine in ENGINES:
+                stream(url, recording, engine)  # warm up the connection
+                m = stream(url, recording, engine)
+                assert content in m["text"], \
+                    "{} on {}: content missing".format(recording, engine)
+                texts.setdefault(recording, m["text"])
+                assert m["text"] == texts[recording], \
+                    "{} on {}: text differs".format(recording, engine)
+                print("{:>9} {:>7} {:>7} {:>9.0f} {:>9.2f} {:>10} {:>8} "
+                      "{:>11.0f}".format(
+                          recording, engine, m["events"],
+                          m["events"] / m["seconds"],
+                          m["ttft_overhead"] * 1000, m["callbacks"],
+                          m["appends"], m["chars"] / max(1, m["appends"])))
+    finally:
+        server.terminate()
+
+    server, url = harness.start_server("--rate", args.rate,
+                                       "--error-rate", 0.3)
+    try:
+        for recording in RECORDINGS:
+            for engine in ENGINES:
+                retries = 0
+                for _ in range(5):
+                    m = stream(url, recording, engine)
+                    assert m["text"] == texts[recording], \
+                        "{} on {}: text differs after retries".format(
+                            recording, engine)
+                    retries += m["record"]["retries"]
+                print("{:>9} {:>7}  errors: 5 streams ok, {} retries".format(
+                    recording, engine, retries))
+    finally:
+        server.terminate()
+
+    server, url = harness.start_server("--rate", args.rate,
+                                       "--drop-rate", 0.5)
+    try:
+        for recording in RECORDINGS:
+            for engine in ENGINES:
+                retries = 0
+                for _ in range(5):
+                    m = stream(url, recording, engine)
+                    assert m["record"]["outcome"] == "done", \
+                        "{} on {}: dropped stream failed".format(
+                            recording, engine)
+                    retries += m["record"]["retries"]
+                print("{:>9} {:>7}   drops: 5 streams ok, {} resumed".format(
+                    recording, engine, retries))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Shared helpers for the headless benchmarks in this folder.
+#
+#  Run from the package root, e.g.:
+#      python bench/bench_sse.py
+
+import http.client
+import io
+import os
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCH_DIR)
+STREAMS_DIR = os.path.join(BENCH_DIR, "streams")
+
+
+def load_plugin():
+    """Import chat_stream.py with the stand-in sublime modules"""
+    for path in (PACKAGE_DIR, os.path.join(BENCH_DIR, "stubs")):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    import chat_stream
+    chat_stream.plugin_loaded()  # settings snapshot follows settings.set()
+    return chat_stream
+
+
+def load_stream(name):
+    """Return the raw bytes of a recorded stream in streams/"""
+    with open(os.path.join(STREAMS_DIR, name), "rb") as f:
+        return f.read()
+
+
+def http_response(data):
+    """
+    Wrap a recorded stream in a real `http.client.HTTPResponse`, sent
+    with chunked transfer encoding and one HTTP chunk per SSE event the
+    way llama.cpp and most providers write it.
+    """
+    body = []
+    for event in data.split(b"\n\n"):
+        if event:
+            event += b"\n\n"
+            body.append(b"%x\r\n%s\r\n" % (len(event), event))
+    raw = (b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+           b"Transfer-Encoding: chunked\r\n\r\n"
+           + b"".join(body) + b"0\r\n\r\n")
+
+    class Socket(object):
+        def makefile(self, mode):
+            return io.BufferedReader(io.BytesIO(raw))
+
+    resp = http.client.HTTPResponse(Socket())
+    resp.begin()
+    return resp
+
+
+def best_of(fn, repeat=5):
+    """Return the best wall time of `repeat` calls to fn()"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+CHAT = "# --- System ---\nYou are an expert.\n\n# --- User ---\nhi\n"
+
+
+def new_chat(window, text=CHAT):
+    """A new view of the stub `window` holding a chat transcript"""
+    view = window.new_file()
+    view.text = text
+    return view
+
+
+def start_server(*args):
+    """
+    Start sse_server.py in its own process with the given command line
+    options; return (process, chat completions URL).
+    """
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "sse_server.py")]
+        + [str(a) for a in args], stdout=subprocess.PIPE)
+    port = int(server.stdout.readline())
+    return server, "http://127.0.0.1:{}/v1/chat/completions".format(port)
+
+
+def make_chat(size, seed=0):
+    """Deterministic chat transcript of roughly `size` characters"""
+    import random
+    rnd = random.Random(seed)
+    words = ("the parser reads every line of the buffer and checks for tags "
+             "def class return yield lambda import json view region").split()
+
+    def para(n):
+        return " ".join(rnd.choice(words) for _ in range(n))
+
+    parts = ["# --- System ---\nYou are an expert.\n"]
+    while sum(len(p) for p in parts) < size:
+        parts.append("\n# --- User ---\n{}\n```python\n{}\n```\n".format(
+            para(20), "\n".join(para(8) for _ in range(rnd.randint(1, 30)))))
+        agent = "\n\n# --- Agent ---\n"
+        if rnd.random() < 0.7:
+            agent += "\n## --- Thinking ---\n>" + "\n> ".join(
+                para(12) for _ in range(rnd.randint(1, 40)))
+            agent += "\n\n## --- Response ---\n"
+        agent += "\n\n".join(para(30) for _ in range(rnd.randint(1, 10)))
+        parts.append(agent + "\n")
+    parts.append("\n# --- User ---\n")
+    return "".join(parts)
@@ -0,0 +1,59 @@
+# Run the headless benchmark and regression suite.
+#
+#  Every bench_*.py of this folder runs in its own interpreter, on the
+#  stand-in `sublime` modules of stubs/ and the mock server of
+#  sse_server.py. Each checks its results (identical text, parse and
+#  sanitize output) before printing numbers; a failed check fails the
+#  suite.
+#
+#      python bench/run.py              # everything
+#      python bench/run.py sse stream   # bench_sse.py and bench_stream.py
+
+import os
+import subprocess
+import sys
+import time
+
+import harness
+
+SUITE = [
+    ("sse", "SSE parser events/s per recording"),
+    ("parse", "chat parsing, 1 KB to 10 MB"),
+    ("sanitize", "output sanitizer throughput"),
+    ("stream", "end to end: ev/s, TTFT overhead, UI callbacks, appends"),
+    ("engine", "threads vs event loop at 1, 10 and 50 streams"),
+    ("cancel", "cancel -> disconnect and slot release"),
+    ("profile", "UI-thread profiler overhead and report"),
+    ("reasoning", "reasoning in the chat vs in a side panel"),
+    ("config", "settings snapshot: request bodies, load-time checks"),
+    ("context", "summarize policy: summary requests per submit"),
+    ("prefetch", "prompt cache warm-up while typing: TTFT cold vs warm"),
+]
+
+
+def main():
+    names = sys.argv[1:] or [name for name, _ in SUITE]
+    unknown = set(names) - set(name for name, _ in SUITE)
+    if unknown:
+        sys.exit("unknown benchmark(s): {}".format(", ".join(sorted(unknown))))
+    failed = []
+    for name, title in SUITE:
+        if name not in names:
+            continue
+        print("== {}: {}".format(name, title))
+        sys.stdout.flush()
+        t0 = time.perf_counter()
+        code = subprocess.call(
+            [sys.executable,
+             os.path.join(harness.BENCH_DIR, "bench_{}.py".format(name))])
+        if code:
+            failed.append(name)
+        print("-- {} {} in {:.1f}s\n".format(
+            name, "FAILED" if code else "ok", time.perf_counter() - t0))
+    if failed:
+        sys.exit("failed: {}".format(", ".join(failed)))
+    print("all {} passed".format(len(names)))
+
+
+if __name__ == "__main__":
+    main()
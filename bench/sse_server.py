@@ -0,0 +1,139 @@
+# Mock OpenAI-compatible server replaying the recorded streams of streams/.
+#
+#  A POST whose "model" names a recording ("llamacpp", "groq", "openai")
+#  gets that recording, any other model the `--stream` one, as a chunked
+#  SSE response with one HTTP chunk per event, after `--ttft` seconds and
+#  paced at `--rate` events per second (events that fall behind are sent
+#  together). Faults can be injected:
+#
+#   --error-rate  share of requests answered 429 (Retry-After: 0) or 503
+#   --drop-rate   share of streams cut off halfway through
+#
+#  and `--reasoning-repeat` sends every reasoning event that many times,
+#  for long "thinking" phases.
+#
+#  Runs as its own process so its CPU time is not charged to the
+#  benchmark; prints the port it listens on as the first line.
+#
+#      python bench/sse_server.py --stream llamacpp.sse --rate 500
+
+import argparse
+import http.server
+import json
+import os
+import random
+import socketserver
+import sys
+import threading
+import time
+
+import harness
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    default = "llamacpp.sse"
+    rate = 500.0
+    ttft = 0.0
+    error_rate = 0.0
+    drop_rate = 0.0
+    reasoning_repeat = 1
+    _streams = {}  # file name -> [HTTP chunk per event]
+    _random = random.Random(0)
+    _lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    @classmethod
+    def events(cls, model):
+        name = "{}.sse".format(model)
+        if not os.path.exists(os.path.join(harness.STREAMS_DIR, name)):
+            name = cls.default
+        with cls._lock:
+            if name not in cls._streams:
+                data = harness.load_stream(name)
+                cls._streams[name] = [b"%x\r\n%s\n\n\r\n" % (len(e) + 2, e)
+                                      for e in data.split(b"\n\n")
+                                      if e.strip()
+                                      for _ in range(cls.repeats(e))]
+            return cls._streams[name]
+
+    @classmethod
+    def repeats(cls, event):
+        return cls.reasoning_repeat if b'"reasoning' in event else 1
+
+    @classmethod
+    def roll(cls, share):
+        with cls._lock:
+            return cls._random.random() < share
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(
+            int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+        events = self.events(body.get("model"))
+        time.sleep(self.ttft)
+        if self.roll(self.error_rate):
+            self.send_response(429 if self.roll(0.5) else 503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.roll(self.drop_rate):
+            events = events[:len(events) // 2]
+            self.close_connection = True
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        start = time.perf_counter()
+        sent = 0
+        try:
+            while sent < len(events):
+                due = min(len(events),
+                          int((time.perf_counter() - start) * self.rate) + 1)
+                self.wfile.write(b"".join(events[sent:due]))
+                self.wfile.flush()
+                sent = due
+                if sent < len(events):
+                    time.sleep(max(0.0, start + sent / self.rate
+                                   - time.perf_counter()))
+            if not self.close_connection:
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+        except OSError:  # the client went away (cancelled)
+            self.close_connection = True
+
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stream", default="llamacpp.sse")
+    parser.add_argument("--rate", type=float, default=500.0)
+    parser.add_argument("--ttft", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--reasoning-repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    Handler.default = args.stream
+    Handler.rate = args.rate
+    Handler.ttft = args.ttft
+    Handler.error_rate = args.error_rate
+    Handler.drop_rate = args.drop_rate
+    Handler.reasoning_repeat = args.reasoning_repeat
+    Handler._random = random.Random(args.seed)
+    server = Server(("127.0.0.1", 0), Handler)
+    print(server.server_address[1])
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
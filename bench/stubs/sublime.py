@@ -0,0 +1,345 @@
+# Minimal stand-in for the `sublime` module so chat_stream.py can be
+# imported and benchmarked on plain CPython (see bench/harness.py).
+
+import collections
+import heapq
+import itertools
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+def _strip_json_comments(text):
+    """Remove // comments and trailing commas from a settings file"""
+    out = []
+    i, n, in_string = 0, len(text), False
+    while i < n:
+        c = text[i]
+        if in_string:
+            out.append(c)
+            if c == "\\":
+                out.append(text[i + 1])
+                i += 2
+                continue
+            if c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+            out.append(c)
+        elif text.startswith("//", i):
+            while i < n and text[i] != "\n":
+                i += 1
+            continue
+        else:
+            out.append(c)
+        i += 1
+    return re.sub(r",(\s*[}\]])", r"\1", "".join(out))
+
+
+class Settings(object):
+    def __init__(self, values=None):
+        self._values = dict(values or {})
+        self._callbacks = {}
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def set(self, key, value):
+        self._values[key] = value
+        for callback in list(self._callbacks.values()):
+            callback()
+
+    def has(self, key):
+        return key in self._values
+
+    def erase(self, key):
+        self._values.pop(key, None)
+
+    def add_on_change(self, tag, callback):
+        self._callbacks[tag] = callback
+
+    def clear_on_change(self, tag):
+        self._callbacks.pop(tag, None)
+
+
+_SETTINGS = {}
+
+
+def load_settings(name):
+    if name not in _SETTINGS:
+        path = os.path.join(PACKAGE_DIR, name)
+        with open(path, encoding="utf-8") as f:
+            _SETTINGS[name] = Settings(json.loads(_strip_json_comments(f.read())))
+    return _SETTINGS[name]
+
+
+def packages_path():
+    """A scratch Packages folder, so ledgers and caches stay out of the repo"""
+    path = os.path.join(tempfile.gettempdir(), "agentic-bench", "Packages")
+    os.makedirs(os.path.join(path, "User"), exist_ok=True)
+    return path
+
+
+# UI thread: callbacks queue up until the benchmark pumps them with
+# `pump_until()` on its main thread, as Sublime Text's UI thread would.
+_ui_lock = threading.Lock()
+_ui_queue = []
+_ui_seq = itertools.count()
+ui_stats = {"callbacks": 0, "seconds": 0.0}
+status_log = collections.deque(maxlen=100)
+
+
+def set_timeout(callback, delay=0):
+    with _ui_lock:
+        heapq.heappush(_ui_queue, (time.perf_counter() + delay / 1000.0,
+                                   next(_ui_seq), callback))
+
+
+set_timeout_async = set_timeout
+
+
+def pump_until(done, timeout=60.0):
+    """Run due UI callbacks until `done()` is true; return `done()`"""
+    end = time.perf_counter() + timeout
+    while not done() and time.perf_counter() < end:
+        with _ui_lock:
+            due = _ui_queue and _ui_queue[0][0] <= time.perf_counter()
+            callback = heapq.heappop(_ui_queue)[2] if due else None
+        if callback is None:
+            time.sleep(0.001)
+            continue
+        t0 = time.perf_counter()
+        callback()
+        ui_stats["callbacks"] += 1
+        ui_stats["seconds"] += time.perf_counter() - t0
+    return done()
+
+
+def status_message(msg):
+    status_log.append(msg)
+
+
+def error_message(msg):
+    print(msg)
+
+
+def ok_cancel_dialog(msg, ok_title=""):
+    return True
+
+
+def set_clipboard(text):
+    pass
+
+
+class Region(object):
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def empty(self):
+        return self.a == self.b
+
+    def __repr__(self):
+        return "Region({}, {})".format(self.a, self.b)
+
+
+class Selection(list):
+    def add(self, region):
+        self.append(region)
+
+
+_ids = itertools.count(1)
+
+
+class View(object):
+    """
+    Text buffer with the parts of the `sublime.View` API the plugin
+    uses. `append` commands are logged in `append_log` as
+    (perf_counter, characters appended).
+    """
+    def __init__(self, text="", window=None):
+        self._id = next(_ids)
+        self.text = text
+        self.count = 0  # change count
+        self._window = window
+        self._settings = Settings()
+        self._status = {}
+        self._sel = Selection()
+        self._name = ""
+        self._valid = True
+        self.append_log = []
+
+    def id(self):
+        return self._id
+
+    def buffer_id(self):
+        return self._id
+
+    def change_count(self):
+        return self.count
+
+    def is_valid(self):
+        return self._valid
+
+    def close(self):
+        self._valid = False
+
+    def window(self):
+        return self._window
+
+    def settings(self):
+        return self._settings
+
+    def size(self):
+        return len(self.text)
+
+    def substr(self, region):
+        if isinstance(region, int):
+            return self.text[region:region + 1]
+        return self.text[region.begin():region.end()]
+
+    def line(self, region):
+        begin = self.text.rfind("\n", 0, region.begin()) + 1
+        end = self.text.find("\n", region.end())
+        return Region(begin, len(self.text) if end < 0 else end)
+
+    def sel(self):
+        return self._sel
+
+    def replace(self, *args):
+        """`replace(edit, region, text)` or `replace(begin, end, text)`"""
+        if isinstance(args[1], Region):
+            begin, end = args[1].begin(), args[1].end()
+        else:
+            begin, end = args[0], args[1]
+        self.text = self.text[:begin] + args[2] + self.text[end:]
+        self.count += 1
+
+    def erase(self, edit, region):
+        self.replace(edit, region, "")
+
+    def run_command(self, name, args=None):
+        if name == "append":
+            characters = args["characters"]
+            self.replace(len(self.text), len(self.text), characters)
+            self.append_log.append((time.perf_counter(), len(characters)))
+
+    def set_status(self, key, value):
+        self._status[key] = value
+
+    def get_status(self, key):
+        return self._status.get(key, "")
+
+    def erase_status(self, key):
+        self._status.pop(key, None)
+
+    def name(self):
+        return self._name
+
+    def set_name(self, name):
+        self._name = name
+
+    def file_name(self):
+        return None
+
+    def set_scratch(self, scratch):
+        pass
+
+    def set_syntax_file(self, syntax):
+        pass
+
+
+class Window(object):
+    """A window of views in one group, with output panels"""
+    def __init__(self):
+        self.views_list = []
+        self.panels = {}
+        self.commands = []
+        self._active = None
+        self._panel = None
+
+    def id(self):
+        return id(self)
+
+    def is_valid(self):
+        return True
+
+    def new_file(self):
+        view = View(window=self)
+        self.views_list.append(view)
+        self._active = view
+        return view
+
+    def views(self):
+        return list(self.views_list)
+
+    def active_view(self):
+        return self._active
+
+    def focus_view(self, view):
+        self._active = view
+
+    def active_view_in_group(self, group):
+        return self._active
+
+    def get_view_index(self, view):
+        if view not in self.views_list:
+            return -1, -1
+        return 0, self.views_list.index(view)
+
+    def set_view_index(self, view, group, index):
+        pass
+
+    def num_groups(self):
+        return 1
+
+    def focus_group(self, group):
+        pass
+
+    def set_layout(self, layout):
+        pass
+
+    def folders(self):
+        return []
+
+    def create_output_panel(self, name):
+        self.panels[name] = View(window=self)
+        return self.panels[name]
+
+    def find_output_panel(self, name):
+        return self.panels.get(name)
+
+    def destroy_output_panel(self, name):
+        self.panels.pop(name, None)
+
+    def active_panel(self):
+        return self._panel
+
+    def run_command(self, name, args=None):
+        self.commands.append((name, args))
+        if name == "show_panel":
+            self._panel = args["panel"]
+        elif name == "hide_panel":
+            self._panel = None
+
+    def show_quick_panel(self, items, on_select, *args, **kwargs):
+        self.commands.append(("show_quick_panel", items))
+
+
+_WINDOW = Window()
+
+
+def active_window():
+    return _WINDOW
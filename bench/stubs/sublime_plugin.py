@@ -0,0 +1,27 @@
+# Minimal stand-in for the `sublime_plugin` module (see bench/harness.py).
+
+
+class Command(object):
+    def __init__(self, target=None):
+        self.window = target
+        self.view = target
+
+
+class WindowCommand(Command):
+    pass
+
+
+class TextCommand(Command):
+    pass
+
+
+class ApplicationCommand(Command):
+    pass
+
+
+class EventListener(object):
+    pass
+
+
+class TextInputHandler(object):
+    pass
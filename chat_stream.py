@@ -8,6 +8,9 @@
 #  * AI Agent Action - Execute user-defined custom agent action
 #                       on a custom code section.
 #
+#    (the "Fan-Out" variants send either to every model of the list
+#     side by side, see `_FanOut`)
+#
 #  * AI Agent Model Chat  - Start a chat with a specific model,
 #                            optionally with a code snippet
 #
@@ -20,10 +23,21 @@
 #
 #  * AI Agent Clear Reasoning  - Erase reasoning output from a chat
 #
+#  * AI Agent Show Reasoning   - Show the chat's reasoning panel
+#                                 ("reasoning_output": "panel")
+#
 #  * AI Agent Clone Chat  - Create a copy of the current chat
 #
 #  * AI Agent New Chat    - Prepare a new chat file
 #
+#  * AI Agent Stats       - Per-model latency/throughput from `_LEDGER`
+#
+#  * AI Agent Batch Action - Run an action over many files (`_Batch`)
+#
+#  Streams are admitted through `_SCHEDULER`, which runs at most
+#  `"workers"` streams per `"system"` and queues the rest, then run on
+#  `_ENGINE` (one event loop for all streams) or their own thread.
+#
 #  All API call logic lives in `chat_stream()` - the single code
 #  path used by all three commands.
 #
@@ -31,12 +45,35 @@
 #  Sublime Text builds (no f-string syntax, only .format()).
 # -------------------------------------------------------------
 
+import io
+import os
+import base64
+import hashlib
+import math
 import time
 import json
+import urllib.error
+import urllib.parse
 import urllib.request
+import http.client
+import ssl
+import socket
+import select
+import email.utils
 import threading
+import queue
 import random
 import re
+import heapq
+import bisect
+import functools
+import itertools
+import collections
+
+try:
+    import asyncio  # Python 3.4+, i.e. not in Sublime Text 3
+except ImportError:
+    asyncio = None
 
 import sublime
 import sublime_plugin
@@ -53,23 +90,262 @@ TAG_MAP = {
     "assistant": "# --- Agent ---",
 }
 
-_LAST_SANITIZE_DICT_RAW = None
-_SANITIZE_DICT = None
-_SANITIZE_RE = None
+_CONFIG = None  # settings snapshot, see _config()
+
+
+class _Config(object):
+    """
+    Snapshot of Agentic.sublime-settings, read through `_config()` and
+    rebuilt (never modified) on every settings change. Besides the raw
+    values it holds the checked model records, the capability lists
+    ("models_high", ...) without unknown or broken models, each model's
+    request body around the messages plus its headers, and the compiled
+    sanitizer. Problems found while building are kept in `errors`.
+    """
+    KEYS = (
+        "default_prompt", "default_models", "models_high", "models_low",
+        "routing_policy", "routing_cost_weight", "hedge_requests",
+        "hedge_delay", "retry_attempts", "retry_backoff", "show_reasoning",
+        "reasoning_output", "sanitize_on_copy", "sanitize_output",
+        "sanitize_keep_raw", "request_usage", "keep_alive_timeout",
+        "stream_engine", "profile_ui", "ledger_max_kb", "context_policy",
+        "map_reduce_tokens", "map_reduce_chunk_tokens",
+        "map_reduce_overlap_lines", "response_cache_mb",
+        "response_cache_replay_tps", "batch_output", "batch_max_kb",
+        "batch_max_workers", "prefetch_delay", "actions", "models",
+        "sanitize_dict",
+    )
+    MODEL_KEYS = ("url", "model", "token", "options", "context", "system",
+                  "workers", "speed", "effort", "cost", "cache_responses",
+                  "prefetch")
+    CHOICES = {
+        "routing_policy": ("score", "random"),
+        "reasoning_output": ("chat", "panel"),
+        "stream_engine": ("async", "threads"),
+        "context_policy": ("drop_oldest", "elide_code", "summarize", "none"),
+        "batch_output": ("panel", "files"),
+    }
+    _MESSAGES = "\0messages"  # stands in for the messages of a request
+
+    def __init__(self, settings):
+        values = settings.to_dict() if hasattr(settings, "to_dict") else {}
+        for key in self.KEYS:
+            value = settings.get(key)
+            if value is not None:
+                values[key] = value
+        actions = values.get("actions") or {}
+        lists = [values.get("default_models")] + [
+            a.get("models") for a in actions.values() if isinstance(a, dict)]
+        for name in lists:  # model lists named other than "models_*"
+            if isinstance(name, str) and settings.get(name) is not None:
+                values[name] = settings.get(name)
+        self._values = values
+        self.errors = []
+
+        self.models = {}
+        broken = set()
+        for name, model in (values.get("models") or {}).items():
+            if not isinstance(model, dict):
+                self.errors.append('model "{}" is not an object'.format(name))
+                continue
+            self.models[name] = model
+            for key in ("url", "model"):
+                if key not in model:
+                    self.errors.append('model "{}": missing "{}"'.format(
+                        name, key))
+                    broken.add(name)
+            if "speed" not in model:  # routable, at 1 tk/s until measured
+                self.errors.append('model "{}": missing "speed", routed as '
+                                   'slow until its speed is measured'.format(
+                                       name))
+            for key in model:
+                if key not in self.MODEL_KEYS:
+                    self.errors.append('model "{}": unknown key "{}"'.format(
+                        name, key))
+            if not isinstance(model.get("options", {}), dict):
+                self.errors.append('model "{}": "options" is not an '
+                                   'object'.format(name))
+                broken.add(name)
+
+        self.capabilities = {}
+        for name, value in values.items():
+            if not (name.startswith("models_") or name in lists):
+                continue
+            if not isinstance(value, list):
+                self.errors.append('"{}" is not a list of models'.format(name))
+                continue
+            for model_name in value:
+                if model_name not in self.models:
+                    self.errors.append('"{}": unknown model "{}"'.format(
+                        name, model_name))
+            self.capabilities[name] = [n for n in value if n in self.models
+                                       and n not in broken]
+        default = values.get("default_models")
+        if default not in self.capabilities:
+            self.errors.append('"default_models": no model list "{}"'.format(
+                default))
+        for name, action in actions.items():
+            if not isinstance(action, dict):
+                self.errors.append('action "{}" is not an object'.format(name))
+            elif action.get("models") not in self.capabilities:
+                self.errors.append('action "{}": no model list "{}"'.format(
+                    name, action.get("models")))
+        for key, choices in sorted(self.CHOICES.items()):
+            if key in values and values[key] not in choices:
+                self.errors.append('"{}" must be one of {}, not {}'.format(
+                    key, ", ".join('"{}"'.format(c) for c in choices),
+                    json.dumps(values[key])))
+
+        self._requests = {}  # id(model) -> (model, head, tail, headers, stream)
+        for model in self.models.values():
+            if isinstance(model.get("options", {}), dict):
+                self._requests[id(model)] = (model,) + self._request(model)
+
+        # {canonical: [look-alikes]} -> {look-alike: canonical}
+        mapping = {}
+        for canonical, alts in (values.get("sanitize_dict") or {}).items():
+            for ch in alts:
+                mapping[ch] = canonical
+        mapping.pop("", None)
+        self.sanitizer = _Sanitizer(mapping)
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def capability(self, name):
+        """The usable models of the model list `name`"""
+        return self.capabilities.get(name, [])
+
+    def request(self, model):
+        """(body before the messages, body after them, headers, streaming)"""
+        entry = self._requests.get(id(model))
+        if entry is not None and entry[0] is model:
+            return entry[1:]
+        return self._request(model)  # not one of this snapshot's models
+
+    def _request(self, model):
+        body = dict(model.get("options", {}))
+        body.update({
+            "messages": self._MESSAGES,
+            "model": model.get("model"),
+        })
 
+        if "include_reasoning" in body and body["include_reasoning"]:
+            body.update({  # match the package setting if True
+                "include_reasoning": self.get("show_reasoning")
+            })
 
-def _pick_model(capability=None):
-    """Return a random model from the provided model list string"""
-    settings = sublime.load_settings("Agentic.sublime-settings")
+        stream = body.get("stream", False)
+        if stream and "stream_options" not in body and self.get(
+                "request_usage", True):
+            body["stream_options"] = {"include_usage": True}
+
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": "Bearer {}".format(model.get("token")),
+            "Connection": "keep-alive",
+        }
+        head, tail = json.dumps(body).encode("utf-8").split(
+            json.dumps(self._MESSAGES).encode("utf-8"))
+        return head, tail, headers, stream
+
+
+def _config():
+    """The current `_Config` (built on first use, see _on_settings_changed)"""
+    global _CONFIG
+    if _CONFIG is None:
+        _CONFIG = _Config(sublime.load_settings("Agentic.sublime-settings"))
+    return _CONFIG
+
+
+def _pick_model(capability=None, messages=None, affinity=None, exclude=()):
+    """
+    Pick a model from the provided model list string, skipping the
+    names in `exclude` (None when nothing is left).
+
+    With "routing_policy": "score" (default) every candidate is scored
+    by its expected seconds to finish - see `_route_score` - and the
+    lowest wins; "random" keeps the original uniform choice. `affinity`
+    names the system that already holds `messages` in its prompt cache.
+    """
+    settings = _config()
     if capability is None:
         capability = settings.get("default_models")
-    capable_models = settings.get(capability)
-    models = settings.get("models")
-    model = random.choice(capable_models)
-    print("Using model", model)
+    capable_models = [name for name in settings.capability(capability)
+                      if name not in exclude]
+    models = settings.models
+    if not capable_models:
+        return None
+    if settings.get("routing_policy", "score") == "random":
+        model = random.choice(capable_models)
+        print("Using model", model)
+        return model
+
+    prompt_tokens = 0
+    if messages:
+        prompt_tokens = sum(len(m.get("content", ""))
+                            for m in messages) / CHARS_PER_TOKEN
+    cost_weight = settings.get("routing_cost_weight", 0.0)
+    rollups = _LEDGER.rollups()
+    scored = []
+    for name in capable_models:
+        if name not in models:
+            continue
+        score, inputs = _route_score(name, models[name], rollups.get(name),
+                                     prompt_tokens, affinity, cost_weight)
+        scored.append((score, random.random(), name, inputs))
+    if not scored:  # let the caller fail on the unknown model name
+        return random.choice(capable_models)
+    scored.sort(key=lambda c: c[:2])
+    model = scored[0][2]
+    print("Using model {} ({}):".format(model, capability))
+    for score, _, name, inputs in scored:
+        print("  {:24} score {:8.2f}s  {}".format(
+            name, score, ", ".join("{} {}".format(k, v)
+                                   for k, v in sorted(inputs.items()))))
     return model
 
 
+def _route_score(name, model, rollup, prompt_tokens, affinity,
+                 cost_weight):
+    """
+    Expected seconds until a request on model `name` completes, plus
+    `cost_weight` seconds per expected dollar: queue wait for a slot on
+    its system (see `_model_slot`), TTFT, cold prefill (when `affinity`
+    is another system) and "effort" output tokens at the measured (or
+    configured) speed.
+    Returns (score, inputs) so the routing decision can be logged.
+    """
+    ewma = rollup.ewma if rollup else {}
+    system, workers = _model_slot(name, model)
+    workers = max(1, int(workers))
+    running, queued = _SCHEDULER.load(system)
+    tps = ewma.get("tps") or model.get("speed") or 1.0
+    ttft = ewma.get("ttft") or 0.0
+    pps = ewma.get("pps")
+    prefill = 0.0
+    if pps and affinity is not None and affinity != system:
+        prefill = prompt_tokens / pps
+    service = ttft + prefill + model.get("effort", 0.0) / tps
+
+    # requests ahead of us drain `workers` at a time
+    ahead = running + queued - workers + 1
+    wait = ahead * service / workers if ahead > 0 else 0.0
+
+    dollars = (prompt_tokens * 0.2 + model.get("effort", 0.0)) \
+        * model.get("cost", 0.0) * 1e-6
+    inputs = {
+        "load": "{}+{}/{}".format(running, queued,
+                                  workers if workers < 1 << 30 else "inf"),
+        "ttft": "{:.2f}".format(ttft),
+        "tk/s": "{:.0f}{}".format(tps, "" if "tps" in ewma else " (cfg)"),
+        "prefill": "{:.2f}".format(prefill),
+        "wait": "{:.1f}".format(wait),
+        "cost": "{:.4f}".format(dollars),
+    }
+    return wait + service + cost_weight * dollars, inputs
+
+
 def _parse_metrics(r):
     """
     Return (cache_n, prompt_n, prompt_per_sec, predicted_per_sec)
@@ -79,9 +355,9 @@ def _parse_metrics(r):
     if t:
         return (t["cache_n"], t["prompt_n"],
                 t["prompt_per_second"], t["predicted_per_second"])
-    u = r.get("usage")  # groq / openai
+    u = r.get("usage") or r.get("x_groq", {}).get("usage")  # groq / openai
     if u:
-        cache = u.get("prompt_tokens_details", {}).get("cached_tokens", 0)
+        cache = (u.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
         prompt = u.get("prompt_tokens", 0) - cache
         pt = u.get("prompt_time", 0) or 1e12
         ct = u.get("completion_time", 0) or 1e12
@@ -91,85 +367,1586 @@ def _parse_metrics(r):
     return None
 
 
-def chat_stream(messages, model, cancel=None):
+def _parse_usage(r):
+    """
+    Return exact token counts (prompt_tokens, cached_tokens,
+    completion_tokens) from a "timings" or "usage" block, or None.
+    """
+    t = r.get("timings")
+    if t and "predicted_n" in t:
+        return (t.get("prompt_n", 0) + t.get("cache_n", 0),
+                t.get("cache_n", 0), t["predicted_n"])
+    u = r.get("usage") or r.get("x_groq", {}).get("usage")
+    if u and "completion_tokens" in u:
+        return (u.get("prompt_tokens", 0),
+                (u.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+                u["completion_tokens"])
+    return None
+
+
+class _StreamMetrics(object):
+    """
+    Measurements of one streaming request: time to first byte, first
+    token and first content token (after reasoning), the gaps between
+    chunks, and token counts - exact from the server when reported,
+    otherwise counted chunks (output) or estimated (input).
+    """
+    def __init__(self):
+        self.t_start = time.perf_counter()  # request sent
+        self.t_first_byte = None
+        self.t_first_token = None
+        self.t_first_content = None
+        self.t_last = None
+        self.gaps = []
+        self.chunks = 0
+        self.usage = None  # (prompt_tokens, cached_tokens, completion_tokens)
+        self.replayed = False  # served from _RESPONSE_CACHE
+
+    def first_byte(self):
+        if self.t_first_byte is None:
+            self.t_first_byte = time.perf_counter()
+
+    def chunk(self, is_reasoning):
+        now = time.perf_counter()
+        if self.t_first_token is None:
+            self.t_first_token = now
+        else:
+            self.gaps.append(now - self.t_last)
+        if not is_reasoning and self.t_first_content is None:
+            self.t_first_content = now
+        self.t_last = now
+        self.chunks += 1
+
+    def since_start(self, t):
+        return None if t is None else t - self.t_start
+
+    def gap(self, q):
+        """Inter-chunk gap quantile in seconds (q=1.0 is the maximum)"""
+        if not self.gaps:
+            return float("NaN")
+        ordered = sorted(self.gaps)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def output_tokens(self):
+        return self.usage[2] if self.usage else self.chunks
+
+    def prompt_tokens(self, messages):
+        if self.usage:
+            return self.usage[0]
+        return sum(len(m.get("content", "")) for m in messages) / CHARS_PER_TOKEN
+
+    def tps(self):
+        """Measured tokens/s from the first to the last chunk"""
+        if self.t_first_token is None or self.t_last <= self.t_first_token:
+            return None
+        return (self.output_tokens() - 1) / (self.t_last - self.t_first_token)
+
+
+def _fmt_seconds(t):
+    return "-" if t is None else "{:.2f}s".format(t)
+
+
+class _ModelRollup(object):
+    """Per-model EWMA and recent-value window of each ledger metric"""
+    METRICS = ("ttft", "tps", "pps", "cost", "prompt_tokens", "output_tokens")
+    ALPHA = 0.2
+
+    def __init__(self, window):
+        self.count = 0
+        self.system = None
+        self.outcomes = collections.Counter()
+        self.cache_hits = 0
+        self.prompt_total = 0
+        self.cost_total = 0.0
+        self.hedges_fired = 0  # requests on this model that were hedged
+        self.hedges_won = 0    # ... and answered by the backup model
+        self.ewma = {}
+        self.recent = dict((k, collections.deque(maxlen=window))
+                           for k in self.METRICS)
+
+    def add(self, record):
+        self.count += 1
+        self.system = record.get("system", self.system)
+        self.outcomes[record.get("outcome", "done")] += 1
+        if record.get("replayed"):
+            return  # served from the response cache, not the backend
+        self.cache_hits += record.get("cached_tokens") or 0
+        self.prompt_total += record.get("prompt_tokens") or 0
+        cost = record.get("cost")
+        if cost is not None and not math.isnan(cost):
+            self.cost_total += cost
+        for key in self.METRICS:
+            value = record.get(key)
+            if value is None or math.isnan(value):
+                continue
+            self.recent[key].append(value)
+            old = self.ewma.get(key)
+            self.ewma[key] = value if old is None \
+                else old + self.ALPHA * (value - old)
+
+    def percentile(self, key, q):
+        ordered = sorted(self.recent[key])
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class _PerfLedger(object):
+    """
+    Append-only JSONL record of every request (see
+    `AgentStreamingTask._summarize`) in User/Agentic.ledger.jsonl, with an
+    in-memory `_ModelRollup` per model. Once the file outgrows
+    "ledger_max_kb" it is compacted to the last WINDOW records per model.
+    """
+    FILENAME = "Agentic.ledger.jsonl"
+    WINDOW = 200
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rollups = {}  # model key -> _ModelRollup
+        self._size = 0
+        self._compacted = 0  # size right after the last compaction
+
+    def path(self):
+        return os.path.join(sublime.packages_path(), "User", self.FILENAME)
+
+    def load(self):
+        """Rebuild the rollups from disk (run once, off the UI thread)"""
+        with self._lock:
+            self._rollups = {}
+            for record in self._read():
+                self._rollup(record)
+            try:
+                self._size = os.path.getsize(self.path())
+            except OSError:
+                self._size = 0
+        self._compact_if_large()
+
+    def append(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._rollup(record)
+            try:
+                with open(self.path(), "a", encoding="utf-8") as f:
+                    f.write(line)
+                self._size += len(line)
+            except OSError as e:
+                print("Agentic: could not write ledger: {}".format(e))
+                return
+        self._compact_if_large()
+
+    def rollups(self):
+        with self._lock:
+            return dict(self._rollups)
+
+    def _rollup(self, record):
+        self._get(record.get("model")).add(record)
+        hedge = record.get("hedge")
+        if hedge:
+            primary = self._get(hedge["primary"])
+            primary.hedges_fired += 1
+            primary.hedges_won += hedge["winner"] != hedge["primary"]
+
+    def _get(self, model):
+        if model not in self._rollups:
+            self._rollups[model] = _ModelRollup(self.WINDOW)
+        return self._rollups[model]
+
+    def _read(self):
+        try:
+            with open(self.path(), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue  # torn write
+        except OSError:
+            return
+
+    def _compact_if_large(self):
+        limit = _config().get("ledger_max_kb", 1024) * 1024
+        with self._lock:
+            # a window larger than the limit must not compact on every append
+            if self._size <= max(limit, 2 * self._compacted):
+                return
+            kept = {}
+            for record in self._read():
+                model = record.get("model")
+                if model not in kept:
+                    kept[model] = collections.deque(maxlen=self.WINDOW)
+                kept[model].append(record)
+            records = sorted((r for q in kept.values() for r in q),
+                             key=lambda r: r.get("time", 0))
+            tmp = self.path() + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    for record in records:
+                        f.write(json.dumps(record, separators=(",", ":")))
+                        f.write("\n")
+                os.replace(tmp, self.path())
+                self._size = self._compacted = os.path.getsize(self.path())
+            except OSError as e:
+                print("Agentic: could not compact ledger: {}".format(e))
+
+
+_LEDGER = _PerfLedger()
+
+
+class _CancelToken(threading.Event):
+    """
+    Cancellation flag of a stream or job. Besides the Event API it runs
+    the callbacks registered with `on_set` when set, on the cancelling
+    thread, so a blocked read can be aborted right away instead of when
+    the next data arrives.
+    """
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def set(self):
+        with self._callbacks_lock:
+            callbacks, self._callbacks = self._callbacks, []
+            super().set()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print("Agentic: cancel callback failed: {}".format(e))
+
+    def on_set(self, callback):
+        """
+        Run `callback()` when the token is set (now, if it already is).
+        Returns a function that unregisters it.
+        """
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+def _ssl_context():
+    """
+    The verifying default TLS context; None on Python 3.3 (Sublime Text
+    3), where http.client then uses its own default as urlopen did
+    """
+    create = getattr(ssl, "create_default_context", None)
+    return create() if create else None
+
+
+def _proxy_for(url):
+    """
+    The (host, port, Proxy-Authorization or None) of the proxy urllib
+    would use for `url` - from HTTP(S)_PROXY/NO_PROXY or the system
+    settings - or None for a direct connection
+    """
+    parts = urllib.parse.urlsplit(url)
+    proxy = urllib.request.getproxies().get(parts.scheme or "http")
+    if not proxy or urllib.request.proxy_bypass(parts.hostname or ""):
+        return None
+    if "://" not in proxy:
+        proxy = "http://" + proxy
+    proxy = urllib.parse.urlsplit(proxy)
+    auth = None
+    if proxy.username:
+        user = "{}:{}".format(urllib.parse.unquote(proxy.username),
+                              urllib.parse.unquote(proxy.password or ""))
+        auth = "Basic " + base64.b64encode(user.encode("utf-8")).decode(
+            "ascii")
+    return proxy.hostname, proxy.port or 80, auth
+
+
+class _ConnectionPool(object):
+    """
+    Keep-alive `http.client` connections keyed by (scheme, host, port,
+    proxy). Idle connections older than `max_idle` seconds are dropped,
+    and a request on a reused connection that turns out to be dead is
+    retried once on a fresh one. Proxied https requests tunnel through
+    the proxy (CONNECT), proxied http requests send it the full URL.
+    """
+    def __init__(self, max_idle=30.0):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}  # key -> [(last_used, connection)]
+        self._ssl = None
+        self.requests = 0
+        self.reused = 0
+
+    def post(self, url, data, headers, cancel=None):
+        """
+        Send a POST and return a `_Lease` holding the response. Setting
+        the `_CancelToken` `cancel` shuts the socket down at once, which
+        unblocks the waiting read and tells the server to stop.
+        """
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        proxy = _proxy_for(url)
+        key = (scheme, parts.hostname, port, proxy)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        if proxy is not None and scheme == "http":
+            path = "http://{}{}".format(parts.netloc, path)
+            if proxy[2]:
+                headers = dict(headers, **{"Proxy-Authorization": proxy[2]})
+
+        conn = self._checkout(key)
+        reused = conn is not None
+        unhook = None
+        while True:
+            if conn is None:
+                conn = self._connect(key)
+            try:
+                conn.request("POST", path, body=data, headers=headers)
+                if cancel is not None:
+                    unhook = cancel.on_set(lambda c=conn: _shutdown(c))
+                resp = conn.getresponse()
+                break
+            except Exception as e:
+                conn.close()
+                if unhook:
+                    unhook()
+                if not reused or not isinstance(
+                        e, (http.client.HTTPException, ConnectionError)) \
+                        or (cancel is not None and cancel.is_set()):
+                    raise
+                conn, reused = None, False  # stale socket: retry once
+        with self._lock:
+            self.requests += 1
+            self.reused += reused
+        if resp.status >= 400:
+            try:  # the provider's explanation, before closing drops it
+                body = resp.read()
+            except (OSError, http.client.HTTPException):
+                body = b""
+            conn.close()
+            if unhook:
+                unhook()
+            raise urllib.error.HTTPError(
+                url, resp.status, resp.reason, resp.msg, io.BytesIO(body))
+        return _Lease(self, key, conn, resp, unhook)
+
+    def reuse_rate(self):
+        """Fraction of requests served on an already open connection"""
+        with self._lock:
+            return self.reused / self.requests if self.requests else 0.0
+
+    def _connect(self, key):
+        scheme, host, port, proxy = key
+        address = (proxy[0], proxy[1]) if proxy else (host, port)
+        if scheme == "https":
+            if self._ssl is None:
+                self._ssl = _ssl_context()
+            conn = http.client.HTTPSConnection(*address, context=self._ssl)
+            if proxy:
+                conn.set_tunnel(host, port, {"Proxy-Authorization": proxy[2]}
+                                if proxy[2] else None)
+            return conn
+        return http.client.HTTPConnection(*address)
+
+    def _checkout(self, key):
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                last_used, conn = idle.pop()
+                if now - last_used < self.max_idle and _is_alive(conn):
+                    return conn
+                conn.close()
+        return None
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            self._idle.setdefault(key, []).append((time.time(), conn))
+
+
+def _shutdown(conn):
+    """
+    Shut down the socket of `conn` from any thread: a read blocked on it
+    returns, and the server sees the disconnect and stops generating.
+    (Plain `socket.shutdown`, which leaves a TLS wrapper's state alone.)
+    """
+    sock = conn.sock
+    if sock is not None:
+        try:
+            socket.socket.shutdown(sock, socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _is_alive(conn):
+    """An idle keep-alive socket that is readable was closed by the peer"""
+    if conn.sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+class _Lease(object):
+    """
+    A response borrowed from `_ConnectionPool`. Call `finish()` once the
+    body was fully consumed to return the connection for reuse; any other
+    exit (`close()`, error, cancel) discards the connection.
+    """
+    def __init__(self, pool, key, conn, response, unhook=None):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self._unhook = unhook  # drops the cancel callback
+        self._done = False
+
+    def finish(self):
+        if self._done:
+            return
+        self._done = True
+        if self._unhook:
+            self._unhook()
+        try:
+            self.response.read()  # drain the terminating chunk
+        except Exception:
+            self.conn.close()
+            return
+        if self.response.will_close:
+            self.conn.close()
+        else:
+            self.pool._checkin(self.key, self.conn)
+
+    def close(self):
+        if not self._done:
+            self._done = True
+            if self._unhook:
+                self._unhook()
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_POOL = _ConnectionPool()
+
+
+def chat_stream(messages, model, cancel=None, stats=None):
     """
     Query an OpenAI server given messages and a model configuration.
     Yields `(is_reasoning, text)` for incremental stream chunks.
     At the end yields a 4-tuple of timing metrics:
         (cache_n, prompt_n, prompt_per_second, predicted_per_second).
+    An optional `_StreamMetrics` receives the first byte and the exact
+    token counts. Models with "cache_responses" replay a completed
+    identical request from `_RESPONSE_CACHE` instead.
     """
-    url = model.get("url")
-    token = model.get("token")
-    body = dict(model.get("options", {}))
-    body.update({
-        "messages": messages,
-        "model": model.get("model"),
-    })
+    key = None
+    if model.get("cache_responses"):
+        key = _RESPONSE_CACHE.key(messages, model)
+        entry = _RESPONSE_CACHE.get(key)
+        if entry is not None:
+            for chunk in _RESPONSE_CACHE.replay(entry, cancel, stats):
+                yield chunk
+            return
 
-    if "include_reasoning" in body and body["include_reasoning"]:
-        body.update({  # match the package setting if True
-            "include_reasoning":
-            sublime.load_settings("Agentic.sublime-settings").get("show_reasoning")
-        })
+    chunks = []
+    for chunk in _chat_stream(messages, model, cancel, stats):
+        if key is not None:
+            chunks.append(chunk)
+            if len(chunk) != 2:  # callers stop reading at the metrics
+                _RESPONSE_CACHE.put(key, chunks, stats)
+                key = None
+        yield chunk
+    if key is not None and not (cancel and cancel.is_set()):
+        _RESPONSE_CACHE.put(key, chunks, stats)
 
-    stream = body.get("stream", False)
 
-    data = json.dumps(body).encode("utf-8")
-    req = urllib.request.Request(
-        url,
-        data=data,
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": "Bearer {}".format(token),
-        },
-    )
+def _chat_stream(messages, model, cancel=None, stats=None):
+    """`chat_stream` without the response cache"""
+    url, data, headers, stream = _build_request(messages, model)
+    _POOL.max_idle = _config().get("keep_alive_timeout", 30.0)
 
     if not stream:
-        resp = urllib.request.urlopen(req)
-        resp = json.loads(''.join([r.decode("utf-8") for r in resp]))
-        m = resp["choices"][0]["message"]
-        if "reasoning_content" in m and m["reasoning_content"]:
-            yield (True, m["reasoning_content"])
-        elif "reasoning" in m and m["reasoning"]:  # groq
-            yield (True, m["reasoning"])
-        if "content" in m:
-            yield (False, m["content"])
-        t = _parse_metrics(resp)
-        if t:
-            yield (t)
+        with _POOL.post(url, data, headers, cancel) as lease:
+            if stats:
+                stats.first_byte()
+            resp = json.loads(lease.response.read().decode("utf-8"))
+            lease.finish()
+        for chunk in _message_chunks(resp, stats):
+            yield chunk
         return
 
-    with urllib.request.urlopen(req) as resp:
-        for raw in resp:
+    with _POOL.post(url, data, headers, cancel) as lease:
+        if stats:
+            stats.first_byte()
+        for evt in _iter_sse_events(lease.response, cancel):
+            # print(evt)  # debugging provider stream outputs
+            if stats:
+                stats.usage = _parse_usage(evt) or stats.usage
+            for chunk in _event_chunks(evt):
+                if len(chunk) != 2:
+                    lease.finish()  # callers stop reading at the metrics
+                yield chunk
+        if not (cancel and cancel.is_set()):
+            lease.finish()
+
+
+def _build_request(messages, model):
+    """Return the (url, body bytes, headers, streaming) of a chat request"""
+    head, tail, headers, stream = _config().request(model)
+    data = head + json.dumps(messages).encode("utf-8") + tail
+    return model.get("url"), data, headers, stream
+
+
+def _message_chunks(resp, stats=None):
+    """The chunks of a complete (non-streaming) chat response"""
+    if stats:
+        stats.usage = _parse_usage(resp)
+    m = resp["choices"][0]["message"]
+    if "reasoning_content" in m and m["reasoning_content"]:
+        yield (True, m["reasoning_content"])
+    elif "reasoning" in m and m["reasoning"]:  # groq
+        yield (True, m["reasoning"])
+    if "content" in m:
+        yield (False, m["content"])
+    t = _parse_metrics(resp)
+    if t:
+        yield (t)
+
+
+class _ResponseCache(object):
+    """
+    Content-addressed store of complete responses under User/Agentic.cache,
+    keyed by the sha256 of (model, url, options, messages). An entry holds
+    every chunk, the metrics tuple and the exact usage. Reading an entry
+    refreshes its mtime, and the least recently used entries are evicted
+    once the store outgrows "response_cache_mb".
+    """
+    DIRNAME = "Agentic.cache"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._size = None  # bytes on disk, scanned on first write
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key=""):
+        return os.path.join(sublime.packages_path(), "User", self.DIRNAME, key)
+
+    def key(self, messages, model):
+        blob = json.dumps([model.get("model"), model.get("url"),
+                           model.get("options", {}), messages],
+                          sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def has(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key):
+        try:
+            with open(self.path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(self.path(key), None)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def replay(self, entry, cancel=None, stats=None):
+        """Yield a stored stream, paced by "response_cache_replay_tps" """
+        tps = _config().get("response_cache_replay_tps", 0)
+        if stats:
+            stats.first_byte()
+            stats.usage = tuple(entry["usage"]) if entry["usage"] else None
+            stats.replayed = True
+        delay = 1.0 / tps if tps else 0.0
+        for chunk in entry["chunks"]:
+            if delay and len(chunk) == 2:
+                time.sleep(delay)
             if cancel and cancel.is_set():
                 return
-            line = raw.decode("utf-8").strip()
-            if not line.startswith("data: "):
+            yield tuple(chunk)
+
+    def put(self, key, chunks, stats=None):
+        data = json.dumps({
+            "chunks": chunks,
+            "usage": stats.usage if stats else None,
+        }, separators=(",", ":"))
+        try:
+            os.makedirs(self.path(), exist_ok=True)
+            with open(self.path(key) + ".tmp", "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(self.path(key) + ".tmp", self.path(key))
+        except OSError as e:
+            print("Agentic: could not cache response: {}".format(e))
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(data)
+            limit = _config().get("response_cache_mb", 64) * 1024 * 1024
+            if self._size > limit:
+                self._evict(limit * 0.9)
+
+    def size(self):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            return self._size
+
+    def _entries(self):
+        """(mtime, size, path) of every entry"""
+        entries = []
+        try:
+            names = os.listdir(self.path())
+        except OSError:
+            return entries
+        for name in names:
+            path = self.path(name)
+            try:
+                st = os.stat(path)
+            except OSError:
                 continue
-            payload = line[6:]
-            if payload == "[DONE]":
-                return
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
 
+    def _evict(self, target):
+        for mtime, size, path in sorted(self._entries()):
+            if self._size <= target:
+                break
             try:
-                evt = json.loads(payload)
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+
+_RESPONSE_CACHE = _ResponseCache()
+
+
+def _event_chunks(evt):
+    """Yield the `chat_stream` tuples carried by one decoded stream event"""
+    final = not evt.get("choices") and "usage" in evt  # openai include_usage
+    for choice in evt.get("choices", []):
+        delta = choice.get("delta", {})
+
+        # Harvest content / reasoning tokens
+        if "reasoning_content" in delta and delta["reasoning_content"]:
+            yield (True, delta["reasoning_content"])
+        elif "reasoning" in delta and delta["reasoning"]:  # groq
+            yield (True, delta["reasoning"])
+        elif "content" in delta and delta["content"]:
+            yield (False, delta["content"])
+        if not delta or evt.get("usage") or evt.get("timings"):
+            final = True  # timing report, alone or on the last delta
+    if final:
+        t = _parse_metrics(evt)
+        if t:
+            yield (t)
+
+
+class _SSEParser(object):
+    """
+    Incremental Server-Sent Events parser working on raw bytes.
+    Reads are appended to one reusable buffer and split into lines in a
+    single call; only the payloads of `data:` fields are kept (and later
+    decoded), comments and other fields are dropped as bytes.
+    Multi-line `data:` fields are joined by newlines.
+    """
+    def __init__(self):
+        self._buf = bytearray()
+        self._data = []  # data lines of the event being assembled
+
+    def feed(self, chunk):
+        """Add raw bytes, return the payloads of all completed events"""
+        buf = self._buf
+        buf += chunk
+        end = buf.rfind(b"\n")
+        if end < 0:
+            return []
+        lines = buf[:end + 1].splitlines()  # split once, in C
+        del buf[:end + 1]
+        events = []
+        data = self._data
+        for line in lines:
+            if not line:  # blank line dispatches the event
+                if data:
+                    events.append(data[0] if len(data) == 1
+                                  else b"\n".join(data))
+                    data = []
+            elif line[:5] == b"data:":
+                data.append(line[6:] if line[5:6] == b" " else line[5:])
+        self._data = data
+        return events
+
+    def close(self):
+        """Flush an unterminated last line/event at the end of the stream"""
+        events = self.feed(b"\n\n") if self._buf else []
+        if self._data:
+            events.append(b"\n".join(self._data))
+            self._data = []
+        return events
+
+
+_DELTA_KEY = b'"delta":'
+_METRICS_KEYS = (b'"usage"', b'"timings"')  # see _parse_metrics
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _has_metrics(payload):
+    """True if an event carries a (non-null) "usage" or "timings" block"""
+    for key in _METRICS_KEYS:
+        i = payload.find(key)
+        if i >= 0 and not payload[i + len(key):i + len(key) + 8] \
+                .lstrip(b": ").startswith(b"null"):
+            return True
+    return False
+
+
+def _decode_event(payload):
+    """
+    Decode one stream event. Token deltas - the bulk of every stream -
+    only decode the small "delta" object of their single choice; final
+    and unusual events are parsed in full, as is any event carrying
+    "usage" or "timings" (some servers send them with the last delta;
+    OpenAI's `"usage":null` on every delta does not count). (A JSON
+    string can never contain the raw bytes `"delta":`, so the key
+    lookups are exact.)
+    """
+    i = payload.find(_DELTA_KEY)
+    if i > 0 and payload.find(_DELTA_KEY, i + 8) < 0 \
+            and payload.rfind(b'"choices":', 0, i) >= 0 \
+            and not _has_metrics(payload):
+        delta = _JSON_DECODER.raw_decode(
+            payload[i + 8:].decode("utf-8").lstrip())[0]
+        if delta:
+            return {"choices": [{"delta": delta}]}
+    return json.loads(payload.decode("utf-8"))
+
+
+def _iter_sse_events(resp, cancel=None, size=65536):
+    """
+    Yield decoded JSON events from a streaming response until
+    "[DONE]", the end of the stream or cancellation.
+    """
+    read = getattr(resp, "read1", None) or resp.readline
+    parser = _SSEParser()
+    while True:
+        block = read(size)
+        payloads = parser.feed(block) if block else parser.close()
+        for payload in payloads:
+            if cancel and cancel.is_set():
+                return
+            if payload.strip() == b"[DONE]":
+                return
+            try:
+                yield _decode_event(payload)
             except ValueError:
                 continue
+        if not block:
+            return
+        if cancel and cancel.is_set():
+            return
 
-            # print(evt)  # debugging provider stream outputs
-            for choice in evt.get("choices", []):
-                delta = choice.get("delta", {})
-
-                # Harvest content / reasoning tokens
-                if "reasoning_content" in delta and delta["reasoning_content"]:
-                    yield (True, delta["reasoning_content"])
-                elif "reasoning" in delta and delta["reasoning"]:  # groq
-                    yield (True, delta["reasoning"])
-                elif "content" in delta and delta["content"]:
-                    yield (False, delta["content"])
-                elif not delta:  # Final timing report
-                    t = _parse_metrics(evt)
-                    if t:
-                        yield (t)
+
+class _RetryingStream(object):
+    """
+    `chat_stream` that retries 429, 5xx and connection errors with
+    jittered exponential backoff (honoring Retry-After), and after
+    "retry_attempts" failures on one model fails over to the next model
+    of `capability`. A retry after partial output sends the streamed
+    content back as an assistant prefix, so the model continues rather
+    than starting over, and drops the repeated reasoning.
+    `name`/`model` are those of the model currently streaming. `ticket`
+    is the scheduler slot streamed under; failing over to another system
+    trades it for a free slot there, also as `owner.ticket`.
+    """
+    MAX_DELAY = 60.0
+
+    def __init__(self, messages, name, model, cancel, stats,
+                 capability=None, ticket=None, owner=None):
+        settings = _config()
+        self.messages = messages
+        self.name = name
+        self.model = model
+        self.cancel = cancel
+        self.stats = stats
+        self.capability = capability
+        self.ticket = ticket
+        self.owner = owner
+        self.attempts = max(1, settings.get("retry_attempts", 3))
+        self.backoff = settings.get("retry_backoff", 1.0)
+        self.retries = 0
+        self.tried = [name]
+        self._content = []         # streamed answer so far
+        self._reasoned = False     # reasoning already shown
+        self._skip_reasoning = False
+        self._attempt = 0          # failures on the current model
+
+    def __iter__(self):
+        while True:
+            messages, model = self.request()
+            try:
+                for chunk in chat_stream(messages, model,
+                                         self.cancel, self.stats):
+                    if len(chunk) != 2 or self.accept(chunk):
+                        yield chunk
+                return
+            except Exception as e:
+                if self.cancel.is_set():  # the socket was shut down
+                    return
+                delay = self.failed(e)
+                if delay and self.cancel.wait(delay):
+                    return
+
+    def request(self):
+        """The (messages, model) of the next attempt"""
+        self._skip_reasoning = self._reasoned
+        if not self._content:
+            return self.messages, self.model
+        return self.messages + [{"role": "assistant",
+                                 "content": "".join(self._content)}], \
+            self.model
+
+    def accept(self, chunk):
+        """Record a stream chunk; False for reasoning already shown"""
+        if not chunk[0]:
+            self._content.append(chunk[1])
+        elif self._skip_reasoning:
+            return False
+        else:
+            self._reasoned = True
+        return True
+
+    def failed(self, error):
+        """
+        Count a failed attempt and return the delay before the next one
+        (after switching models on failover); re-raise `error` when it
+        is not retried.
+        """
+        if self.cancel.is_set() or not _is_retryable(error):
+            raise error
+        self._attempt += 1
+        self.retries += 1
+        if self._attempt < self.attempts:
+            delay = self._delay(error, self._attempt)
+            msg = "Retrying {} in {:.1f}s ({}/{}): {}".format(
+                self.name, delay, self._attempt, self.attempts - 1, error)
+        elif self._failover():
+            self._attempt, delay = 0, 0.0
+            msg = "Failing over to {}: {}".format(self.name, error)
+        else:
+            raise error
+        print(msg)
+        sublime.status_message(msg)
+        return delay
+
+    def _failover(self):
+        """Switch to the next untried model, False when there is none"""
+        if self.capability is None:
+            return False
+        while True:
+            name = _pick_model(self.capability, self.messages,
+                               exclude=self.tried)
+            if name is None:
+                return False
+            self.tried.append(name)
+            model = _config().models[name]
+            if self._move_slot(name, model):
+                break
+        self.name = name
+        self.model = model
+        return True
+
+    def _move_slot(self, name, model):
+        """Hold a slot on the system of `model`; False if none is free"""
+        if self.ticket is None:
+            return True
+        system, workers = _model_slot(name, model)
+        if system == self.ticket.system:
+            return True
+        ticket = _StreamTicket(None, system, workers, self.ticket.priority)
+        if not _SCHEDULER.try_acquire(ticket):
+            print("Failover: {} has no free slot".format(name))
+            return False
+        _SCHEDULER.release(self.ticket)
+        self.ticket = ticket
+        if self.owner is not None:
+            self.owner.ticket = ticket
+        return True
+
+    def _delay(self, error, attempt):
+        delay = random.uniform(0, self.backoff * 2 ** (attempt - 1))
+        headers = getattr(error, "headers", None)
+        after = headers.get("Retry-After") if headers else None
+        if after:
+            try:
+                delay = max(delay, float(after))
+            except ValueError:
+                when = email.utils.parsedate_tz(after)
+                if when:
+                    delay = max(delay,
+                                email.utils.mktime_tz(when) - time.time())
+        return min(delay, self.MAX_DELAY)
+
+
+def _is_retryable(error):
+    """Rate limits, server errors and dropped connections"""
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+_Protocol = asyncio.Protocol if asyncio else object
+
+
+class _HttpConnection(_Protocol):
+    """
+    One keep-alive HTTP/1.1 connection of `_StreamEngine`. The response
+    is parsed as the event loop delivers it - status line and headers,
+    then a chunked, sized or close-delimited body - and handed to the
+    current `_EngineStream` (`head()`, `body()`, `end()`) without ever
+    holding more than one partial chunk.
+    """
+    MAX_HEAD = 65536
+
+    def __init__(self, engine, key):
+        self.engine = engine
+        self.key = key
+        self.transport = None
+        self.sink = None        # _EngineStream of the running request
+        self.reused = False
+        self.last_used = 0.0
+        self._buf = bytearray()
+        self._state = None
+        self._left = 0          # bytes left in the current chunk/body
+        self._got = False       # any response bytes yet
+        self._keep = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send(self, request, sink):
+        self.sink = sink
+        self._buf = bytearray()
+        self._state = "head"
+        self._got = False
+        self.transport.write(request)
+
+    def drop(self):
+        """Forget the request and close the socket now"""
+        self.sink = None
+        if self.transport:
+            self.transport.abort()
+
+    def data_received(self, data):
+        self._got = True
+        buf = self._buf
+        buf += data
+        while self.sink is not None and buf:
+            state = self._state
+            if state == "head":
+                end = buf.find(b"\r\n\r\n")
+                if end < 0:
+                    if len(buf) > self.MAX_HEAD:
+                        self._fail(http.client.LineTooLong("header"))
+                    return
+                head = bytes(buf[:end + 2])
+                del buf[:end + 4]
+                self._head(head)
+            elif state == "size":
+                end = buf.find(b"\r\n")
+                if end < 0:
+                    return
+                try:
+                    size = int(bytes(buf[:end]).split(b";")[0], 16)
+                except ValueError:
+                    self._fail(http.client.IncompleteRead(bytes(buf[:end])))
+                    return
+                del buf[:end + 2]
+                self._left = size
+                self._state = "chunk" if size else "trailer"
+            elif state in ("chunk", "sized"):
+                if len(buf) <= self._left:
+                    block = bytes(buf)
+                    buf.clear()
+                else:
+                    block = bytes(buf[:self._left])
+                    del buf[:self._left]
+                self._left -= len(block)
+                self.sink.body(block)
+                if not self._left:
+                    if state == "sized":
+                        self._done()
+                    else:
+                        self._state = "crlf"
+            elif state == "crlf":
+                if len(buf) < 2:
+                    return
+                del buf[:2]
+                self._state = "size"
+            elif state == "trailer":
+                end = buf.find(b"\r\n")
+                if end < 0:
+                    return
+                del buf[:end + 2]
+                if not end:
+                    self._done()
+            elif state == "close":
+                block = bytes(buf)
+                buf.clear()
+                self.sink.body(block)
+            else:  # bytes after a complete response
+                self._keep = False
+                buf.clear()
+
+    def _head(self, head):
+        line, _, rest = head.partition(b"\r\n")
+        try:
+            version, status, reason = (line.decode("latin-1").split(None, 2)
+                                       + [""])[:3]
+            status = int(status)
+        except ValueError:
+            self._fail(http.client.BadStatusLine(line))
+            return
+        if 100 <= status < 200:  # interim response, the real one follows
+            return
+        headers = http.client.parse_headers(io.BytesIO(rest + b"\r\n"))
+        self._keep = version == "HTTP/1.1" and \
+            headers.get("Connection", "").lower() != "close"
+        if "chunked" in headers.get("Transfer-Encoding", "").lower():
+            self._state = "size"
+        elif headers.get("Content-Length") is not None:
+            self._state = "sized"
+            self._left = int(headers["Content-Length"])
+        else:
+            self._state = "close"
+            self._keep = False
+        self.sink.head(status, reason.strip(), headers)
+        if self._state == "sized" and not self._left and self.sink:
+            self._done()
+
+    def _done(self):
+        sink, self.sink = self.sink, None
+        self._state = None
+        if self._keep:
+            self.engine.checkin(self)
+        else:
+            self.transport.close()
+        sink.end(None)
+
+    def _fail(self, error):
+        sink, self.sink = self.sink, None
+        self.transport.abort()
+        sink.end(error)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.engine.forget(self)
+        sink, self.sink = self.sink, None
+        if sink is None:
+            return
+        if self._state == "close":
+            sink.end(None)
+        elif self.reused and not self._got:
+            sink.reconnect()  # stale keep-alive socket
+        else:
+            sink.end(exc or http.client.IncompleteRead(b""))
+
+
+class _EngineStream(object):
+    """
+    One `AgentStreamingTask` driven by `_ENGINE`: sends each attempt of
+    its `_RetryingStream` (backing off with loop timers), parses the
+    SSE body into the task's chunks and concludes the task at the end,
+    on an error that is not retried, or as soon as it is cancelled.
+    """
+    MAX_ERROR_BODY = 65536
+
+    def __init__(self, engine, task, retry):
+        self.engine = engine
+        self.task = task
+        self.retry = retry
+        self.conn = None
+        self.connecting = None  # loop task of a pending connect
+        self.timer = None       # backoff before the next attempt
+        self.done = False
+        self.metrics = None
+
+    def send(self):
+        self.timer = None
+        messages, model = self.retry.request()
+        url, data, headers, self.stream = _build_request(messages, model)
+        self.url = url
+        self.request = _http_request(url, data, headers)
+        self.parser = _SSEParser()
+        self.status = None
+        self.finished = False   # saw [DONE] or the metrics
+        self.body_buf = bytearray()
+        self.engine.open(url, self)
+
+    def reconnect(self):
+        self.conn = None
+        self.engine.open(self.url, self, fresh=True)
+
+    def connected(self, conn):
+        self.connecting = None
+        self.conn = conn
+        conn.send(self.request, self)
+
+    def head(self, status, reason, headers):
+        self.status, self.reason, self.headers = status, reason, headers
+        if status < 400:
+            self.task.metrics.first_byte()
+
+    def body(self, data):
+        if self.done:
+            return  # drained for keep-alive after the task concluded
+        if self.status >= 400 or not self.stream:
+            if len(self.body_buf) < self.MAX_ERROR_BODY or \
+                    self.status < 400:
+                self.body_buf += data
+            return
+        for payload in self.parser.feed(data):
+            self._event(payload)
+            if self.finished:
+                self._conclude(None)
+            if self.done:
+                return
+
+    def _event(self, payload):
+        if payload.strip() == b"[DONE]":
+            self.finished = True
+            return
+        try:
+            evt = _decode_event(payload)
+        except ValueError:
+            return
+        stats = self.task.metrics
+        stats.usage = _parse_usage(evt) or stats.usage
+        self._chunks(_event_chunks(evt))
+
+    def _chunks(self, chunks):
+        for chunk in chunks:
+            if len(chunk) != 2:
+                self.metrics = chunk
+                self.finished = True
+                return
+            if self.retry.accept(chunk) and not self.task._on_chunk(chunk):
+                self.engine.abort(self)
+                return
+
+    def end(self, error):
+        """The response completed (`error` None) or the request failed"""
+        self.conn = None
+        if self.done:
+            return
+        if error is None and self.status >= 400:
+            error = urllib.error.HTTPError(
+                self.url, self.status, self.reason, self.headers,
+                io.BytesIO(bytes(self.body_buf)))
+        elif error is None and not self.stream:
+            try:
+                resp = json.loads(self.body_buf.decode("utf-8"))
+                self._chunks(_message_chunks(resp, self.task.metrics))
+            except (ValueError, KeyError, IndexError) as e:
+                error = e
+        elif error is None:
+            for payload in self.parser.close():
+                if not self.finished:
+                    self._event(payload)
+        if error is None or self.done:
+            self._conclude(None)
+            return
+        try:
+            delay = self.retry.failed(error)
+        except Exception as e:
+            self._conclude(e)
+            return
+        self.timer = self.engine.loop.call_later(delay, self.send)
+
+    def abort(self):
+        """Stop now (on the loop): drop the connection and conclude"""
+        if self.timer:
+            self.timer.cancel()
+        if self.connecting:
+            self.connecting.cancel()
+        if self.conn:
+            self.conn.drop()
+            self.conn = None
+        self._conclude(None)
+
+    def _conclude(self, error):
+        if self.done:
+            return
+        self.done = True
+
+        def conclude():  # off the loop: the ledger writes to disk
+            try:
+                self.task._conclude(error, self.metrics)
+            finally:
+                self.task._release()
+        self.engine.loop.run_in_executor(None, conclude)
+
+
+def _http_request(url, data, headers):
+    """Raw bytes of an HTTP/1.1 POST of `data`"""
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    lines = ["POST {} HTTP/1.1".format(path),
+             "Host: {}".format(parts.netloc.rpartition("@")[2]),
+             "Content-Length: {}".format(len(data)),
+             "Accept-Encoding: identity"]
+    lines.extend("{}: {}".format(k, v) for k, v in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data
+
+
+class _StreamEngine(object):
+    """
+    Drives streams of the chat views on one background asyncio loop
+    ("stream_engine": "async") instead of one blocking thread each.
+    Each stream is an `_EngineStream` over a pooled `_HttpConnection`;
+    views stay registered in `_ACTIVE_STREAMERS` as for threads.
+    Hedged requests, models with "cache_responses", models reached
+    through a proxy and Python without asyncio (Sublime Text 3) keep
+    using the thread per stream.
+    """
+    def __init__(self):
+        self.loop = None
+        self._lock = threading.Lock()
+        self._idle = {}     # (scheme, host, port) -> [_HttpConnection]
+        self._ssl = None
+        self.max_idle = 30.0
+        self.requests = 0
+        self.reused = 0
+
+    def accepts(self, task):
+        """True when `task` can stream on the loop"""
+        settings = _config()
+        if asyncio is None or settings.get("stream_engine", "async") != "async":
+            return False
+        model_name = task.view.settings().get("agent_model")
+        model = settings.models.get(model_name)
+        if not model or model.get("cache_responses"):
+            return False
+        if urllib.parse.urlsplit(model.get("url", "")).scheme not in \
+                ("http", "https"):
+            return False
+        if _proxy_for(model["url"]) is not None:  # see _ConnectionPool
+            return False
+        return task._hedge_delay(model_name) is None
+
+    def submit(self, task):
+        """Run an admitted `task` on the loop (its begin off the loop)"""
+        self.max_idle = _config().get("keep_alive_timeout", 30.0)
+        loop = self._running_loop()
+        loop.call_soon_threadsafe(self._begin, task)
+
+    def abort(self, stream):
+        """Cancel `stream` from any thread"""
+        if self.loop is None:
+            return
+        if threading.current_thread() is self._thread:
+            stream.abort()
+        else:
+            self.loop.call_soon_threadsafe(stream.abort)
+
+    def reuse_rate(self):
+        return self.reused / self.requests if self.requests else 0.0
+
+    def stop(self):
+        with self._lock:
+            loop, self.loop = self.loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+
+    def _running_loop(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self.loop.run_forever, daemon=True,
+                    name="Agentic stream engine")
+                self._thread.start()
+            return self.loop
+
+    def _begin(self, task):
+        # The turn opens off the loop: fitting the context may summarize
+        future = self.loop.run_in_executor(None, task._begin)
+        future.add_done_callback(lambda f: self._begun(task, f))
+
+    def _begun(self, task, future):
+        try:
+            begun = future.result()
+        except Exception:
+            task._release()
+            task.registry.pop(task.view.id(), None)
+            raise
+        if not begun:
+            task._release()
+            return
+        stream = task.engine_stream = _EngineStream(
+            self, task, task._retrying())
+        stream.send()
+        task._cancel_event.on_set(lambda: self.abort(stream))
+
+    def open(self, url, stream, fresh=False):
+        """Connect `stream`, reusing an idle connection unless `fresh`"""
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        self.requests += 1
+        conn = None if fresh else self._checkout(key)
+        if conn is not None:
+            self.reused += 1
+            stream.connected(conn)
+            return
+        context = None
+        if scheme == "https":
+            if self._ssl is None:
+                self._ssl = _ssl_context()
+            context = self._ssl or True  # asyncio's default context
+        stream.connecting = self.loop.create_task(self.loop.create_connection(
+            lambda: _HttpConnection(self, key), parts.hostname, port,
+            ssl=context))
+        stream.connecting.add_done_callback(
+            lambda f: self._connected(stream, f))
+
+    def _connected(self, stream, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            stream.connecting = None
+            stream.end(error)
+            return
+        conn = future.result()[1]
+        if stream.done:
+            self.checkin(conn)
+        else:
+            stream.connected(conn)
+
+    def checkin(self, conn):
+        conn.last_used = time.time()
+        conn.reused = True
+        self._idle.setdefault(conn.key, []).append(conn)
+
+    def forget(self, conn):
+        idle = self._idle.get(conn.key, [])
+        if conn in idle:
+            idle.remove(conn)
+
+    def _checkout(self, key):
+        now = time.time()
+        idle = self._idle.get(key, [])
+        while idle:
+            conn = idle.pop()
+            if now - conn.last_used < self.max_idle and conn.transport \
+                    and not conn.transport.is_closing():
+                return conn
+            if conn.transport:
+                conn.transport.close()
+        return None
+
+
+_ENGINE = _StreamEngine()
+
+
+_CODE_BLOCK = re.compile(r"(```[^\n]*\n)(.*?)(```)", re.S)
+_ELIDE_LINES = 20   # code blocks longer than this may be elided
+_TRIM_TO = 0.8      # trim to this share of the budget, so the trimmed
+                    # prefix stays stable (and cached) for a few turns
+_SUMMARY_PROMPT = (
+    "Summarize the conversation below for the assistant that continues "
+    "it. Keep requirements, decisions, file and identifier names, code "
+    "that is still relevant, and open questions. Be concise.")
+
+
+def _context_tokens(messages):
+    return sum(len(m.get("content", "")) for m in messages) / CHARS_PER_TOKEN
+
+
+def _fit_context(messages, model, cancel=None, held=None, cached_only=False):
+    """
+    Fit `messages` into the model's "context" minus its "effort" using
+    "context_policy": "drop_oldest" turns, "elide_code" (long code blocks
+    of older turns), "summarize" (older turns, by a "models_low" model,
+    cached in `_RESPONSE_CACHE`) or "none". Leading system messages and
+    the last message are always kept; any policy falls back to dropping
+    the oldest turns. Returns `messages` itself when nothing changes.
+    `held` names the system whose slot the caller holds (see
+    `_summarize_turns`). With `cached_only`, returns None rather than
+    requesting a summary that is not stored yet.
+    """
+    budget = model.get("context", float("inf")) - model.get("effort", 0.0)
+    used = _context_tokens(messages)
+    policy = _config().get("context_policy", "drop_oldest")
+    if used <= budget or policy == "none":
+        return messages
+
+    target = budget * _TRIM_TO
+    split = 0
+    while split < len(messages) - 1 and messages[split]["role"] == "developer":
+        split += 1
+    head, body = messages[:split], list(messages[split:])
+    if policy == "elide_code":
+        body = _elide_code(head, body, target)
+    elif policy == "summarize":
+        body = _summarize_turns(head, body, target, cancel, held,
+                                cached_only)
+        if body is None:
+            return None
+    body = _drop_oldest(head, body, target)
+
+    fitted = head + body
+    msg = "Context: {:.0f} of {:.0f} tokens, {} to {:.0f}".format(
+        used, budget, policy, _context_tokens(fitted))
+    print(msg)
+    sublime.status_message(msg)
+    return fitted
+
+
+def _drop_oldest(head, body, target):
+    """Drop the oldest turns (never the last) until under `target`"""
+    while len(body) > 1 and _context_tokens(head + body) > target:
+        body.pop(0)
+        while len(body) > 1 and body[0]["role"] == "assistant":
+            body.pop(0)  # start at a user turn
+    return body
+
+
+def _elide_code(head, body, target):
+    """Replace long code blocks in older turns, oldest first"""
+    used = [_context_tokens(head + body)]
+
+    def elide(match):
+        code = match.group(2)
+        lines = code.count("\n")
+        if used[0] <= target or lines <= _ELIDE_LINES:
+            return match.group(0)
+        stub = "[... {} lines elided ...]\n".format(lines)
+        used[0] -= (len(code) - len(stub)) / CHARS_PER_TOKEN
+        return match.group(1) + stub + match.group(3)
+
+    for i in range(len(body) - 1):
+        if used[0] <= target:
+            break
+        content = _CODE_BLOCK.sub(elide, body[i]["content"])
+        if content != body[i]["content"]:
+            body[i] = dict(body[i], content=content)
+    return body
+
+
+def _summarize_turns(head, body, target, cancel=None, held=None,
+                     cached_only=False):
+    """
+    Replace the oldest turns with one summary message. A summary covers
+    a fixed prefix of the chat and is stored in `_RESPONSE_CACHE` under
+    the digest of (head, that prefix), so later submits reuse it with
+    the turns that follow for as long as those fit in `target`. Only
+    when they no longer fit are the turns that aged out since folded
+    into it (previous summary + those turns): one "models_low" request
+    per overflow rather than per submit. `held` is the system whose
+    slot the caller already holds; other systems are waited for.
+    Returns None when a new summary is needed and `cached_only` is set.
+    """
+    anchors = _summary_anchors(head, body)
+    start, summary = 0, None
+    for n in range(len(body) - 1, 0, -1):
+        if _RESPONSE_CACHE.has(anchors[n]):
+            entry = _RESPONSE_CACHE.get(anchors[n])
+            if entry is not None:
+                start, summary = n, "".join(
+                    c[1] for c in entry["chunks"] if len(c) == 2 and not c[0])
+                break
+    if summary is not None:
+        fitted = [_summary_message(summary)] + body[start:]
+        if _context_tokens(head + fitted) <= target:
+            return fitted
+
+    keep = len(body) - 1
+    while keep > start and _context_tokens(body[keep - 1:]) <= target / 2:
+        keep -= 1
+    if keep <= start:  # only the last turns are left: drop_oldest
+        return body if summary is None else fitted
+    if cached_only:
+        return None
+
+    name = _pick_model("models_low")
+    if name is None:
+        return body
+    low = _config().models[name]
+    room = (low.get("context", float("inf")) - low.get("effort", 0.0)) \
+        * _TRIM_TO * CHARS_PER_TOKEN
+    turns = ([_summary_message(summary)] if summary is not None else []) \
+        + body[start:keep]
+    transcript = "\n\n".join("{}: {}".format(m["role"], m["content"])
+                              for m in turns)
+    if len(transcript) > room:
+        transcript = transcript[-int(room):]
+    request = [{"role": "developer", "content": _SUMMARY_PROMPT},
+               {"role": "user", "content": transcript}]
+
+    sublime.status_message("Summarizing {} earlier messages with {}".format(
+        keep - start, name))
+    system, workers = _model_slot(name, low)
+    ticket = None
+    if system != held:
+        ticket = _BatchTicket(system, workers, priority=0)
+        _SCHEDULER.submit(ticket)
+        while not ticket.admitted.wait(0.1):
+            if cancel and cancel.is_set() and _SCHEDULER.dequeue(ticket):
+                return body
+    chunks = []
+    try:
+        for chunk in chat_stream(request, low, cancel):
+            if len(chunk) != 2:
+                break
+            if not chunk[0]:
+                chunks.append(chunk)
+    except Exception as e:
+        print("Could not summarize with {}: {}".format(name, e))
+        return body
+    finally:
+        if ticket:
+            _SCHEDULER.release(ticket)
+    if cancel and cancel.is_set():
+        return body
+    _RESPONSE_CACHE.put(anchors[keep], chunks)
+    return [_summary_message("".join(c[1] for c in chunks))] + body[keep:]
+
+
+def _summary_anchors(head, body):
+    """Cache key of a summary of `body[:n]`, for every n"""
+    digest = hashlib.sha256(b"summary")
+    digest.update(json.dumps(head, sort_keys=True).encode("utf-8"))
+    anchors = [digest.hexdigest()]
+    for message in body:
+        digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+        anchors.append(digest.hexdigest())
+    return anchors
+
+
+def _summary_message(summary):
+    return {"role": "user", "content":
+            "Summary of the earlier conversation:\n" + summary}
 
 
 class AgentStreamingTask(threading.Thread):
@@ -179,75 +1956,187 @@ class AgentStreamingTask(threading.Thread):
         self.view = view
         self.messages = messages
         self.registry = registry
-        self._cancel_event = threading.Event()
-        self.sanitize = sublime.load_settings(
-            "Agentic.sublime-settings").get("sanitize_output")
-        if self.sanitize:
-            _update_sanitize_dict()
-        self.show_reasoning = sublime.load_settings(
-            "Agentic.sublime-settings").get("show_reasoning")
-        self._buffer = []       # pending writes
-        self._pending = False   # a flush is already scheduled?
+        self._cancel_event = _CancelToken()
+        settings = _config()
+        self.sanitize = settings.get("sanitize_output")
+        self.keep_raw = self.sanitize and settings.get("sanitize_keep_raw",
+                                                       True)
+        self._raw_log = []    # unsanitized stream text (keep_raw)
+        self._shown_log = []  # the same text as written to the view
+        self._tail = ""       # unresolved look-alike prefix (sanitize)
+        self.show_reasoning = settings.get("show_reasoning")
+        self.reasoning_panel = _ReasoningPanel(view) if self.show_reasoning \
+            and settings.get("reasoning_output") == "panel" else None
+        self._buffer = collections.deque()  # pending writes
+        self._first_write = None  # time of the oldest unflushed write
+        self._last_flush = 0.0
+        self._visible = True
+        self._ui_cost = 0.0       # EWMA seconds per append
+        self._rate = 0.0          # EWMA writes per second
+        self._writes = 0          # writes since the last flush
+        self.flush_count = 0
+        self.flush_bytes = 0
+        self.flush_time = 0.0     # seconds spent appending on the UI thread
         self.start_time = time.time()
+        self.ticket = None      # scheduler slot, see start_streaming
+        self.metrics = None     # _StreamMetrics of the running request
+        self.hedge = None       # _HedgedStream when "hedge_requests" is on
+        self.retry = None       # _RetryingStream otherwise
+        self.record = None      # ledger record, once finished
+        self.on_done = None     # callback(record), see start_streaming
+        self.engine_stream = None  # _EngineStream when run on _ENGINE
 
     def cancel(self):
         self._cancel_event.set()
         self.view.settings().set("agentic_is_streaming", False)
+        if self.ticket and _SCHEDULER.dequeue(self.ticket):  # never ran
+            self.view.erase_status("agentic_queue")
+            self.registry.pop(self.view.id(), None)
+            if self.on_done:
+                self.on_done(None)
+
+    def launch(self):
+        """Start streaming once admitted: on `_ENGINE` when it can drive
+        the model, otherwise on this task's own thread"""
+        if _ENGINE.accepts(self):
+            _ENGINE.submit(self)
+        else:
+            self.start()
 
     def run(self):
-        prev_reasoning = False
-        cache, tps = (0.0, None)  # default empty performance
-
-        self._write("\n\n# --- Agent ---\n")
-        sublime.set_timeout(
-            lambda: self.view.run_command(
-                "move_to", {"to": "eof", "extend": False}), 0)
-
-        if self.view.settings().get("agent_model") is None:
-            self.view.settings().set(
-                "agent_model",
-                _pick_model())
-
-        # Load latest model settings
-        models = sublime.load_settings("Agentic.sublime-settings").get("models")
-        model_name = self.view.settings().get("agent_model")
-        model = models[model_name]
+        try:
+            self._run()
+        finally:
+            self._release()
 
-        status_string = "Streaming {}.".format(model_name)
-        sublime.status_message(status_string)
-        print(status_string)
+    def _release(self):
+        if self.ticket:
+            _SCHEDULER.release(self.ticket)
 
+    def _run(self):
+        if not self._begin():
+            return
+        delay = self._hedge_delay(self.model_name)
+        if delay is None:
+            source = self._retrying()
+        else:
+            source = self.hedge = _HedgedStream(
+                self, self.model_name, self.model, delay)
+        error, metrics = None, None
         try:
-            for chunk in chat_stream(self.messages, model, self._cancel_event):
+            for chunk in source:
                 # Normal (2-tuple) chunk vs. metrics (4-tuple)
-                if len(chunk) == 2:
-                    is_reasoning, text = chunk
-                else:
-                    cache, prompt, pps, tps = chunk
+                if len(chunk) != 2:
+                    metrics = chunk
                     break
-
-                if self._cancel_event.is_set() or not self.is_valid():
-                    self._cancel_event.set()
-                    sublime.status_message("Interrupted")
+                if not self._on_chunk(chunk):
                     break
+        except Exception as e:
+            error = e
+        self._conclude(error, metrics)
+
+    def _begin(self):
+        """
+        Open the agent turn; False when cancelled while being admitted
+        or when the chat's model is not (or no longer) configured
+        """
+        if self._cancel_event.is_set():  # cancelled while being admitted
+            self.registry.pop(self.view.id(), None)
+            if self.on_done:
+                _set_timeout(lambda: self.on_done(None), 0)
+            return False
+        # Load latest model settings
+        self.model_name = self.view.settings().get("agent_model")
+        self.model = _config().models.get(self.model_name)
+        if self.model is None:  # e.g. a saved chat naming a removed model
+            msg = 'Unknown model "{}"'.format(self.model_name)
+            print(msg)
+            sublime.status_message(msg)
+            self.registry.pop(self.view.id(), None)
+            self.view.settings().set("agentic_is_streaming", False)
+            if self.on_done:
+                _set_timeout(lambda: self.on_done(None), 0)
+            return False
+        self.start_time = time.time()  # exclude time spent queued
+        self._prev_reasoning = False
+
+        self._emit("\n\n# --- Agent ---\n")
+        _set_timeout(
+            lambda: self.view.run_command(
+                "move_to", {"to": "eof", "extend": False}), 0)
 
-                if is_reasoning:
-                    if not self.show_reasoning:
-                        continue
-                    if not prev_reasoning:  # first reasoning message
-                        self._write("\n## --- Thinking ---\n>")
-                        prev_reasoning = True
-                    text = text.replace("\n", "\n> ")
-                else:
-                    if prev_reasoning:
-                        self._write("\n\n## --- Response ---\n")
-                        prev_reasoning = False
-                self._write(text)
+        self.messages = _fit_context(
+            self.messages, self.model, self._cancel_event,
+            self.ticket.system if self.ticket else None)
 
-        except Exception as e:
+        status_string = "Streaming {}.".format(self.model_name)
+        sublime.status_message(status_string)
+        print(status_string)
+
+        self.metrics = _StreamMetrics()
+        return True
+
+    def _hedge_delay(self, model_name):
+        """
+        Seconds before hedging this stream, None when not hedged: pinned
+        chats and chats on one chosen model (no "agent_capability") have
+        no list to take a backup from
+        """
+        settings = self.view.settings()
+        if settings.get("agent_pinned", False) or \
+                not settings.get("agent_capability"):
+            return None
+        return _HedgedStream.delay_for(model_name)
+
+    def _retrying(self):
+        pinned = self.view.settings().get("agent_pinned", False)
+        self.retry = _RetryingStream(
+            self.messages, self.model_name, self.model, self._cancel_event,
+            self.metrics, None if pinned else
+            self.view.settings().get("agent_capability"),
+            self.ticket, owner=self)
+        return self.retry
+
+    def _on_chunk(self, chunk):
+        """Show one (is_reasoning, text) chunk; False to stop streaming"""
+        is_reasoning, text = chunk
+        self.metrics.chunk(is_reasoning)  # the winner's, when hedged
+
+        if self._cancel_event.is_set() or not self.is_valid():
+            self._cancel_event.set()
+            sublime.status_message("Interrupted")
+            return False
+
+        if is_reasoning:
+            if not self.show_reasoning:
+                return True
+            if self.reasoning_panel:  # only a marker goes into the chat
+                if not self._prev_reasoning:
+                    label = self.reasoning_panel.begin(self._streamed_model(
+                        self.model_name, self.model)[0])
+                    self._emit("\n## --- Thinking ---\n> {} "
+                               "(AI Agent Show Reasoning)".format(label))
+                    self._prev_reasoning = True
+                self.reasoning_panel.write(text)
+                return True
+            if not self._prev_reasoning:  # first reasoning message
+                self._emit("\n## --- Thinking ---\n>")
+                self._prev_reasoning = True
+            text = text.replace("\n", "\n> ")
+        else:
+            if self._prev_reasoning:
+                self._emit("\n\n## --- Response ---\n")
+                self._prev_reasoning = False
+        self._emit(text)
+        return True
+
+    def _conclude(self, error, metrics):
+        """Close the turn after the stream ended, failed or was cancelled"""
+        model_name, model = self._streamed_model(self.model_name, self.model)
+        if error is not None:
             error_details = ""
             try:
-                error_details = "\n" + e.read().decode('utf-8')
+                error_details = "\n" + error.read().decode('utf-8')
             except Exception:
                 pass
             print(
@@ -257,97 +2146,873 @@ class AgentStreamingTask(threading.Thread):
                     model.get("model", '"model" field missing"'),
                     model.get("url", '"url" field missing'),
                     model.get("options", {}),
-                    str(e),
+                    str(error),
                     error_details))
-            sublime.status_message("Streaming Error: {}".format(str(e)))
-            sublime.set_timeout(self._finalize, 0)
+            sublime.status_message("Streaming Error: {}".format(str(error)))
+            self._summarize(model_name, model, "error")
+            self._end_turn()
+            _set_timeout(self._finalize, 0)
             return
-
-        ## Estimate and print usage based on elapsed time
-        if not tps:
-            tps = model.get("speed", float("NaN"))
-
-        # Estimate generated tokens and measure input.
-        gen_estimate = (time.time() - self.start_time) * tps
-        input_tokens = sum([len(m.get("content", 0)) for m in self.messages]) / CHARS_PER_TOKEN
+        self._end_turn()
+        cache, prompt, pps, tps = metrics or (0.0, None, None, None)
+        stats = self.metrics
+
+        ## Summarize measured usage (exact counts when the server reports them)
+        outcome = "cancelled" if self._cancel_event.is_set() else "done"
+        record = self._summarize(model_name, model, outcome, cache, pps, tps)
+        exact = "" if stats.usage else "~"
+        print("Latency: first byte {}, first token {}, first content {}. "
+              "Gaps p50/p95/max: {:.0f}/{:.0f}/{:.0f} ms. "
+              "Tokens in/out: {}{}/{}{}".format(
+                  _fmt_seconds(record["ttfb"]), _fmt_seconds(record["ttft"]),
+                  _fmt_seconds(record["ttfc"]),
+                  stats.gap(0.5) * 1000, stats.gap(0.95) * 1000,
+                  stats.gap(1.0) * 1000, exact, record["prompt_tokens"],
+                  exact, record["output_tokens"]))
 
         # Compute total context usage and percentage of model's context
-        used_context = input_tokens + gen_estimate
+        used_context = record["prompt_tokens"] + record["output_tokens"]
         fraction_used = used_context / model.get("context", float("NaN"))
 
-        # Calculate cost based on inputs
-        token_cost = model.get("cost", float("NaN")) * 1e-6
-        cost = cache * 0.02 * token_cost \
-                + (input_tokens - cache) * 0.2 * token_cost \
-                + gen_estimate * token_cost
-
         # Log status
-        status = "Streaming Done. {}. Tk/s: {}. Context: {} ({:.0f}%). Cost: {:.3}".format(
-                            model_name, int(tps), int(used_context), fraction_used*100, cost)
+        status = "Streaming Done. {}. TTFT: {}. Tk/s: {:.0f}. Context: {}{} ({:.0f}%). Cost: {:.3}".format(
+                            model_name, _fmt_seconds(record["ttft"]),
+                            record["tps"] or model.get("speed", float("NaN")),
+                            exact, int(used_context),
+                            fraction_used*100, record["cost"])
+        if prompt is not None and cache + prompt:
+            status += ". Cache: {:.0f}%{}".format(
+                100.0 * cache / (cache + prompt),
+                " (raw history)" if self.keep_raw else "")
+        if stats.replayed:
+            status += ". Replayed from the response cache"
+        saved = _PREFETCHER.saved(self.view, model_name, cache)
+        if saved:
+            print("Warm-up saved {} prompt tokens, ~{} of prefill".format(
+                int(saved[0]), _fmt_seconds(saved[1])))
+            status += ". Warm-up saved ~{}".format(_fmt_seconds(saved[1]))
 
         print(status)
+        pool = _ENGINE if self.engine_stream else _POOL
+        print("Connections reused: {}/{} ({:.0f}%)".format(
+            pool.reused, pool.requests, pool.reuse_rate() * 100))
         sublime.status_message(status)
-        sublime.set_timeout(self._finalize, 0)
+        _set_timeout(self._finalize, 0)
+
+    def _streamed_model(self, model_name, model):
+        """The (name, model) that answered, after a hedge or failover"""
+        if self.hedge and self.hedge.winner:
+            return self.hedge.winner.name, self.hedge.winner.model
+        if self.retry:
+            return self.retry.name, self.retry.model
+        return model_name, model
+
+    def _summarize(self, model_name, model, outcome,
+                   cache=0.0, pps=None, tps=None):
+        """Build this request's usage record and append it to the ledger"""
+        record = _usage_record(model_name, model, self.metrics,
+                               self.messages, outcome, cache, pps, tps)
+        record["hedge"] = self.hedge.hedge_record() if self.hedge else None
+        record["retries"] = self.retry.retries if self.retry else 0
+        _LEDGER.append(record)
+        self.record = record
+        return record
+
+    def _emit(self, text):
+        """
+        Shape stream text on the worker thread: sanitize it (carrying a
+        look-alike sequence that may continue in the next chunk) and
+        queue the finished string for the view.
+        """
+        if self.sanitize:
+            shown, self._tail = _sanitize_stream(self._tail + text)
+            if self.keep_raw:
+                self._raw_log.append(text)
+                self._shown_log.append(shown)
+            text = shown
+        if text:
+            self._write(text)
+
+    def _end_turn(self):
+        """Write out the carried tail and record the raw turn"""
+        if self._tail:
+            shown = _sanitize_text(self._tail)
+            self._tail = ""
+            if self.keep_raw:
+                self._shown_log.append(shown)
+            self._write(shown)
+        if self.keep_raw:
+            _RAW_TURNS.record(self.view, "".join(self._shown_log),
+                              "".join(self._raw_log))
 
     def _write(self, txt):
         self._buffer.append(txt)            # atomic under the GIL
-        time = 25 if len(self._buffer) < 96 else 0
-        if not self._pending:               # schedule a debounced flush
-            self._pending = True
-            sublime.set_timeout(self.__flush, time)  # balance responsiveness and power
+        self._writes += 1
+        if self._first_write is None:
+            self._first_write = time.time()
+        _FLUSHER.notify(self)
 
     def is_valid(self):
         return self.view and self.view.is_valid() \
                 and self.view.window() and self.view.window().is_valid()
 
-    def __flush(self):
-        """Do not run outside of sublime.set_timeout"""
-        self._pending = False
+    def _flush(self):
+        """Do not run outside of sublime.set_timeout (see _FlushScheduler)"""
+        now = time.time()
+        if self._last_flush:
+            rate = self._writes / max(now - self._last_flush, 1e-3)
+            self._rate += 0.3 * (rate - self._rate)
+        self._first_write = None
+        self._last_flush = now
+        self._writes = 0
         if not self.is_valid():
             self._buffer.clear()
             return
 
         parts = []
-        while self._buffer:                 # pop everything (O(1) each)
-            parts.append(self._buffer.pop())
+        while self._buffer:                 # pop in order (O(1) each)
+            parts.append(self._buffer.popleft())
         if not parts:
             return
 
-        out_string = "".join(parts[::-1])
-        if self.sanitize:
-            out_string = _sanitize_text(out_string)
-
-        self.view.run_command(
-            "append",
-            {"characters": out_string}  # restore original order
-        )
+        out_string = "".join(parts)
+        t0 = time.perf_counter()
+        self.view.run_command("append", {"characters": out_string})
+        cost = time.perf_counter() - t0
+        self._ui_cost += 0.3 * (cost - self._ui_cost)
+        self.flush_count += 1
+        self.flush_bytes += len(out_string)
+        self.flush_time += cost
+
+    def flush_stats(self):
+        """Per-stream flush counters, for the console summary"""
+        return "Flushes: {}, {:.0f} chars/flush, UI {:.1f} ms, {:.0f} writes/s".format(
+            self.flush_count, self.flush_bytes / max(self.flush_count, 1),
+            self.flush_time * 1000, self._rate)
 
     def _finalize(self):
+        if self.on_done:
+            self.on_done(self.record)
         if not self.is_valid():
             return
         self.registry.pop(self.view.id(), None)
         self._write("\n\n# --- User ---\n")
         self.view.settings().set("agentic_is_streaming", False)
+        print(self.flush_stats())
+
+
+def _usage_record(model_name, model, stats, messages, outcome,
+                  cache=0.0, pps=None, tps=None):
+    """Ledger record of one request from its `_StreamMetrics`"""
+    tps = stats.tps() or tps
+    input_tokens = stats.prompt_tokens(messages)
+    output_tokens = stats.output_tokens()
+    if stats.usage:
+        cache = stats.usage[1] or cache
+    input_tokens = max(input_tokens, cache)  # estimate below server count
+
+    # Calculate cost based on inputs
+    token_cost = model.get("cost", float("NaN")) * 1e-6
+    cost = cache * 0.02 * token_cost \
+            + (input_tokens - cache) * 0.2 * token_cost \
+            + output_tokens * token_cost
+    if stats.replayed:
+        cost = 0.0
+
+    return {
+        "time": time.time(),
+        "model": model_name,
+        "system": model.get("system", model_name),
+        "outcome": outcome,
+        "exact": stats.usage is not None,
+        "prompt_tokens": int(input_tokens),
+        "cached_tokens": int(cache),
+        "output_tokens": output_tokens,
+        "ttfb": stats.since_start(stats.t_first_byte),
+        "ttft": stats.since_start(stats.t_first_token),
+        "ttfc": stats.since_start(stats.t_first_content),
+        "tps": tps,
+        "pps": pps,
+        "cost": cost,
+        "replayed": stats.replayed,
+    }
+
+
+class _Contender(object):
+    """One model racing in a `_HedgedStream`"""
+    def __init__(self, name, model, stats, ticket):
+        self.name = name
+        self.model = model
+        self.stats = stats
+        self.ticket = ticket
+        self.cancel = _CancelToken()
+
+
+class _HedgedStream(object):
+    """
+    `chat_stream` for a task that races a backup model when the task's
+    model has not produced a token within `delay` seconds (or failed
+    first). The backup is the best-scoring model of the chat's capability
+    list on another system with a free slot. The first contender to
+    produce output wins; the other is cancelled and its scheduler slot
+    released at once, and the task adopts the winner's ticket and stats.
+    """
+    POLL = 0.1  # seconds between checks of the task's cancel event
+
+    def __init__(self, task, name, model, delay):
+        self.task = task
+        self.delay = delay
+        self.fired = False
+        self.winner = None  # _Contender
+        self.contenders = []  # still racing
+        self.names = []       # every model started, primary first
+        self._queue = queue.Queue()
+        self.primary = _Contender(name, model, task.metrics, task.ticket)
+        self._start(self.primary)
+        task._cancel_event.on_set(self._cancel_all)
+
+    @staticmethod
+    def delay_for(model_name):
+        """Seconds to wait before hedging `model_name`, None if disabled"""
+        settings = _config()
+        if not settings.get("hedge_requests", False):
+            return None
+        delay = settings.get("hedge_delay", "p95")
+        if delay != "p95":
+            return float(delay)
+        rollup = _LEDGER.rollups().get(model_name)
+        if rollup is None or len(rollup.recent["ttft"]) < 20:
+            return 5.0  # until there is a meaningful p95
+        return max(0.5, rollup.percentile("ttft", 0.95))
+
+    def _start(self, contender):
+        self.contenders.append(contender)
+        self.names.append(contender.name)
+        threading.Thread(target=self._pump, args=(contender,),
+                         daemon=True).start()
+
+    def _pump(self, contender):
+        try:
+            for chunk in _RetryingStream(self.task.messages, contender.name,
+                                         contender.model, contender.cancel,
+                                         contender.stats):
+                if contender.cancel.is_set():
+                    break
+                self._queue.put((contender, chunk))
+        except Exception as e:
+            self._queue.put((contender, e))
+        else:
+            self._queue.put((contender, None))
+
+    def _fire(self):
+        """Start the backup model, if one is free"""
+        self.fired = True
+        primary = self.primary
+        models = _config().models
+        capability = self.task.view.settings().get("agent_capability")
+        system = _model_slot(primary.name, primary.model)[0]
+        same_system = [n for n, m in models.items()
+                       if _model_slot(n, m)[0] == system]
+        name = _pick_model(capability, self.task.messages, affinity=system,
+                           exclude=same_system)
+        if name is None:
+            print("Hedge: no backup for {} in {}".format(primary.name,
+                                                         capability))
+            return
+        ticket = _StreamTicket(None, *_model_slot(name, models[name]))
+        if not _SCHEDULER.try_acquire(ticket):
+            print("Hedge: {} has no free slot".format(name))
+            return
+        print("Hedge: racing {} against {} after {:.1f}s".format(
+            name, primary.name, time.perf_counter() - primary.stats.t_start))
+        stats = _StreamMetrics()
+        stats.t_start = primary.stats.t_start  # TTFT as the user sees it
+        self._start(_Contender(name, models[name], stats, ticket))
+
+    def _cancel_all(self):
+        """The task was cancelled: abort every contender's request now"""
+        for contender in list(self.contenders):
+            contender.cancel.set()
+
+    def _drop(self, contender):
+        """Cancel a contender and free its slot"""
+        contender.cancel.set()
+        _SCHEDULER.release(contender.ticket)
+        if contender.ticket is self.task.ticket:
+            self.task.ticket = None  # already released
+        self.contenders.remove(contender)
+
+    def _win(self, contender):
+        self.winner = contender
+        self.task.ticket = contender.ticket
+        self.task.metrics = contender.stats
+        for other in list(self.contenders):
+            if other is not contender:
+                self._drop(other)
+        if self.fired:
+            print("Hedge: {} won".format(contender.name))
+
+    def hedge_record(self):
+        """The ledger's "hedge" field: None unless the hedge fired"""
+        if len(self.names) < 2 or self.winner is None:
+            return None
+        return {"primary": self.names[0], "backup": self.names[1],
+                "winner": self.winner.name}
+
+    def __iter__(self):
+        deadline = time.perf_counter() + self.delay
+        error = None
+        try:
+            while self.contenders:
+                if self.task._cancel_event.is_set():
+                    return
+                wait = self.POLL
+                if not self.fired:
+                    wait = min(wait, max(0.0, deadline - time.perf_counter()))
+                try:
+                    contender, item = self._queue.get(timeout=wait)
+                except queue.Empty:
+                    if not self.fired and time.perf_counter() >= deadline:
+                        self._fire()
+                    continue
+                if contender not in self.contenders:
+                    continue  # leftovers of a dropped contender
+                if isinstance(item, Exception):
+                    if self.winner is not None:
+                        raise item
+                    error = item
+                    self._drop(contender)
+                    if not self.fired:  # fail over right away
+                        self._fire()
+                    continue
+                if self.winner is None:
+                    self._win(contender)
+                if item is None:
+                    return
+                yield item
+            if error is not None:
+                raise error
+        finally:
+            for contender in list(self.contenders):
+                if contender is not self.winner:
+                    self._drop(contender)
+
+
+class _RawTurns(object):
+    """
+    Unsanitized shadow copies of assistant turns, per buffer.
+    With `sanitize_output` the view shows sanitized text, which no longer
+    matches the tokens the server generated (and cached). Turns are keyed
+    by their sanitized content: a turn the user did not edit still
+    matches its key and is sent back with the raw text, an edited turn
+    falls back to the buffer text.
+    """
+    def __init__(self):
+        self._turns = {}  # buffer id -> {sanitized content: raw content}
+
+    def record(self, view, shown, raw):
+        """Store the assistant turn a stream wrote as `shown` / `raw`"""
+        shown_msgs = [m for m in _build_messages_from_text(shown)
+                      if m["role"] == "assistant"]
+        raw_msgs = [m for m in _build_messages_from_text(raw)
+                    if m["role"] == "assistant"]
+        if len(shown_msgs) != 1 or len(raw_msgs) != 1:
+            return
+        key = shown_msgs[0]["content"].strip()
+        if key and key != raw_msgs[0]["content"].strip():
+            self._turns.setdefault(view.buffer_id(), {})[key] = \
+                raw_msgs[0]["content"].strip()
+
+    def restore(self, view, messages):
+        """Swap untouched assistant turns in `messages` for their raw text"""
+        turns = self._turns.get(view.buffer_id())
+        if not turns:
+            return messages
+        for m in messages:
+            if m["role"] != "assistant":
+                continue
+            key = m["content"].strip()
+            if key in turns:
+                m["content"] = m["content"].replace(key, turns[key], 1)
+        return messages
 
+    def copy(self, source, target):
+        turns = self._turns.get(source.buffer_id())
+        if turns:
+            self._turns[target.buffer_id()] = dict(turns)
 
-def start_streaming(view, messages, model_name=None):
-    """Public helper - start a streaming task on a view"""
+    def discard(self, view):
+        self._turns.pop(view.buffer_id(), None)
+
+
+_RAW_TURNS = _RawTurns()
+
+
+def _reasoning_panel_name(view):
+    return "agentic_reasoning_{}".format(view.id())
+
+
+class _ReasoningPanel(object):
+    """
+    Reasoning of one chat turn, streamed into the chat's output panel
+    ("reasoning_output": "panel") instead of the chat buffer. Flushed
+    by `_FLUSHER` like a stream, but as plain appends - no quoting,
+    sanitizing or raw history - at the hidden cadence unless the panel
+    is shown.
+    """
+    def __init__(self, chat):
+        self.chat = chat
+        self.name = _reasoning_panel_name(chat)
+        self.view = None          # the panel, once created
+        self._buffer = collections.deque()
+        self._first_write = None
+        self._last_flush = 0.0
+        self._visible = False
+        self._ui_cost = 0.0
+
+    def begin(self, model_name):
+        """Open this turn's section; return the label marking it in the chat"""
+        label = "{} {}".format(time.strftime("%H:%M:%S"), model_name)
+        self.write("\n--- {} ---\n".format(label))
+        return label
+
+    def write(self, text):
+        """Called from the worker thread"""
+        self._buffer.append(text)
+        if self._first_write is None:
+            self._first_write = time.time()
+        _FLUSHER.notify(self)
+
+    def _flush(self):
+        """Do not run outside of sublime.set_timeout (see _FlushScheduler)"""
+        self._first_write = None
+        self._last_flush = time.time()
+        window = self.chat.window()
+        if not window:
+            self._buffer.clear()
+            return
+        parts = []
+        while self._buffer:
+            parts.append(self._buffer.popleft())
+        t0 = time.perf_counter()
+        self.view = window.find_output_panel(self.name) \
+            or window.create_output_panel(self.name)
+        self.view.run_command("append", {"characters": "".join(parts),
+                                         "scroll_to_end": True})
+        self._ui_cost += 0.3 * (time.perf_counter() - t0 - self._ui_cost)
+
+
+class _UiProfiler(object):
+    """
+    Opt-in ("profile_ui") wall time of the code Agentic runs on the UI
+    thread: every command's `run`, the listeners' event handlers and
+    every `_set_timeout` callback, as a histogram per call site. Only
+    used on the UI thread, so it needs no lock; disabled, it costs one
+    attribute check per call.
+    """
+    BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.004, 0.008,
+              0.016, 0.033, 0.066, 0.125, 0.25, 0.5, 1.0)  # seconds
+    STALL = 0.016  # a dropped frame
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.sites = {}  # site -> [calls, seconds, max, histogram]
+        self.since = time.time()
+
+    def record(self, site, seconds):
+        entry = self.sites.get(site)
+        if entry is None:
+            entry = self.sites[site] = [0, 0.0, 0.0,
+                                        [0] * (len(self.BOUNDS) + 1)]
+        entry[0] += 1
+        entry[1] += seconds
+        if seconds > entry[2]:
+            entry[2] = seconds
+        entry[3][bisect.bisect_left(self.BOUNDS, seconds)] += 1
+
+    def wrap(self, callback, site):
+        """`callback` timed as `site`"""
+        def profiled(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                self.record(site, time.perf_counter() - t0)
+        return profiled
+
+    def percentile(self, histogram, q):
+        """Upper bucket bound (seconds) below which a share `q` of calls fell"""
+        target = q * sum(histogram)
+        seen = 0
+        for bound, count in zip(self.BOUNDS + (float("inf"),), histogram):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+    def stalls(self, histogram):
+        return sum(histogram[bisect.bisect_left(self.BOUNDS, self.STALL) + 1:])
+
+    def report(self, top=40):
+        """The worst call sites by total time, as text lines"""
+        sites = sorted(self.sites.items(), key=lambda s: -s[1][1])
+        header = "{:52} {:>7} {:>9} {:>8} {:>8} {:>8} {:>6}".format(
+            "site", "calls", "total ms", "mean ms", "p95 ms", "max ms",
+            ">16ms")
+        lines = [
+            "Agentic UI thread profile since {} - {} calls, {:.1f} ms, "
+            "{} over 16 ms".format(
+                time.strftime("%H:%M:%S", time.localtime(self.since)),
+                sum(e[0] for _, e in sites),
+                sum(e[1] for _, e in sites) * 1000,
+                sum(self.stalls(e[3]) for _, e in sites)),
+            "", header, "-" * len(header)]
+        for site, (calls, seconds, worst, histogram) in sites[:top]:
+            lines.append("{:52} {:>7} {:>9.1f} {:>8.2f} {:>8} {:>8.1f} {:>6}".format(
+                site[-52:], calls, seconds * 1000, seconds * 1000 / calls,
+                "<={:g}".format(self.percentile(histogram, 0.95) * 1000),
+                worst * 1000, self.stalls(histogram)))
+        if not sites:
+            lines.append("(nothing recorded yet)")
+        return lines
+
+
+_PROFILER = _UiProfiler()
+
+
+def _set_timeout(callback, delay=0, site=None):
+    """`sublime.set_timeout`, timed per call site when "profile_ui" is on"""
+    if _PROFILER.enabled:
+        callback = _PROFILER.wrap(callback, site or _call_site(callback))
+    sublime.set_timeout(callback, delay)
+
+
+def _call_site(callback):
+    """A readable name for a callback: qualified name, line for lambdas"""
+    func = getattr(callback, "__func__", callback)
+    name = getattr(func, "__qualname__", None) or repr(func)
+    code = getattr(func, "__code__", None)
+    if name.endswith("<lambda>") and code is not None:
+        name = "{} lambda:{}".format(name.replace(".<locals>.<lambda>", ""),
+                                     code.co_firstlineno)
+    return name
+
+
+def _profile_ui_entry_points(namespace):
+    """
+    Time the commands' `run` and the listeners' (non-async) event
+    handlers defined in `namespace` while profiling is on. The wrappers
+    keep the signature (`functools.wraps`), which Sublime Text inspects
+    to prompt for missing command arguments.
+    """
+    listeners = tuple(getattr(sublime_plugin, name) for name in
+                      ("EventListener", "TextChangeListener")
+                      if hasattr(sublime_plugin, name))
+    for name, cls in list(namespace.items()):
+        if not isinstance(cls, type):
+            continue
+        if issubclass(cls, (sublime_plugin.WindowCommand,
+                            sublime_plugin.TextCommand)):
+            methods = ["run"]
+        elif issubclass(cls, listeners):
+            methods = [m for m in vars(cls) if m.startswith("on_")
+                       and not m.endswith("_async")]
+        else:
+            continue
+        for method in methods:
+            if method in vars(cls):
+                setattr(cls, method, _profiled(
+                    vars(cls)[method], "{}.{}".format(name, method)))
+
+
+def _profiled(method, site):
+    @functools.wraps(method)
+    def profiled(*args, **kwargs):
+        if not _PROFILER.enabled:
+            return method(*args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            _PROFILER.record(site, time.perf_counter() - t0)
+    return profiled
+
+
+class _FlushScheduler(object):
+    """
+    Coalesce the pending writes of all streams into shared UI ticks.
+    A stream is flushed once its interval has passed since its last
+    flush - immediately for a stream that was idle. The interval adapts
+    to the stream's write rate: below SLOW_RATE every write is shown as
+    it arrives, above FAST_RATE the interval stretches (up to
+    FAST_FRAMES frames) so each append carries a bigger batch. It also
+    grows with the measured cost of its `append` (so one stream takes
+    at most UI_SHARE of the UI thread), and hidden views use a slow
+    cadence. A tick stops after FRAME_BUDGET seconds, the rest go next
+    frame.
+    """
+    FRAME_BUDGET = 0.008
+    UI_SHARE = 0.2
+    MIN_INTERVAL = 0.016
+    MAX_INTERVAL = 0.25
+    HIDDEN_INTERVAL = 1.0
+    SLOW_RATE = 20.0    # writes/s: further apart than a few frames
+    FAST_RATE = 120.0   # writes/s: about two per frame
+    FAST_FRAMES = 4
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = collections.OrderedDict()  # tasks with writes
+        self._tick_at = None  # time of the next scheduled tick
+
+    def notify(self, task):
+        """Called from any thread after `task` buffered text"""
+        due = self._due(task)
+        with self._lock:
+            self._pending[task] = True
+            if self._tick_at is not None and self._tick_at <= due:
+                return
+            self._tick_at = due
+        self._schedule(due)
+
+    def _due(self, task):
+        if not task._visible:
+            interval = self.HIDDEN_INTERVAL
+        else:
+            rate = task._rate
+            if rate < self.SLOW_RATE:
+                batch = 0.0
+            else:
+                batch = self.MIN_INTERVAL * min(max(rate / self.FAST_RATE,
+                                                    1.0), self.FAST_FRAMES)
+            interval = min(max(task._ui_cost / self.UI_SHARE, batch),
+                           self.MAX_INTERVAL)
+        return max(task._first_write or time.time(),
+                   task._last_flush + interval)
+
+    def _schedule(self, when):
+        delay = max(0, int((when - time.time()) * 1000))
+        _set_timeout(lambda: self._tick(when), delay, "_FlushScheduler._tick")
+
+    def _tick(self, when):
+        t0 = time.perf_counter()
+        with self._lock:
+            if when != self._tick_at:
+                return  # superseded by an earlier tick
+            self._tick_at = None
+            tasks = list(self._pending)
+        for task in tasks:
+            task._visible = _is_visible(task.view)
+        now = time.time()
+        for task in sorted(tasks, key=self._due):
+            if self._due(task) > now:
+                break
+            if time.perf_counter() - t0 > self.FRAME_BUDGET:
+                break
+            with self._lock:
+                self._pending.pop(task, None)
+            task._flush()
+        with self._lock:
+            if not self._pending or self._tick_at is not None:
+                return
+            due = max(min(self._due(t) for t in self._pending),
+                      now + self.MIN_INTERVAL)
+            self._tick_at = due
+        self._schedule(due)
+
+
+def _is_visible(view):
+    """True if `view` is the selected tab of its group (or shown panel)"""
+    window = view and view.window()
+    if not window:
+        return False
+    group, _ = window.get_view_index(view)
+    if group < 0:  # an output panel, visible while shown
+        panel = window.active_panel() or ""
+        return panel.startswith("output.") and \
+            window.find_output_panel(panel[len("output."):]) == view
+    return window.active_view_in_group(group) == view
+
+
+_FLUSHER = _FlushScheduler()
+
+
+class _StreamScheduler(object):
+    """
+    Admit at most `"workers"` concurrent streams per `"system"`.
+    Waiting tickets are queued per system - highest priority first,
+    FIFO within a priority - and started as running tickets release.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = {}  # system -> set of tickets
+        self._queues = {}   # system -> heap of (-priority, seq, ticket)
+        self._seq = itertools.count()
+
+    def submit(self, ticket):
+        """Start `ticket` now if a slot is free, otherwise queue it"""
+        with self._lock:
+            running = self._running.setdefault(ticket.system, set())
+            queue = self._queues.setdefault(ticket.system, [])
+            admit = not queue and len(running) < ticket.workers
+            if admit:
+                running.add(ticket)
+            else:
+                heapq.heappush(queue,
+                               (-ticket.priority, next(self._seq), ticket))
+        if admit:
+            ticket.admit()
+        else:
+            self._show_positions(ticket.system)
+
+    def try_acquire(self, ticket):
+        """Take a free slot for `ticket` without queueing; False if busy"""
+        with self._lock:
+            running = self._running.setdefault(ticket.system, set())
+            if self._queues.get(ticket.system) or \
+                    len(running) >= ticket.workers:
+                return False
+            running.add(ticket)
+            return True
+
+    def release(self, ticket):
+        """Free the slot held by a running `ticket`"""
+        with self._lock:
+            self._running.get(ticket.system, set()).discard(ticket)
+        self._advance(ticket.system)
+
+    def dequeue(self, ticket):
+        """Drop a waiting `ticket`; return False if it was not queued"""
+        with self._lock:
+            queue = self._queues.get(ticket.system, [])
+            for i, entry in enumerate(queue):
+                if entry[2] is ticket:
+                    queue.pop(i)
+                    heapq.heapify(queue)
+                    break
+            else:
+                return False
+        self._advance(ticket.system)
+        return True
+
+    def _advance(self, system):
+        """Hand free slots to the head of the queue (strict FIFO)"""
+        admitted = []
+        with self._lock:
+            running = self._running.setdefault(system, set())
+            queue = self._queues.setdefault(system, [])
+            while queue and len(running) < queue[0][2].workers:
+                ticket = heapq.heappop(queue)[2]
+                running.add(ticket)
+                admitted.append(ticket)
+        for ticket in admitted:
+            ticket.admit()
+        self._show_positions(system)
+
+    def load(self, system):
+        """Return (running, queued) counts for a system"""
+        with self._lock:
+            return (len(self._running.get(system, ())),
+                    len(self._queues.get(system, ())))
+
+    def _show_positions(self, system):
+        with self._lock:
+            waiting = [e[2] for e in sorted(self._queues.get(system, []))]
+        for position, ticket in enumerate(waiting, 1):
+            ticket.queued(position)
+
+
+class _StreamTicket(object):
+    """Scheduler entry for one `AgentStreamingTask`"""
+    def __init__(self, task, system, workers, priority=0):
+        self.task = task
+        self.system = system
+        self.workers = max(1, int(workers))
+        self.priority = priority
+
+    def admit(self):
+        self.task.view.erase_status("agentic_queue")
+        self.task.launch()
+
+    def queued(self, position):
+        msg = "Queued #{} on {}".format(position, self.system)
+        self.task.view.set_status("agentic_queue", msg)
+        if position == 1:
+            sublime.status_message(msg)
+
+
+_SCHEDULER = _StreamScheduler()
+
+
+def _no_model(capability):
+    """Tell the user that the model list `capability` has no usable model"""
+    msg = 'No usable model in "{}"'.format(capability)
+    print(msg)
+    sublime.status_message(msg)
+
+
+def start_streaming(view, messages, model_name=None, priority=0,
+                    on_done=None):
+    """
+    Public helper - queue a streaming task on a view.
+    Higher `priority` streams are admitted first on a busy system.
+    `on_done(record)` is called on the UI thread with the ledger record
+    when the stream ends (None if it was cancelled before it started,
+    or never started because no model was usable).
+    """
+    if not model_name and view.settings().get("agent_model") is None:
+        capability = _config().get("default_models")
+        model_name = _pick_model(capability, messages)
+        if model_name is None:
+            view.settings().set("agentic_is_streaming", False)
+            _no_model(capability)
+            if on_done:
+                on_done(None)
+            return
+        view.settings().set("agent_capability", capability)
     view.settings().set("agentic_is_streaming", True)
     if model_name:
         view.settings().set("agent_model", model_name)
+
+    model_name = view.settings().get("agent_model")
+    model = _config().models.get(model_name, {})
+    system, workers = _model_slot(model_name, model)
+
     task = AgentStreamingTask(view, messages, _ACTIVE_STREAMERS)
+    task.on_done = on_done
+    task.ticket = _StreamTicket(task, system, workers, priority)
     _ACTIVE_STREAMERS[view.id()] = task
-    task.start()
+    _SCHEDULER.submit(task.ticket)
+
+
+def _model_slot(model_name, model):
+    """Return the (system, workers) a model is scheduled on"""
+    workers = model.get("workers", float("inf"))
+    if workers == float("inf"):
+        workers = 1 << 30
+    return model.get("system", model_name), workers
 
 
 def _build_messages_from_text(text):
     """Parse a view into a list of chat messages"""
+    return _parse_chat(text)[0]
+
+
+def _parse_chat(text, offset=0, in_reasoning=False):
+    """
+    Parse chat text into (messages, blocks). `blocks` holds one
+    (offset, in_reasoning, messages_before) entry per "# --- " header,
+    the parser state needed to resume parsing at that header.
+    """
     lines = text.splitlines(True)
 
     messages = []
+    blocks = []
     current_role = None
     content_lines = []
-    in_reasoning = False
 
     for line in lines:
         stripped = line.strip()
@@ -357,6 +3022,7 @@ def _build_messages_from_text(text):
             if current_role and content_lines:
                 msg = "".join(content_lines).rstrip("\n")
                 messages.append({"role": current_role, "content": msg})
+            blocks.append((offset, in_reasoning, len(messages)))
 
             if "System" in stripped:
                 current_role = "developer"
@@ -368,7 +3034,9 @@ def _build_messages_from_text(text):
                 current_role = None
 
             content_lines = []
+            offset += len(line)
             continue
+        offset += len(line)
 
         # Reasoning section toggles
         if stripped.startswith("## --- "):
@@ -389,7 +3057,254 @@ def _build_messages_from_text(text):
         msg = "".join(content_lines).rstrip("\n")
         messages.append({"role": current_role, "content": msg})
 
-    return messages
+    return messages, blocks
+
+
+class _ChatParseCache(object):
+    """
+    Parsed messages per buffer, stored with the `change_count()` they
+    were computed at. Edits are tracked by `_ChatChangeListener`; a
+    later call re-parses only from the last header before the first
+    modified offset, and falls back to a full parse when no edit
+    position is known (older Sublime Text builds).
+    """
+    def __init__(self):
+        self._entries = {}  # buffer id -> (change_count, messages, blocks)
+        self._dirty = {}    # buffer id -> (first modified offset, change_count)
+
+    def messages(self, view):
+        """Return the chat messages of `view` (fresh copies)"""
+        key = view.buffer_id()
+        count = view.change_count()
+        entry = self._entries.get(key)
+        dirty = self._dirty.pop(key, None)
+        if entry and entry[0] == count:
+            parsed = entry[1:]
+        else:
+            parsed = None
+            if entry and dirty and dirty[1] == count:
+                parsed = self._reparse_tail(view, entry, dirty[0])
+            if parsed is None:
+                parsed = _parse_chat(
+                    view.substr(sublime.Region(0, view.size())))
+            self._entries[key] = (count,) + parsed
+            _watch_changes(view)
+        return [dict(m) for m in parsed[0]]
+
+    def mark_dirty(self, key, offset, change_count):
+        old = self._dirty.get(key)
+        if old:
+            offset = min(offset, old[0])
+        self._dirty[key] = (offset, change_count)
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+        self._dirty.pop(key, None)
+
+    def last_header(self, view):
+        """Offset of the last "# --- " header of `view` when last parsed"""
+        entry = self._entries.get(view.buffer_id())
+        return entry[2][-1][0] if entry and entry[2] else 0
+
+    @staticmethod
+    def _reparse_tail(view, entry, dirty):
+        _, messages, blocks = entry
+        k = len(blocks) - 1
+        while k >= 0 and blocks[k][0] >= dirty:
+            k -= 1
+        if k < 0:
+            return None
+        offset, in_reasoning, before = blocks[k]
+        tail = view.substr(sublime.Region(offset, view.size()))
+        new_messages, new_blocks = _parse_chat(tail, offset, in_reasoning)
+        if not new_blocks or new_blocks[0][0] != offset:
+            return None  # the header itself was edited away
+        return (messages[:before] + new_messages,
+                blocks[:k] + [(o, r, n + before) for o, r, n in new_blocks])
+
+
+_PARSE_CACHE = _ChatParseCache()
+
+
+if hasattr(sublime_plugin, "TextChangeListener"):  # build 4081+
+    class _ChatChangeListener(sublime_plugin.TextChangeListener):
+        """Record the first modified offset of a parsed chat buffer"""
+        @classmethod
+        def is_applicable(cls, buffer):
+            return False  # attached on demand by _watch_changes
+
+        def on_text_changed(self, changes):
+            view = self.buffer.primary_view()
+            if not changes or not view:
+                return
+            _PARSE_CACHE.mark_dirty(self.buffer.id(),
+                                    min(c.a.pt for c in changes),
+                                    view.change_count())
+
+    _CHANGE_LISTENERS = {}  # buffer id -> _ChatChangeListener
+
+    def _watch_changes(view):
+        listener = _CHANGE_LISTENERS.get(view.buffer_id())
+        if listener is None or not listener.is_attached():
+            listener = _ChatChangeListener()
+            listener.attach(view.buffer())
+            _CHANGE_LISTENERS[view.buffer_id()] = listener
+
+    def _unwatch_changes(buffer_id):
+        listener = _CHANGE_LISTENERS.pop(buffer_id, None)
+        if listener is not None and listener.is_attached():
+            listener.detach()
+else:
+    def _watch_changes(view):
+        pass
+
+    def _unwatch_changes(buffer_id):
+        pass
+
+
+def _is_last_view(view):
+    """True when no other open view (clone) shows the buffer of `view`"""
+    key = view.buffer_id()
+    return not any(v.buffer_id() == key and v.id() != view.id()
+                   for window in sublime.windows() for v in window.views())
+
+
+class _Prefetcher(object):
+    """
+    Warm the prompt cache of a chat's model while its next turn is
+    typed. "prefetch_delay" seconds after the last edit of a chat whose
+    `agent_model` has "prefetch": true, the chat so far is sent as a
+    one-token, non-streaming request with "cache_prompt", so a llama.cpp
+    server has prefilled most of the prompt when the turn is sent.
+
+    A warm-up only takes a free slot of the model's system (never queued
+    ahead of real requests) and is cancelled when an edit lands before
+    the turn being typed, in the part it prefilled. Its timings are kept
+    so the chat's next request can report the prefill it saved.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = {}  # view id -> (cancel token, start of the last turn)
+        self._sent = {}     # view id -> digest of the last warmed messages
+        self._warm = {}     # view id -> (model, cache_n, prompt_n, prompt/s)
+
+    def modified(self, view):
+        """UI thread: `view` was edited - restart its idle timer"""
+        settings = view.settings()
+        if not settings.get("agentic_is_chat") or \
+                settings.get("agentic_is_streaming"):
+            return
+        model = _config().models.get(settings.get("agent_model"))
+        if not model or not model.get("prefetch"):
+            return
+        with self._lock:
+            running = self._running.get(view.id())
+        if running and any(r.begin() < running[1] for r in view.sel()):
+            running[0].set()  # edited what it is prefilling
+        count = view.change_count()
+        _set_timeout(lambda: self._idle(view, count),
+                     int(_config().get("prefetch_delay", 1.5) * 1000),
+                     "_Prefetcher._idle")
+
+    def discard(self, view):
+        with self._lock:
+            running = self._running.pop(view.id(), None)
+            self._sent.pop(view.id(), None)
+            self._warm.pop(view.id(), None)
+        if running:
+            running[0].set()
+
+    def _idle(self, view, count):
+        if not view.is_valid() or view.change_count() != count:
+            return  # edited since (a later timer is pending) or closed
+        if view.settings().get("agentic_is_streaming"):
+            return
+        name = view.settings().get("agent_model")
+        model = _config().models.get(name)
+        if not model or not model.get("prefetch"):
+            return
+        messages = [m for m in _PARSE_CACHE.messages(view) if m["content"]]
+        if not messages:
+            return
+        if _config().get("sanitize_output"):  # as AgenticChatCommand sends
+            messages = _RAW_TURNS.restore(view, messages)
+        digest = hashlib.sha1(json.dumps(
+            [name, messages]).encode("utf-8")).hexdigest()
+        with self._lock:
+            if view.id() in self._running or \
+                    self._sent.get(view.id()) == digest:
+                return  # one warm-up at a time, or already warm
+        ticket = _StreamTicket(None, *_model_slot(name, model))
+        if not _SCHEDULER.try_acquire(ticket):
+            return  # the system is busy with real requests
+        cancel = _CancelToken()
+        with self._lock:
+            self._running[view.id()] = (cancel, _PARSE_CACHE.last_header(view))
+            self._sent[view.id()] = digest
+        threading.Thread(target=self._warm_up, daemon=True, args=(
+            view, name, model, messages, ticket, cancel)).start()
+
+    def _warm_up(self, view, name, model, messages, ticket, cancel):
+        warm = None
+        t0 = time.perf_counter()
+        try:
+            # never a summary request from a typing pause
+            messages = _fit_context(messages, model, cancel,
+                                    cached_only=True)
+            if messages is None:
+                return
+            body = dict(model.get("options", {}))
+            body.pop("stream_options", None)
+            body.update({
+                "messages": messages,
+                "model": model.get("model"),
+                "stream": False,
+                "max_tokens": 1,
+                "cache_prompt": True,
+            })
+            headers = _config().request(model)[2]
+            with _POOL.post(model.get("url"),
+                            json.dumps(body).encode("utf-8"),
+                            headers, cancel) as lease:
+                resp = json.loads(lease.response.read().decode("utf-8"))
+                lease.finish()
+            warm = _parse_metrics(resp)
+        except Exception as e:
+            if not cancel.is_set():
+                print("Agentic: warm-up on {} failed: {}".format(name, e))
+        finally:
+            _SCHEDULER.release(ticket)
+            with self._lock:
+                if self._running.get(view.id(), (None,))[0] is cancel:
+                    del self._running[view.id()]
+                if warm:
+                    self._warm[view.id()] = (name,) + warm[:3]
+                elif self._sent.get(view.id()):
+                    del self._sent[view.id()]  # try again at the next pause
+        if warm:
+            print("Agentic: warmed {}: {} prompt tokens prefilled, {} cached, "
+                  "in {:.2f}s".format(name, warm[1], warm[0],
+                                      time.perf_counter() - t0))
+        # catch up with edits made meanwhile
+        _set_timeout(lambda: view.is_valid() and self._idle(
+            view, view.change_count()), 0, "_Prefetcher._idle")
+
+    def saved(self, view, model_name, cache):
+        """
+        (prompt tokens, seconds) of prefill that the chat's last warm-up
+        saved a request that found `cache` tokens cached, or None.
+        Counted once, for the first request after the warm-up.
+        """
+        with self._lock:
+            warm = self._warm.pop(view.id(), None)
+        if not warm or warm[0] != model_name:
+            return None
+        _, warm_cache, warm_prompt, pps = warm
+        tokens = max(0, min(cache, warm_cache + warm_prompt) - warm_cache)
+        return tokens, tokens / pps if pps else 0.0
+
+
+_PREFETCHER = _Prefetcher()
 
 
 def _rebuild_text(messages, strip_active=False):
@@ -430,12 +3345,552 @@ def _create_chat(window, name, initial="",
     view.set_syntax_file("Packages/Markdown/Markdown.sublime-syntax")
     if initial:
         view.run_command("append", {"characters": initial})
-        sublime.set_timeout(
+        _set_timeout(
             lambda: view.run_command("move_to", {"to": "eof", "extend": False}),
             0)
     return view
 
 
+def _fan_out_layout(window, count):
+    """
+    Split the window into the source view on the left and a grid of
+    `count` cells on the right; return the grid's group indices.
+    """
+    cols = max(1, int(math.ceil(math.sqrt(count))))
+    rows = max(1, int(math.ceil(count / float(cols))))
+    window.set_layout({
+        "cols": [0.0] + [0.5 + 0.5 * c / cols for c in range(cols + 1)],
+        "rows": [r / float(rows) for r in range(rows + 1)],
+        "cells": [[0, 0, 1, rows]] + [[1 + c, r, 2 + c, r + 1]
+                                      for r in range(rows)
+                                      for c in range(cols)],
+    })
+    return list(range(1, count + 1))
+
+
+class _FanOut(object):
+    """
+    One prompt streamed to several models side by side. Each model gets
+    a pinned chat view (no hedging or failover); the views share one
+    message list, go through `_SCHEDULER` like any stream, and report
+    to a summary panel as they finish.
+    """
+    PANEL = "agentic_fan_out"
+
+    def __init__(self, window, title, capability):
+        self.window = window
+        self.title = title
+        self.capability = capability
+        self.names = _config().capability(capability)
+        self.records = {}  # model name -> ledger record (None: never ran)
+
+    def start(self, new_chat):
+        if not self.names:
+            sublime.status_message("No models in {}".format(self.capability))
+            return
+        messages = _build_messages_from_text(new_chat)
+        groups = _fan_out_layout(self.window, len(self.names))
+        for name, group in zip(self.names, groups):
+            view = _create_chat(self.window,
+                                "{} {}".format(name[:12], self.title[:12]),
+                                new_chat, create_pane=False)
+            self.window.set_view_index(view, group, 0)
+            view.settings().set("agent_pinned", True)
+            start_streaming(view, messages, name,
+                            on_done=lambda record, name=name:
+                            self._done(name, record))
+        self._show()
+        sublime.status_message("Submitting prompt to {} models".format(
+            len(self.names)))
+
+    def _done(self, name, record):
+        self.records[name] = record
+        self._show()
+        if len(self.records) == len(self.names):
+            print(self.summary())
+
+    def summary(self):
+        lines = ["Fan-out: {} ({}), {}/{} done".format(
+            self.title, self.capability, len(self.records), len(self.names)),
+            "", "{:24} {:>10} {:>7} {:>7} {:>7} {:>9}".format(
+                "model", "status", "TTFT", "tk/s", "out", "cost")]
+        for name in self.names:
+            r = self.records.get(name)
+            if r is None:
+                status = "cancelled" if name in self.records else "running"
+                lines.append("{:24} {:>10}".format(name[:24], status))
+                continue
+            lines.append("{:24} {:>10} {:>7} {:>7} {:>7} {:>9.3g}".format(
+                name[:24], r["outcome"], _fmt_seconds(r["ttft"]),
+                "-" if r["tps"] is None else "{:.0f}".format(r["tps"]),
+                r["output_tokens"], r["cost"]))
+        return "\n".join(lines)
+
+    def _show(self):
+        panel = self.window.find_output_panel(self.PANEL) or \
+            self.window.create_output_panel(self.PANEL)
+        panel.run_command("select_all")
+        panel.run_command("right_delete")
+        panel.run_command("append", {"characters": self.summary() + "\n"})
+        self.window.run_command("show_panel",
+                                {"panel": "output." + self.PANEL})
+
+
+class _BatchTicket(object):
+    """Scheduler entry for one file of a `_Batch`"""
+    def __init__(self, system, workers, priority=-1):
+        self.system = system
+        self.workers = max(1, int(workers))
+        self.priority = priority
+        self.admitted = threading.Event()
+
+    def admit(self):
+        self.admitted.set()
+
+    def queued(self, position):
+        pass
+
+
+class _Batch(object):
+    """
+    A user-defined action run over many files by a bounded pool of
+    worker threads - one per "workers" slot of the action's systems,
+    capped by "batch_max_workers". Every file takes a low-priority slot
+    from `_SCHEDULER`, so chats are still admitted first. Results go to
+    "<file>.<action>.md" ("batch_output": "files") or an output panel.
+    Progress is kept in a manifest under User/ so a cancelled or failed
+    batch can be resumed.
+    """
+    MANIFEST = "Agentic.batch.json"
+    PANEL = "agentic_batch"
+
+    def __init__(self, window, action_name, files, done=()):
+        settings = _config()
+        self.window = window
+        self.action_name = action_name
+        self.action = settings.get("actions")[action_name]
+        self.files = files
+        self.done = set(done)
+        self.failed = {}  # path -> error message
+        self.output = settings.get("batch_output", "panel")
+        self.sanitize = settings.get("sanitize_output")
+        self.cancel = _CancelToken()
+        self.running = 0  # live worker threads
+        self.finished = 0  # files completed this session
+        self.tokens = 0
+        self.started = None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+
+    @classmethod
+    def manifest_path(cls):
+        return os.path.join(sublime.packages_path(), "User", cls.MANIFEST)
+
+    @classmethod
+    def resume(cls, window):
+        """The batch recorded in the manifest, or None"""
+        try:
+            with open(cls.manifest_path(), encoding="utf-8") as f:
+                manifest = json.load(f)
+            return cls(window, manifest["action"], manifest["files"],
+                       manifest["done"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def suffix(self):
+        return ".{}.md".format(re.sub(r"\W+", "_", self.action_name))
+
+    def start(self):
+        todo = [path for path in self.files if path not in self.done]
+        for path in todo:
+            self._queue.put(path)
+        self.started = time.time()
+        self._save()
+        if self.output != "files":
+            self.window.create_output_panel(self.PANEL)
+            self.window.run_command("show_panel",
+                                    {"panel": "output." + self.PANEL})
+        self.running = min(_pool_size(self.action["models"]), len(todo))
+        print("Batch {}: {} files ({} already done), {} workers".format(
+            self.action_name, len(todo), len(self.done), self.running))
+        for _ in range(self.running):
+            threading.Thread(target=self._work, daemon=True).start()
+        if not self.running:
+            self._finish()
+        else:
+            self._report()
+
+    def progress(self):
+        total = len(self.files)
+        done = len(self.done)
+        elapsed = max(1e-6, time.time() - self.started)
+        rate = self.finished / elapsed  # files/s this session
+        left = total - done - len(self.failed)
+        eta = left / rate if rate else None
+        return "Batch {}: {}/{} files{}, {:.1f} files/min, {:.0f} tk/s, ETA {}".format(
+            self.action_name, done, total,
+            ", {} failed".format(len(self.failed)) if self.failed else "",
+            rate * 60, self.tokens / elapsed,
+            "-" if eta is None else "{:.0f}s".format(eta))
+
+    def _report(self):
+        if self.running:
+            sublime.status_message(self.progress())
+            _set_timeout(self._report, 1000)
+
+    def _work(self):
+        try:
+            while not self.cancel.is_set():
+                try:
+                    path = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self._run_file(path)
+                except Exception as e:
+                    self._fail(path, e)
+        finally:
+            with self._lock:
+                self.running -= 1
+                last = not self.running
+            if last:
+                _set_timeout(self._finish, 0)
+
+    def _run_file(self, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                content = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            self._fail(path, e)
+            return
+        messages = _build_messages_from_text(
+            _action_chat(self.action, path, content))
+        text, record = _complete(messages, self.action["models"],
+                                 self.cancel, batch=self.action_name)
+        if text is None:
+            return
+
+        if self.sanitize:
+            text = _sanitize_text(text)
+        try:
+            self._write(path, text)
+        except OSError as e:
+            self._fail(path, e)
+            return
+        with self._lock:
+            self.done.add(path)
+            self.finished += 1
+            self.tokens += record["output_tokens"]
+            self._save()
+
+    def _write(self, path, text):
+        if self.output == "files":
+            with open(path + self.suffix(), "w", encoding="utf-8") as f:
+                f.write(text)
+            return
+        panel = self.window.find_output_panel(self.PANEL)
+        if panel:
+            entry = "## {}\n\n{}\n\n".format(path, text)
+            _set_timeout(lambda: panel.run_command(
+                "append", {"characters": entry}), 0)
+
+    def _fail(self, path, error):
+        print("Batch {}: {} failed: {}".format(self.action_name, path, error))
+        with self._lock:
+            self.failed[path] = str(error)
+            self._save()
+
+    def _save(self):
+        tmp = self.manifest_path() + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"action": self.action_name, "files": self.files,
+                           "done": sorted(self.done),
+                           "failed": self.failed}, f)
+            os.replace(tmp, self.manifest_path())
+        except OSError as e:
+            print("Agentic: could not save batch manifest: {}".format(e))
+
+    def _finish(self):
+        global _BATCH
+        if _BATCH is self:
+            _BATCH = None
+        msg = self.progress()
+        if len(self.done) == len(self.files):
+            try:
+                os.remove(self.manifest_path())
+            except OSError:
+                pass
+            msg += ". Done"
+        elif self.cancel.is_set():
+            msg += ". Cancelled - run AI Agent Resume Batch to continue"
+        else:
+            msg += ". Run AI Agent Resume Batch to retry the failed files"
+        print(msg)
+        sublime.status_message(msg)
+
+
+_BATCH = None  # the running _Batch
+
+
+def _pool_size(capability):
+    """Threads worth running for `capability`: its systems' "workers" """
+    settings = _config()
+    slots = {}  # system -> workers
+    for name in settings.capability(capability):
+        system, workers = _model_slot(name, settings.models[name])
+        slots[system] = max(slots.get(system, 0), workers)
+    return max(1, min(sum(slots.values()),
+                      settings.get("batch_max_workers", 8)))
+
+
+def _complete(messages, capability, cancel, priority=-1, **fields):
+    """
+    Run `messages` on the best model of `capability` without a view:
+    wait for a scheduler slot at `priority`, stream with retry/failover
+    and append the request (plus `fields`) to the ledger. Returns
+    (answer, record); answer is None when cancelled. Raises on errors.
+    """
+    name = _pick_model(capability, messages)
+    if name is None:
+        raise ValueError('no usable model in "{}"'.format(capability))
+    model = _config().models[name]
+    messages = _fit_context(messages, model, cancel)
+    ticket = _BatchTicket(*_model_slot(name, model), priority=priority)
+    _SCHEDULER.submit(ticket)
+    while not ticket.admitted.wait(0.1):
+        if cancel.is_set() and _SCHEDULER.dequeue(ticket):
+            return None, None
+
+    stats = _StreamMetrics()
+    stream = _RetryingStream(messages, name, model, cancel, stats,
+                             capability, ticket)
+    text, metrics = [], (0.0, None, None, None)
+    try:
+        for chunk in stream:
+            if len(chunk) != 2:
+                metrics = chunk
+                break
+            stats.chunk(chunk[0])
+            if not chunk[0]:
+                text.append(chunk[1])
+    finally:
+        _SCHEDULER.release(stream.ticket)  # moved on failover
+    outcome = "cancelled" if cancel.is_set() else "done"
+    cache, _, pps, tps = metrics
+    record = _usage_record(stream.name, stream.model, stats, messages,
+                           outcome, cache, pps, tps)
+    record["retries"] = stream.retries
+    record.update(fields)
+    _LEDGER.append(record)
+    return (None if cancel.is_set() else "".join(text)), record
+
+
+def _batch_files(paths, max_kb, skip_suffix):
+    """Files under `paths`, without hidden entries, outputs or big files"""
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            files.extend(os.path.join(root, n) for n in sorted(names)
+                         if not n.startswith("."))
+    kept = []
+    for f in files:
+        if f.endswith(skip_suffix):
+            continue
+        try:
+            size = os.path.getsize(f)
+        except OSError:  # dangling symlink, removed or unreadable
+            continue
+        if size <= max_kb * 1024:
+            kept.append(f)
+    return kept
+
+
+def _split_chunks(text, max_chars, overlap=0):
+    """
+    Split `text` into [(first_line, last_line, chunk)] of about `max_chars`
+    each, cutting between top-level blocks (an unindented line after a
+    blank line). A block longer than `max_chars` is cut into windows of
+    lines that overlap by `overlap` lines.
+    """
+    lines = text.splitlines(True)
+    starts = [0] + [i for i in range(1, len(lines))
+                    if lines[i][:1].strip() and not lines[i - 1].strip()]
+    starts.append(len(lines))
+
+    spans = []
+    begin, size = None, 0
+    for a, b in zip(starts, starts[1:]):
+        block = sum(len(line) for line in lines[a:b])
+        if begin is not None and (size + block > max_chars or
+                                  block > max_chars):
+            spans.append((begin, a))
+            begin, size = None, 0
+        if block <= max_chars:
+            if begin is None:
+                begin = a
+            size += block
+            continue
+        i = a
+        while i < b:  # line windows
+            j, n = i, 0
+            while j < b and (j == i or n + len(lines[j]) <= max_chars):
+                n += len(lines[j])
+                j += 1
+            spans.append((i, j))
+            if j >= b:
+                break
+            i = max(i + 1, j - overlap)
+    if begin is not None:
+        spans.append((begin, len(lines)))
+    return [(a + 1, b, "".join(lines[a:b])) for a, b in spans]
+
+
+def _needs_map_reduce(content):
+    limit = _config().get("map_reduce_tokens", 16000)
+    return bool(limit) and len(content) / CHARS_PER_TOKEN > limit
+
+
+class _MapReduce(object):
+    """
+    A prompt on content too large for one request. `_split_chunks` cuts
+    the content into parts, and the prompt runs on every part in parallel
+    (`_complete` on up to `_pool_size` threads). The partial answers then
+    become the user turn of a chat view, and a final reduce step that
+    merges them streams into it. Progress shows in the view's status
+    bar. The view is registered in `_ACTIVE_STREAMERS`, so cancelling
+    or closing it stops the map step.
+    """
+    STATUS = "agentic_map"
+
+    def __init__(self, window, title, system, prompt, file_name, content,
+                 capability):
+        self.window = window
+        self.title = title
+        self.system = system
+        self.prompt = prompt
+        self.file_name = file_name
+        self.content = content
+        self.capability = capability
+        self.view = None
+        self.chunks = []
+        self.results = []
+        self.done = 0
+        self.failed = 0
+        self.running = 0
+        self._cancel = _CancelToken()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+
+    def start(self):
+        settings = _config()
+        if not settings.capability(self.capability):
+            _no_model(self.capability)
+            return
+        self.chunks = _split_chunks(
+            self.content,
+            int(settings.get("map_reduce_chunk_tokens", 4000) * CHARS_PER_TOKEN),
+            settings.get("map_reduce_overlap_lines", 20))
+        self.results = [None] * len(self.chunks)
+        self.header = "# --- System ---\n{}\n\n# --- User ---\n".format(
+            self.system)
+        self.view = _create_chat(self.window, "Chat " + self.title[:12],
+                                 self.header)
+        self.view.settings().set("agentic_is_streaming", True)
+        self.view.settings().set("agent_capability", self.capability)
+        _ACTIVE_STREAMERS[self.view.id()] = self
+
+        for i in range(len(self.chunks)):
+            self._queue.put(i)
+        self.running = min(_pool_size(self.capability), len(self.chunks))
+        for _ in range(self.running):
+            threading.Thread(target=self._work, daemon=True).start()
+        self._progress()
+
+    def cancel(self):
+        self._cancel.set()
+        self.view.settings().set("agentic_is_streaming", False)
+
+    def _work(self):
+        try:
+            while not self._cancel.is_set():
+                try:
+                    i = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                first, last, chunk = self.chunks[i]
+                messages = [
+                    {"role": "developer", "content": self.system},
+                    {"role": "user", "content":
+                     "File: {} (part {} of {}, lines {}-{})\n```\n{}\n```\n{}\n"
+                     "Answer for this part only; the answers for all parts "
+                     "are merged afterwards.".format(
+                         self.file_name, i + 1, len(self.chunks), first, last,
+                         chunk, self.prompt)}]
+                try:
+                    text, _ = _complete(messages, self.capability,
+                                        self._cancel, priority=0,
+                                        map_reduce=self.title)
+                except Exception as e:
+                    text = "(failed: {})".format(e)
+                    with self._lock:
+                        self.failed += 1
+                with self._lock:
+                    self.results[i] = text
+                    self.done += 1
+                _set_timeout(self._progress, 0)
+        finally:
+            with self._lock:
+                self.running -= 1
+                last = not self.running
+            if last:
+                _set_timeout(self._reduce, 0)
+
+    def _progress(self):
+        if self.running:
+            self.view.set_status(self.STATUS, "Map {}/{} parts{}".format(
+                self.done, len(self.chunks),
+                ", {} failed".format(self.failed) if self.failed else ""))
+
+    def _reduce(self):
+        self.view.erase_status(self.STATUS)
+        _ACTIVE_STREAMERS.pop(self.view.id(), None)
+        if self._cancel.is_set() or not self.view.is_valid():
+            self.view.settings().set("agentic_is_streaming", False)
+            sublime.status_message("Map-reduce cancelled")
+            return
+        parts = "\n\n".join(
+            "### Part {} (lines {}-{})\n{}".format(i + 1, first, last, text)
+            for i, ((first, last, _), text)
+            in enumerate(zip(self.chunks, self.results)))
+        user = ("File: {}\nThe request below was run on {} parts of the "
+                "file. The answers for each part:\n\n{}\n\nMerge them into "
+                "one answer to the request, without repeating overlapping "
+                "content.\n\nRequest: {}\n").format(
+                    self.file_name, len(self.chunks), parts, self.prompt)
+        self.view.run_command("append", {"characters": user})
+        messages = _build_messages_from_text(self.header + user)
+        name = _pick_model(self.capability, messages)
+        if name is None:  # the settings changed during the map step
+            self.view.settings().set("agentic_is_streaming", False)
+            _no_model(self.capability)
+            return
+        start_streaming(self.view, messages, name)
+        sublime.status_message("Reducing {} parts".format(len(self.chunks)))
+
+
+def _action_chat(action, file_name, content):
+    """Chat text that runs a user-defined `action` on `content`"""
+    user_prompt = "File: {}\n```\n{}\n```\n{}".format(
+        file_name, content, action["prompt"])
+    return "# --- System ---\n{}\n\n# --- User ---\n{}\n".format(
+        action["system"], user_prompt)
+
+
 def _read_selection(view):
     """Load user-selected data or file"""
     sel = view.sel()
@@ -461,7 +3916,7 @@ class AgenticCodeCommand(sublime_plugin.WindowCommand):
     def input(self, args):
         return PromptInputHandler()
 
-    def run(self, prompt):
+    def run(self, prompt, fan_out=False):
         # New window + scratch view
         old = self.window.active_view()
 
@@ -469,10 +3924,22 @@ class AgenticCodeCommand(sublime_plugin.WindowCommand):
         user_prompt = "File: {}\n```\n{}\n```\n{}".format(
             old.file_name(), content, prompt)
         new_chat = "# --- System ---\n{}\n\n# --- User ---\n{}\n".format(
-            sublime.load_settings("Agentic.sublime-settings").get("default_prompt"),
+            _config().get("default_prompt"),
             user_prompt
         )
 
+        if prompt and not fan_out and _needs_map_reduce(content):
+            settings = _config()
+            _MapReduce(self.window, prompt, settings.get("default_prompt"),
+                       prompt, old.file_name(), content,
+                       settings.get("default_models")).start()
+            return
+
+        if fan_out and prompt:  # same prompt to every default model
+            _FanOut(self.window, prompt, _config().get("default_models")
+            ).start(new_chat)
+            return
+
         view = _create_chat(self.window, "Chat " + prompt[:12],
                             initial=new_chat)
 
@@ -495,12 +3962,13 @@ class AgenticChatCommand(sublime_plugin.WindowCommand):
             self.window.run_command("cancel_stream")
             return
 
-        text = view.substr(sublime.Region(0, view.size()))
-        messages = _build_messages_from_text(text)
+        messages = _PARSE_CACHE.messages(view)
         if not messages:
             sublime.status_message("Chat data not found")
             self.window.run_command("agent_new_chat")
             return
+        if _config().get("sanitize_output"):
+            messages = _RAW_TURNS.restore(view, messages)
 
         view.settings().set("agentic_is_streaming", True)
         view.settings().set("agentic_is_chat", True)
@@ -516,7 +3984,7 @@ class AgenticNewChatCommand(sublime_plugin.WindowCommand):
         if not self.window.active_view():
             return
         new_chat = "# --- System ---\n{}\n\n# --- User ---\n".format(
-            sublime.load_settings("Agentic.sublime-settings").get("default_prompt")
+            _config().get("default_prompt")
         )
         view = _create_chat(self.window, "Chat", new_chat, create_pane=False)
 
@@ -527,14 +3995,14 @@ class AgenticCloneChatCommand(sublime_plugin.WindowCommand):
         view = self.window.active_view()
         if not view:
             return
-        text = view.substr(sublime.Region(0, view.size()))
-        messages = _build_messages_from_text(text)
+        messages = _PARSE_CACHE.messages(view)
         if not messages:
             sublime.status_message("Chat data not found")
             self.window.run_command("agent_new_chat")
             return
         cleaned = _rebuild_text(messages, strip_active=True)
-        view = _create_chat(self.window, "Chat", cleaned, create_pane=False)
+        clone = _create_chat(self.window, "Chat", cleaned, create_pane=False)
+        _RAW_TURNS.copy(view, clone)
 
 
 class AgenticCancelStreamCommand(sublime_plugin.WindowCommand):
@@ -557,8 +4025,7 @@ class AgenticClearReasoningCommand(sublime_plugin.TextCommand):
         view = self.view
         if view.id() in _ACTIVE_STREAMERS:
             return
-        text = view.substr(sublime.Region(0, view.size()))
-        messages = _build_messages_from_text(text)
+        messages = _PARSE_CACHE.messages(view)
         if not messages:
             sublime.status_message("Chat data not found")
             return
@@ -567,9 +4034,21 @@ class AgenticClearReasoningCommand(sublime_plugin.TextCommand):
         sublime.status_message("Chat reasoning cleared")
 
 
+class AgenticShowReasoningCommand(sublime_plugin.WindowCommand):
+    """Show the reasoning panel of the active chat ("reasoning_output")"""
+    def run(self):
+        view = self.window.active_view()
+        name = view and _reasoning_panel_name(view)
+        if not name or not self.window.find_output_panel(name):
+            sublime.status_message("No reasoning panel for this chat")
+            return
+        self.window.run_command("show_panel", {"panel": "output." + name})
+
+
 class AgenticActionCommand(sublime_plugin.WindowCommand):
     """Run a user-defined action - see Agentic.sublime-settings"""
-    def run(self):
+    def run(self, fan_out=False):
+        self.fan_out = fan_out
         self.actions = self._load_actions()
         if not self.actions:
             sublime.error_message(
@@ -589,27 +4068,86 @@ class AgenticActionCommand(sublime_plugin.WindowCommand):
             return
         action_name = list(self.actions.keys())[index]
         chosen = self.actions[action_name]
-        settings = sublime.load_settings("Agentic.sublime-settings")
+        settings = _config()
         models_list = chosen["models"]
-        system_prompt = chosen["system"]
-        prompt = chosen["prompt"]
 
         old = self.window.active_view()
         content = _read_selection(old)
-        user_prompt = "File: {}\n```\n{}\n```\n{}".format(
-            old.file_name(), content, prompt)
-        new_chat = "# --- System ---\n{}\n\n# --- User ---\n{}\n".format(
-            system_prompt, user_prompt)
+        new_chat = _action_chat(chosen, old.file_name(), content)
 
-        view = _create_chat(self.window, "Chat " + action_name[:12], new_chat)
+        if not self.fan_out and _needs_map_reduce(content):
+            _MapReduce(self.window, action_name, chosen["system"],
+                       chosen["prompt"], old.file_name(), content,
+                       models_list).start()
+            return
+
+        if self.fan_out:  # every model of the action's list
+            _FanOut(self.window, action_name, models_list).start(new_chat)
+            return
 
         messages = _build_messages_from_text(new_chat)
-        model = _pick_model(models_list)
+        model = _pick_model(models_list, messages)
+        if model is None:
+            _no_model(models_list)
+            return
+        view = _create_chat(self.window, "Chat " + action_name[:12], new_chat)
+        view.settings().set("agent_capability", models_list)
         start_streaming(view, messages, model)
         sublime.status_message("Submitting prompt")
 
     def _load_actions(self):
-        return sublime.load_settings("Agentic.sublime-settings").get("actions")
+        return _config().get("actions")
+
+
+class AgenticBatchCommand(sublime_plugin.WindowCommand):
+    """Run a user-defined action over files or folders (side bar)"""
+    def run(self, paths=None, resume=False):
+        global _BATCH
+        if _BATCH is not None:
+            sublime.status_message(_BATCH.progress())
+            return
+        if resume:
+            batch = _Batch.resume(self.window)
+            if batch is None:
+                sublime.status_message("No batch to resume")
+                return
+            _BATCH = batch
+            batch.start()
+            return
+
+        self.paths = paths or self.window.folders()
+        self.actions = _config().get("actions")
+        if not self.paths or not self.actions:
+            sublime.status_message("Nothing to run a batch on")
+            return
+        self.window.show_quick_panel(list(self.actions.keys()),
+                                     self.run_action)
+
+    def run_action(self, index):
+        global _BATCH
+        if index == -1:
+            return
+        action_name = list(self.actions.keys())[index]
+        batch = _Batch(self.window, action_name, [])
+        batch.files = _batch_files(
+            self.paths, _config().get("batch_max_kb", 256), batch.suffix())
+        if not batch.files:
+            sublime.status_message("No files to run {} on".format(action_name))
+            return
+        if not sublime.ok_cancel_dialog(
+                "Run the \"{}\" action on {} files?".format(
+                    action_name, len(batch.files))):
+            return
+        _BATCH = batch
+        batch.start()
+
+
+class AgenticCancelBatchCommand(sublime_plugin.WindowCommand):
+    """Stop the running batch; it can be resumed later"""
+    def run(self):
+        if _BATCH is not None:
+            _BATCH.cancel.set()
+            sublime.status_message("Cancelling batch")
 
 
 class AgenticModelChatCommand(sublime_plugin.WindowCommand):
@@ -647,7 +4185,7 @@ class AgenticModelChatCommand(sublime_plugin.WindowCommand):
             user_prompt = ""
 
         new_chat = "# --- System ---\n{}\n\n# --- User ---\n{}".format(
-            sublime.load_settings("Agentic.sublime-settings").get("default_prompt"),
+            _config().get("default_prompt"),
             user_prompt)
 
         view = _create_chat(self.window, "Chat " + model_name[:12], new_chat)
@@ -656,14 +4194,93 @@ class AgenticModelChatCommand(sublime_plugin.WindowCommand):
         view.settings().set("agent_model", model_name)
 
     def _load_models(self):
-        return sublime.load_settings("Agentic.sublime-settings").get("models")
+        return _config().models
+
+
+class AgenticStatsCommand(sublime_plugin.WindowCommand):
+    """Show per-model latency and throughput measured in the ledger"""
+    def run(self):
+        rollups = _LEDGER.rollups()
+        models = _config().models
+
+        def fmt(value, spec="{:.2f}"):
+            return "-" if value is None else spec.format(value)
+
+        header = "{:24} {:14} {:>5} {:>9} {:>17} {:>17} {:>8} {:>6} {:>7} {:>9} {:>9}".format(
+            "model", "system", "runs", "ok/c/err", "TTFT p50/p95/avg",
+            "tk/s p50/avg/cfg", "prefill", "cache", "out", "cost",
+            "hedge f/w")
+        lines = ["Agentic stats - last {} runs per model ({})".format(
+            _LEDGER.WINDOW, _LEDGER.path()), "", header, "-" * len(header)]
+        for name in sorted(rollups, key=lambda n: str(n)):
+            r = rollups[name]
+            lines.append(
+                "{:24} {:14} {:>5} {:>9} {:>17} {:>17} {:>8} {:>5}% {:>7} {:>9} {:>9}".format(
+                    str(name)[:24], str(r.system)[:14], r.count,
+                    "{}/{}/{}".format(r.outcomes["done"],
+                                      r.outcomes["cancelled"],
+                                      r.outcomes["error"]),
+                    "/".join((fmt(r.percentile("ttft", 0.5)),
+                              fmt(r.percentile("ttft", 0.95)),
+                              fmt(r.ewma.get("ttft")))),
+                    "/".join((fmt(r.percentile("tps", 0.5), "{:.0f}"),
+                              fmt(r.ewma.get("tps"), "{:.0f}"),
+                              fmt(models.get(name, {}).get("speed"), "{}"))),
+                    fmt(r.ewma.get("pps"), "{:.0f}"),
+                    "{:.0f}".format(100.0 * r.cache_hits / r.prompt_total)
+                    if r.prompt_total else "-",
+                    fmt(r.ewma.get("output_tokens"), "{:.0f}"),
+                    "{:.3f}".format(r.cost_total),
+                    "{}/{}".format(r.hedges_fired, r.hedges_won)))
+        if not rollups:
+            lines.append("(no requests recorded yet)")
+        lines += ["", "Response cache: {} hits, {} misses, {:.1f} MB".format(
+            _RESPONSE_CACHE.hits, _RESPONSE_CACHE.misses,
+            _RESPONSE_CACHE.size() / 1048576.0)]
+
+        panel = self.window.create_output_panel("agentic_stats")
+        panel.run_command("append", {"characters": "\n".join(lines) + "\n"})
+        self.window.run_command("show_panel", {"panel": "output.agentic_stats"})
+
+
+class AgenticUiProfileCommand(sublime_plugin.WindowCommand):
+    """Show where Agentic spent time on the UI thread ("profile_ui")"""
+    def run(self, reset=False):
+        if reset:
+            _PROFILER.reset()
+        if _PROFILER.enabled:
+            lines = _PROFILER.report()
+        else:
+            lines = ['UI profiling is off: set "profile_ui": true in '
+                     'Agentic.sublime-settings, use Sublime Text as usual, '
+                     'then run AI Agent UI Profile again.']
+        panel = self.window.create_output_panel("agentic_ui_profile")
+        panel.run_command("append", {"characters": "\n".join(lines) + "\n"})
+        self.window.run_command("show_panel",
+                                {"panel": "output.agentic_ui_profile"})
+
+
+class AgenticPrefetchListener(sublime_plugin.EventListener):
+    """Warm the model's prompt cache while a chat turn is typed"""
+    def on_modified(self, view):
+        _PREFETCHER.modified(view)
 
 
 class AgenticViewCloseHandler(sublime_plugin.EventListener):
     """
     Close stream when tab (view) closes
     """
+    def on_pre_close(self, view):
+        window = view.window()
+        if window and window.find_output_panel(_reasoning_panel_name(view)):
+            window.destroy_output_panel(_reasoning_panel_name(view))
+
     def on_close(self, view):
+        if _is_last_view(view):  # the per-buffer state goes with it
+            _unwatch_changes(view.buffer_id())
+            _PARSE_CACHE.discard(view.buffer_id())
+            _RAW_TURNS.discard(view)
+        _PREFETCHER.discard(view)
         if view.settings().get("agentic_is_streaming"):
             task = _ACTIVE_STREAMERS.get(view.id())
             if task:
@@ -672,43 +4289,117 @@ class AgenticViewCloseHandler(sublime_plugin.EventListener):
                 view.settings().set("agentic_is_streaming", False)
 
 
-def _update_sanitize_dict():
-    global _LAST_SANITIZE_DICT_RAW
-    global _SANITIZE_DICT
-    global _SANITIZE_RE
-
-    all_sanitize = sublime.load_settings("Agentic.sublime-settings").get("sanitize_dict")
-    # {canonical: [look-alikes]}
-
-    # Do nothing if dict is the same.
-    if _LAST_SANITIZE_DICT_RAW is not None \
-            and all_sanitize == _LAST_SANITIZE_DICT_RAW:
-        return
-
-    _SANITIZE_DICT = {}
-    for _canonical, _alts in all_sanitize.items():
-        for _ch in _alts:
-            _SANITIZE_DICT[_ch] = _canonical
-
-    _SANITIZE_RE = re.compile(
-        "|".join(sorted(map(re.escape, _SANITIZE_DICT), key=len, reverse=True))
-    )
-    _LAST_SANITIZE_DICT_RAW = all_sanitize
+class _Sanitizer(object):
+    """
+    Compiled form of `sanitize_dict` ({look-alike: canonical}).
+    Single-character look-alikes are replaced by one `str.translate`
+    table; multi-character ones (keycaps, ...) by a longest-first
+    alternation whose gaps go through the table. Text without any
+    candidate character is returned after a single regex scan.
+    Produces exactly what one longest-first regex over all keys would.
+    """
+    def __init__(self, mapping):
+        self.table = dict((ord(k), v) for k, v in mapping.items()
+                          if len(k) == 1 and k != v)
+        self.multi = dict((k, v) for k, v in mapping.items() if len(k) > 1)
+        firsts = set(map(chr, self.table)) | set(k[0] for k in self.multi)
+        self._candidates = re.compile("[{}]".format("".join(
+            map(re.escape, sorted(firsts))))) if firsts else None
+        self._multi_re = re.compile("|".join(sorted(
+            map(re.escape, self.multi), key=len, reverse=True))) \
+            if self.multi else None
+        # Proper prefixes of multi-character look-alikes
+        self.partial = set(k[:i] for k in self.multi for i in range(1, len(k)))
+        self.partial_len = max(map(len, self.partial or [""]))
+
+    def sanitize(self, text):
+        if self._candidates is None or not self._candidates.search(text):
+            return text
+        if self._multi_re is None:
+            return text.translate(self.table)
+        out = []
+        pos = 0
+        for m in self._multi_re.finditer(text):
+            out.append(text[pos:m.start()].translate(self.table))
+            out.append(self.multi[m.group(0)])
+            pos = m.end()
+        if not pos:
+            return text.translate(self.table)
+        out.append(text[pos:].translate(self.table))
+        return "".join(out)
+
+    def sanitize_stream(self, text):
+        """
+        Sanitize a stream chunk. Returns (sanitized, tail) where `tail`
+        is the unresolved end of `text` - a partial multi-character
+        look-alike whose replacement depends on the next chunk - to be
+        prepended to it.
+        """
+        n = len(text)
+        # Positions whose remainder could still grow into a longer match
+        holds = [i for i in range(max(0, n - self.partial_len), n)
+                 if text[i:] in self.partial]
+        if not holds:
+            return self.sanitize(text), ""
+
+        out = []
+        pos = 0
+        for m in self._multi_re.finditer(text):
+            if any(pos <= i <= m.start() for i in holds):
+                break  # the scan reaches an unresolved position first
+            out.append(text[pos:m.start()].translate(self.table))
+            out.append(self.multi[m.group(0)])
+            pos = m.end()
+        cut = min([i for i in holds if i >= pos] or [n])
+        out.append(text[pos:cut].translate(self.table))
+        return "".join(out), text[cut:]
+
+
+def _sanitizer():
+    """Return the compiled sanitizer of the current settings"""
+    return _config().sanitizer
 
 
 def _sanitize_text(text: str) -> str:
     """
     Replace Unicode look-alike in *text* with its ASCII canonical value
     """
-    # `sub` receives each match; we look up the canonical character
-    # in the flat map we built above.
-    return _SANITIZE_RE.sub(lambda m: _SANITIZE_DICT[m.group(0)], text)
+    return _sanitizer().sanitize(text)
+
+
+def _sanitize_stream(text):
+    """See `_Sanitizer.sanitize_stream`"""
+    return _sanitizer().sanitize_stream(text)
+
+
+def _on_settings_changed():
+    global _CONFIG
+    old = _CONFIG
+    _CONFIG = _Config(sublime.load_settings("Agentic.sublime-settings"))
+    if _CONFIG.errors and (old is None or old.errors != _CONFIG.errors):
+        print("Agentic: problems in Agentic.sublime-settings:\n  " +
+              "\n  ".join(_CONFIG.errors))
+        sublime.status_message("Agentic: {} settings problem(s), see the "
+                               "console".format(len(_CONFIG.errors)))
+    _PROFILER.enabled = bool(_CONFIG.get("profile_ui", False))
+
+
+def plugin_loaded():
+    sublime.load_settings("Agentic.sublime-settings").add_on_change(
+        "agentic", _on_settings_changed)
+    _on_settings_changed()
+    threading.Thread(target=_LEDGER.load, daemon=True).start()
+
+
+def plugin_unloaded():
+    sublime.load_settings("Agentic.sublime-settings").clear_on_change(
+        "agentic")
+    _ENGINE.stop()
 
 
 class AgenticSanitizeCommand(sublime_plugin.TextCommand):
     """Sanitize the whole document or the selected text."""
     def run(self, edit):
-        _update_sanitize_dict()
         view = self.view
 
         #  1.  If there is at least one non-empty selection - sanitize it.
@@ -741,14 +4432,13 @@ class AgenticSanitizeCommand(sublime_plugin.TextCommand):
 class AgenticCopyCommand(sublime_plugin.TextCommand):
     """Sanitizes AI outputs (removes extra unicode based on settings)"""
     def run(self, edit):
-        do_clean = sublime.load_settings("Agentic.sublime-settings").get("sanitize_on_copy")
+        do_clean = _config().get("sanitize_on_copy")
 
         # Standard copy if sanitize_on_copy is false
         if not do_clean:
             self.view.run_command("copy")
             return
 
-        _update_sanitize_dict()
         view = self.view
         pieces = []
         for region in view.sel():
@@ -767,7 +4457,7 @@ class AgenticCutCommand(sublime_plugin.TextCommand):
     """Sanitizes AI outputs and cuts the selection (copy + delete)."""
     def run(self, edit):
         # Use the same setting that controls copy sanitization
-        do_clean = sublime.load_settings("Agentic.sublime-settings").get("sanitize_on_copy")
+        do_clean = _config().get("sanitize_on_copy")
 
         # Standard cut if sanitization is disabled
         if not do_clean:
@@ -775,7 +4465,6 @@ class AgenticCutCommand(sublime_plugin.TextCommand):
             return
 
         # Sanitize the selected text and put it on the clipboard
-        _update_sanitize_dict()
         view = self.view
         pieces = []
         for region in view.sel():
@@ -799,3 +4488,6 @@ class AgenticCutCommand(sublime_plugin.TextCommand):
         # Status feedback
         end = "" if len(out) == 1 else "s"
         sublime.status_message("Sanitized + Cut {} character{}".format(len(out), end))
+
+
+_profile_ui_entry_points(globals())